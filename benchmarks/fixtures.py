@@ -0,0 +1,244 @@
+"""
+Fixture networks for the benchmarks, of increasing size, and a small
+synthetic Webnucleo database covering all of them, so the benchmarks run
+offline without the full data files:
+
+    cno          the CNO cycle of test/test_network.py
+    light        the light-element set of test/testRxns.txt
+    alpha        the 13-isotope alpha chain, He4 to Ni56
+    synth500     ~500 species in a band around the valley of stability
+    synth3000    ~3000 species, the same way out to the heaviest elements
+
+The synthetic networks link each nucleus by (p,g), (n,g), (a,g), (a,p)
+and (p,a) to whichever of its neighbours are in the band, and by beta
+decays towards stability.  The data is not real: the mass excesses are
+the measured ones for the light nuclei and the semi-empirical mass
+formula elsewhere, and the rates are non-smoker fits with the right
+Coulomb barriers but made-up strengths; what matters here is that the
+networks have the sizes, sparsity and stiffness of real ones.
+
+    nuc_file, rxn_file = write_database(directory)
+    rxn_strings = networks["alpha"]()
+"""
+import os
+import random
+import numpy as np
+
+from brulilo.util.species import element_lut, isotope_A_ranges
+from brulilo.util.species import isotope_lut, get_Z_A
+from brulilo.util.rxnfile import parse_rxn_string
+from brulilo.util.webnucleo import reaction_key
+
+# measured mass excesses (MeV) of the light nuclei, by (Z, A)
+_mass_excess = {(0, 1): 8.071, (1, 1): 7.289, (1, 2): 13.136,
+                (1, 3): 14.950, (2, 3): 14.931, (2, 4): 2.425,
+                (2, 6): 17.592, (3, 7): 14.907, (4, 7): 15.769,
+                (4, 9): 11.348, (6, 11): 10.650, (6, 12): 0.0,
+                (6, 13): 3.125, (7, 13): 5.346, (7, 14): 2.863,
+                (7, 15): 0.101, (8, 15): 2.855, (8, 16): -4.737,
+                (8, 17): -0.809, (9, 17): 1.952, (10, 20): -7.042,
+                (12, 24): -13.933, (14, 28): -21.493, (16, 32): -26.016,
+                (18, 36): -30.232, (20, 40): -34.846, (22, 44): -37.548,
+                (24, 48): -42.821, (26, 52): -48.332, (28, 56): -53.904}
+
+# the shared T9 grid of the partition-function tables
+_partf_t9 = [0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1., 1.5,
+             2., 2.5, 3., 3.5, 4., 4.5, 5., 6., 7., 8., 9., 10.]
+
+# the CNO cycle, as in test/test_network.py
+_cno = ["C12(p,g)N13", "N13(,e+nu_e)C13", "C13(p,g)N14", "N14(p,g)O15",
+        "O15(,e+nu_e)N15", "N15(p,g)O16", "N15(p,a)C12", "O16(p,g)F17",
+        "F17(,e+nu_e)O17", "O17(p,a)N14"]
+
+_alpha_chain = ["He4", "C12", "O16", "Ne20", "Mg24", "Si28", "S32", "Ar36",
+                "Ca40", "Ti44", "Cr48", "Fe52", "Ni56"]
+
+
+def _light():
+    """
+    The reactions of test/testRxns.txt.
+    """
+    rxn_file = os.path.join(os.path.dirname(__file__), os.pardir, "brulilo",
+                            "test", "testRxns.txt")
+    with open(rxn_file, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _alpha():
+    """
+    Triple-alpha, then (a,g) up the chain to Ni56.
+    """
+    return (["He4(aa,g)C12"] +
+            ["%s(a,g)%s" % pair
+             for pair in zip(_alpha_chain[1:-1], _alpha_chain[2:])])
+
+
+def _name(Z, A):
+    if Z == 0:
+        return "n"
+    return "%s%d" % (element_lut[Z], A)
+
+
+def _stable_A(Z):
+    """
+    The A closest to the valley of stability for this Z, within the
+    isotopes known to brulilo.
+    """
+    A_min, A_max = isotope_A_ranges[Z]
+    A = np.arange(A_min, A_max + 1)
+    return A[np.argmin(np.abs(A / (1.98 + 0.0155 * A**(2./3)) - Z))]
+
+
+def valley_band(Z_max, half_width):
+    """
+    The (Z, A) of the nuclei within half_width in A of the valley of
+    stability, for 1 <= Z <= Z_max, along with n, p and He4.
+    """
+    band = set([(0, 1), (1, 1), (2, 4)])
+    for Z in range(1, Z_max + 1):
+        A_min, A_max = isotope_A_ranges[Z]
+        A_stable = _stable_A(Z)
+        band.update((Z, A) for A in range(max(A_min, A_stable - half_width),
+                                          min(A_max, A_stable + half_width)
+                                          + 1))
+    return band
+
+
+def _band_reactions(band):
+    """
+    The reaction strings linking the nuclei of band.
+    """
+    stable = dict((Z, _stable_A(Z)) for Z, A in band if Z > 0)
+    rxns = []
+    for Z, A in sorted(band):
+        if Z < 2 or (Z, A) == (2, 4):
+            continue
+        target = _name(Z, A)
+        for projectile, ejectile, dZ, dA in [("p", "g", 1, 1),
+                                             ("n", "g", 0, 1),
+                                             ("a", "g", 2, 4),
+                                             ("a", "p", 1, 3),
+                                             ("p", "a", -1, -3)]:
+            if (Z + dZ, A + dA) in band:
+                rxns.append("%s(%s,%s)%s" % (target, projectile, ejectile,
+                                             _name(Z + dZ, A + dA)))
+        # beta decays towards the valley
+        if A > stable[Z] and (Z + 1, A) in band:
+            rxns.append("%s(,e-nu_e_bar)%s" % (target, _name(Z + 1, A)))
+        elif A < stable[Z] and (Z - 1, A) in band:
+            rxns.append("%s(,e+nu_e)%s" % (target, _name(Z - 1, A)))
+    return rxns
+
+
+def _synth500():
+    return _band_reactions(valley_band(40, 6))
+
+
+def _synth3000():
+    return _band_reactions(valley_band(100, 15))
+
+
+# the fixture networks, by name, in order of size; each builds the list of
+# reaction strings
+network_names = ["cno", "light", "alpha", "synth500", "synth3000"]
+networks = {"cno": lambda: list(_cno),
+            "light": _light,
+            "alpha": _alpha,
+            "synth500": _synth500,
+            "synth3000": _synth3000}
+
+
+def _mass_excess_of(Z, A):
+    """
+    The mass excess (MeV), measured or from the semi-empirical mass
+    formula.
+    """
+    if (Z, A) in _mass_excess:
+        return _mass_excess[(Z, A)]
+    N = A - Z
+    binding = (15.75*A - 17.8*A**(2./3) - 0.711*Z*(Z - 1)/A**(1./3) -
+               23.7*(N - Z)**2/float(A))
+    if A % 2 == 0:
+        binding += (1 if Z % 2 == 0 else -1) * 11.18/np.sqrt(A)
+    return Z*_mass_excess[(1, 1)] + N*_mass_excess[(0, 1)] - binding
+
+
+def _non_smoker_fit(reactants, weak, rng):
+    """
+    A made-up fit, with the Coulomb barrier of the first two of the
+    (sanitized) reactants; weak reactions are made much slower.
+    """
+    fit = [rng.uniform(9, 17) - 25*(len(reactants) - 2) - 20*weak, 0., 0.,
+           0., 0., 0., 0.]
+    if len(reactants) > 1:
+        (Z1, A1), (Z2, A2) = [get_Z_A(r) for r in reactants[:2]]
+        if Z1*Z2:
+            fit[0] += 5
+            fit[2] = -4.2487*(Z1**2*Z2**2*A1*A2/float(A1 + A2))**(1./3)
+            fit[6] = -2./3
+    return fit
+
+
+def write_database(directory, names=None, seed=1):
+    """
+    Write the synthetic Webnucleo nuclide and reaction XML files for the
+    fixture networks names (default: all of them) into directory, and
+    return their paths.  Every reaction is stored in the direction it is
+    written in, except photodisintegrations, which are stored as the
+    captures they are the reverse of.
+    """
+    if names is None:
+        names = network_names
+    rng = random.Random(seed)
+    nuclides = set([(0, 1), (1, 1)])
+    reactions = {}
+    for name in names:
+        for rxnString in networks[name]():
+            spec = parse_rxn_string(rxnString)
+            reactants, products = spec.reactants, spec.products
+            if "gamma" in reactants:
+                reactants, products = products, reactants
+            for species in reactants + products:
+                if species in isotope_lut:
+                    nuclides.add(get_Z_A(species))
+            reactions.setdefault(reaction_key(reactants, products),
+                                 reactants)
+
+    nuc_file = os.path.join(directory, "nuclear_data.xml")
+    with open(nuc_file, 'w') as f:
+        f.write('<nuclear_data>\n')
+        for Z, A in sorted(nuclides):
+            f.write('<nuclide><z>%d</z><a>%d</a><source>bench</source>'
+                    '<mass_excess>%r</mass_excess><spin>%g</spin>' %
+                    (Z, A, _mass_excess_of(Z, A), 0.5*(A % 2)))
+            if A > 4:
+                scale = rng.uniform(0, 2e-3)
+                f.write('<partf_table>' + ''.join(
+                    '<point><t9>%g</t9><log10_partf>%r</log10_partf>'
+                    '</point>' % (t9, scale*t9**2) for t9 in _partf_t9) +
+                    '</partf_table>')
+            f.write('</nuclide>\n')
+        f.write('</nuclear_data>\n')
+
+    rxn_file = os.path.join(directory, "reaction_data.xml")
+    with open(rxn_file, 'w') as f:
+        f.write('<reaction_data>\n')
+        for key in sorted(reactions):
+            reactants, products = key
+            f.write('<reaction><source>bench</source>' +
+                    ''.join('<reactant>%s</reactant>' % r
+                            for r in reactants) +
+                    ''.join('<product>%s</product>' % p for p in products))
+            if len(reactants) == 1:
+                # a decay, with a half-life of a second to an hour
+                f.write('<single_rate>%r</single_rate>' %
+                        (np.log(2) / 10**rng.uniform(0, 3.5)))
+            else:
+                f.write('<non_smoker_fit><fit>' + ''.join(
+                    '<a%d>%r</a%d>' % (i + 1, a, i + 1)
+                    for i, a in enumerate(_non_smoker_fit(
+                        reactions[key], "neutrino_e" in products, rng))) +
+                    '</fit></non_smoker_fit>')
+            f.write('</reaction>\n')
+        f.write('</reaction_data>\n')
+    return nuc_file, rxn_file
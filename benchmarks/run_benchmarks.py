@@ -0,0 +1,334 @@
+"""
+Benchmarks of brulilo on the fixture networks of fixtures.py, from the
+CNO cycle up to a ~3000-species network, run offline on a synthetic
+Webnucleo database written to a scratch directory.  Timed are:
+
+    load_xml       compiling the database XML into its arrays
+    load_cache     loading the same arrays from the .npz cache
+    construct      Network.from_rxn_strings, from scratch
+    rates_scalar   Network.rates at one temperature and density
+    rates_batched  Network.rates for a batch of zones at once
+    rhs            Stoichiometry.rhs, with the rates already evaluated
+    jacobian       Stoichiometry.jacobian, likewise
+    burn           Network.burn, at the conditions of _burn_conditions
+
+The two load stages cover the whole database, so they are only run once.
+Each stage is called often enough to take at least --min-time seconds,
+--repeat times over (or fewer, for stages slow enough to take more than
+--max-time seconds in all), and the best and median time per call are
+kept.
+The results are written as JSON, along with the commit they were run on,
+so that runs can be compared (brulilo must be importable, either
+installed or with the repository on PYTHONPATH):
+
+    python benchmarks/run_benchmarks.py --output before.json
+    ... change something ...
+    python benchmarks/run_benchmarks.py --compare before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import numpy as np
+import scipy
+
+from brulilo import integrators
+from brulilo import Network
+from brulilo.isotope import isotope_registry, species_table
+from brulilo.util.webnucleo import webnucleo
+
+import fixtures
+
+_results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "results")
+
+stage_names = ["load_xml", "load_cache", "construct", "rates_scalar",
+               "rates_batched", "rhs", "jacobian", "burn"]
+
+# a stage this much slower than in the run it is compared to is flagged
+_regression = 1.2
+
+
+def time_stage(function, repeat=5, min_time=0.2, max_time=60.):
+    """
+    Time function(), calling it number times in each of repeat runs, with
+    number the smallest power of 10 for which a run takes min_time.  Slow
+    stages are run fewer times, so that all the runs together take about
+    max_time at most.
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 10**6:
+            break
+        number *= 10
+    repeat = max(1, min(repeat, int(max_time / elapsed)))
+    times = [elapsed] + timer.repeat(repeat - 1, number)
+    times = np.array(times) / number
+    return {"best": float(times.min()), "median": float(np.median(times)),
+            "number": number, "repeat": repeat}
+
+
+def _reset_database(use_cache):
+    """
+    Drop everything the Webnucleo parser has loaded or derived, so the next
+    lookup reads the database again.
+    """
+    webnucleo._use_cache = use_cache
+    webnucleo._nuc_arrays = None
+    webnucleo._rxn_arrays = None
+    webnucleo._nuclide_index = None
+    webnucleo._reaction_index = None
+    webnucleo._proton_mass_excess = None
+    webnucleo._neutron_mass_excess = None
+
+
+def _load_database():
+    webnucleo.nuc_arrays
+    webnucleo.rxn_arrays
+
+
+def benchmark_database(**timing):
+    """
+    The load stages, on the whole database; timing is passed on to
+    time_stage.
+    """
+    def load_xml():
+        _reset_database(False)
+        _load_database()
+
+    def load_cache():
+        _reset_database(True)
+        _load_database()
+
+    stages = {"load_xml": time_stage(load_xml, **timing)}
+    # write the cache
+    _reset_database(True)
+    _load_database()
+    stages["load_cache"] = time_stage(load_cache, **timing)
+    return stages
+
+
+def _construct(rxn_strings):
+    """
+    A Network built from scratch: the Isotopes are forgotten first, so
+    they are looked up again.
+    """
+    isotope_registry.clear()
+    species_table.__init__()
+    return Network.from_rxn_strings(rxn_strings)
+
+
+def _initial_abundances(network):
+    """
+    Molar abundances of mostly protons and alphas, with the rest of the
+    mass spread evenly over the other species.
+    """
+    names = [str(isotope) for isotope in network.isotopes]
+    X = np.zeros(len(names))
+    for name, fraction in [("H1", 0.3), ("He4", 0.5)]:
+        if name in names:
+            X[names.index(name)] = fraction
+    others = X == 0
+    X[others] = (1 - X.sum()) / others.sum()
+    return X / np.array([isotope.A for isotope in network.isotopes])
+
+
+# temperature (K), density (g/cm^3) and timestep (s) of the burns
+_burn_conditions = (3e9, 1e7, 1e-3)
+
+
+def benchmark_network(rxn_strings, zones=256, method="bdf",
+                      stages=stage_names, **timing):
+    """
+    The per-network stages for the network of rxn_strings; timing is
+    passed on to time_stage.
+    """
+    network = _construct(rxn_strings)
+    results = {"nspecies": len(network.isotopes),
+               "nreactions": len(network.reactions),
+               "stages": {}}
+    timings = results["stages"]
+    if "construct" in stages:
+        timings["construct"] = time_stage(lambda: _construct(rxn_strings),
+                                          **timing)
+        # the species table now belongs to the last one built
+        network = _construct(rxn_strings)
+
+    temperature, density, dt = _burn_conditions
+    Y = _initial_abundances(network)
+    rates = network.rates(temperature, density)
+    stoichiometry = network.stoichiometry
+    zone_T = np.logspace(8.5, 9.7, zones)
+    zone_rho = np.logspace(4, 8, zones)
+    calls = {"rates_scalar": lambda: network.rates(temperature, density),
+             "rates_batched": lambda: network.rates(zone_T, zone_rho),
+             "rhs": lambda: stoichiometry.rhs(Y, rates, density),
+             "jacobian": lambda: stoichiometry.jacobian(Y, rates, density),
+             "burn": lambda: network.burn(Y, temperature, density, dt,
+                                          method=method)}
+    for stage in stage_names:
+        if stage in calls and stage in stages:
+            timings[stage] = time_stage(calls[stage], **timing)
+    return results
+
+
+def _git(*args):
+    try:
+        return subprocess.check_output(
+            ("git",) + args,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, zones=256, method="bdf", stages=stage_names, data_dir=None,
+        **timing):
+    """
+    Run the benchmarks on the fixture networks names, returning the
+    results as a dict, ready to be written as JSON.  The fixture database
+    is written to data_dir (default: a temporary directory), and timing
+    is passed on to time_stage.
+    """
+    results = {"commit": _git("rev-parse", "HEAD"),
+               "describe": _git("describe", "--always", "--dirty"),
+               "date": datetime.datetime.now().isoformat(),
+               "python": platform.python_version(),
+               "numpy": np.__version__,
+               "scipy": scipy.__version__,
+               "platform": platform.platform(),
+               "zones": zones, "method": method,
+               "burn_conditions": _burn_conditions,
+               "database": {}, "networks": {}}
+    tmp_dir = None
+    if data_dir is None:
+        data_dir = tmp_dir = tempfile.mkdtemp(prefix="brulilo-bench-")
+    saved_files = webnucleo._nuc_data_file, webnucleo._rxn_data_file
+    try:
+        webnucleo._nuc_data_file, webnucleo._rxn_data_file = \
+            fixtures.write_database(data_dir)
+        if "load_xml" in stages or "load_cache" in stages:
+            results["database"] = benchmark_database(**timing)
+            _report("database", results["database"])
+        _reset_database(True)
+        for name in names:
+            results["networks"][name] = benchmark_network(
+                fixtures.networks[name](), zones=zones, method=method,
+                stages=stages, **timing)
+            _report("%s (%d species, %d reactions)" %
+                    (name, results["networks"][name]["nspecies"],
+                     results["networks"][name]["nreactions"]),
+                    results["networks"][name]["stages"])
+    finally:
+        webnucleo._nuc_data_file, webnucleo._rxn_data_file = saved_files
+        _reset_database(True)
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def _format_time(seconds):
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= scale:
+            return "%8.3f %-2s" % (seconds / scale, unit)
+    return "%8.3f ns" % (seconds / 1e-9)
+
+
+def _report(title, stages):
+    print title
+    for stage in stage_names:
+        if stage in stages:
+            print "  %-14s best %s   median %s" % (
+                stage, _format_time(stages[stage]["best"]),
+                _format_time(stages[stage]["median"]))
+    sys.stdout.flush()
+
+
+def compare(results, previous):
+    """
+    Print the ratio of each best time in results to the one in previous,
+    flagging the stages that got slower by more than _regression.
+    """
+    print "compared to %s:" % (previous.get("describe") or
+                               previous.get("commit"))
+    pairs = [("database", results["database"], previous["database"])]
+    for name in fixtures.network_names:
+        if name in results["networks"] and name in previous["networks"]:
+            pairs.append((name, results["networks"][name]["stages"],
+                          previous["networks"][name]["stages"]))
+    regressions = 0
+    for title, stages, old_stages in pairs:
+        for stage in stage_names:
+            if stage in stages and stage in old_stages:
+                ratio = stages[stage]["best"] / old_stages[stage]["best"]
+                flag = ""
+                if ratio > _regression:
+                    flag = "  <-- slower"
+                    regressions += 1
+                print "  %-10s %-14s %6.2fx%s" % (title, stage, ratio, flag)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--networks", nargs="+",
+                        choices=fixtures.network_names,
+                        default=fixtures.network_names,
+                        help="the fixture networks to run (default: all)")
+    parser.add_argument("--stages", nargs="+", choices=stage_names,
+                        default=stage_names,
+                        help="the stages to time (default: all)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="timed runs of each stage (default: 5)")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="least duration of each run, in seconds")
+    parser.add_argument("--max-time", type=float, default=60.,
+                        help="most duration of all the runs of a stage, "
+                        "in seconds, unless a single call takes longer")
+    parser.add_argument("--zones", type=int, default=256,
+                        help="zones of the batched rate evaluation")
+    parser.add_argument("--method", default="bdf",
+                        choices=sorted(integrators.methods),
+                        help="integrator of the burns (default: bdf)")
+    parser.add_argument("--data-dir",
+                        help="where to write the fixture database (default:"
+                        " a temporary directory)")
+    parser.add_argument("--output",
+                        help="JSON file for the results (default: "
+                        "results/<commit>.json, next to this script)")
+    parser.add_argument("--compare", metavar="JSON",
+                        help="the results of an earlier run to compare to")
+    args = parser.parse_args(argv)
+
+    results = run(args.networks, zones=args.zones, method=args.method,
+                  stages=args.stages, data_dir=args.data_dir,
+                  repeat=args.repeat, min_time=args.min_time,
+                  max_time=args.max_time)
+
+    output = args.output
+    if output is None:
+        if not os.path.isdir(_results_dir):
+            os.makedirs(_results_dir)
+        output = os.path.join(_results_dir, "%s.json" %
+                              (results["describe"] or "results"))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print "results written to %s" % output
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            if compare(results, json.load(f)):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
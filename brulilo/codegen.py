@@ -0,0 +1,262 @@
+"""
+Python code generated for one Network.  The Stoichiometry evaluates dY/dt
+and the Jacobian of any network with the same few indexed NumPy
+operations, which spend much of their time gathering and scattering
+through the index arrays.  For a fixed network, we can instead write out
+every molar flux, every species' dY/dt and every nonzero Jacobian entry as
+its own straight-line expression, e.g. for the CNO cycle
+
+    k0 = r0 * rho
+    f0 = k0 * y0 * y2
+    ...
+    d2 = -f0 + f6
+    ...
+    j5 = -k0 * y2
+
+and let Python run that.  For a single zone the expressions are on plain
+floats; for a (zones, species) batch the same code runs on the columns.
+Each term costs about as much as a NumPy call does for a whole array, so
+this pays off for small networks (two to three times faster for tens of
+species), while for networks of hundreds of species and more the generic
+kernels are faster.
+
+Generating and compiling the module takes a while for large networks, so
+it is cached on disk, keyed by a hash of the network's reactions and
+stoichiometry and of the generator's version, and later runs just import
+it:
+
+    network.use_generated_kernels()
+    Y = network.burn(Y0, temperature, density, dt)
+
+The rates are arguments of the generated functions, not part of them, so
+the same module serves whatever rate data (or RateTable) is used.
+"""
+import collections
+import hashlib
+import imp
+import os
+import tempfile
+import numpy as np
+
+from stoichiometry import Stoichiometry
+from util.instrument import instrument
+
+_codegen_version = 2
+
+# where the generated modules are cached, unless told otherwise
+cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "brulilo",
+                         "kernels")
+
+# long sums are split over several lines of this many terms, to keep the
+# expressions shallow for the compiler
+_terms_per_line = 32
+
+
+def network_key(stoichiometry, reactions):
+    """
+    The hash identifying the code generated for this Stoichiometry and its
+    list of Reactions.
+    """
+    digest = hashlib.sha1("brulilo codegen %d\n" % _codegen_version)
+    for reaction in reactions:
+        digest.update("%s\n" % reaction)
+    S = stoichiometry.S.tocsr()
+    for array in [S.data, S.indices, S.indptr, stoichiometry.reactant_index,
+                  stoichiometry.dup_factor, stoichiometry.density_power,
+                  stoichiometry.jacobian_pattern.indices,
+                  stoichiometry.jacobian_pattern.indptr]:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def _number(value):
+    if value == int(value):
+        return "%d" % value
+    return repr(float(value))
+
+
+def _product(factors):
+    return " * ".join(factors)
+
+
+def _term(coeff, factors):
+    """
+    coeff times the product of factors, as ' + ...' or ' - ...'.
+    """
+    sign = " - " if coeff < 0 else " + "
+    if abs(coeff) != 1:
+        factors = [_number(abs(coeff))] + factors
+    return sign + _product(factors)
+
+
+def _sum_lines(target, terms, indent="    "):
+    """
+    Lines setting target to the sum of terms (as made by _term), split
+    into chunks of _terms_per_line.
+    """
+    if not terms:
+        return ["%s%s = zero" % (indent, target)]
+    lines = []
+    for start in range(0, len(terms), _terms_per_line):
+        chunk = "".join(terms[start:start + _terms_per_line])
+        # drop the leading ' + ', or make the leading ' - ' a unary minus
+        chunk = chunk[3:] if chunk.startswith(" + ") else "-" + chunk[3:]
+        lines.append("%s%s %s %s" % (indent, target,
+                                     "+=" if start else "=", chunk))
+    return lines
+
+
+def generate_source(stoichiometry, key=""):
+    """
+    The source of the module for stoichiometry: rhs(Y, rates, density)
+    and jacobian_data(Y, rates, density), as Stoichiometry.rhs and the
+    data array of Stoichiometry.jacobian.
+    """
+    nspecies, nrxns = stoichiometry.nspecies, stoichiometry.nrxns
+    reactants = [[k for k in row if k < nspecies]
+                 for row in stoichiometry.reactant_index.tolist()]
+    powers = sorted(set(stoichiometry.density_power.tolist()) - set([0]))
+
+    # the rate factors, and the fluxes
+    factors = ["    rho%d = %s" % (p, " * ".join(["rho"] * p))
+               for p in powers]
+    for j in range(nrxns):
+        power = int(stoichiometry.density_power[j])
+        expression = "r%d" % j
+        if power:
+            expression += " * rho%d" % power
+        if stoichiometry.dup_factor[j] != 1:
+            expression += " / %r" % float(stoichiometry.dup_factor[j])
+        factors.append("    k%d = %s" % (j, expression))
+    fluxes = []
+    for j in range(nrxns):
+        fluxes.append("    f%d = %s" % (j, _product(
+            ["k%d" % j] + ["y%d" % k for k in reactants[j]])))
+
+    # dY/dt, by species
+    S = stoichiometry.S.tocsr()
+    derivatives = []
+    for i in range(nspecies):
+        cols = S.indices[S.indptr[i]:S.indptr[i+1]]
+        coeffs = S.data[S.indptr[i]:S.indptr[i+1]]
+        derivatives.extend(_sum_lines("d%d" % i, [
+            _term(coeff, ["f%d" % j]) for j, coeff in zip(cols, coeffs)]))
+
+    # the Jacobian entries, by position in the CSR data array; terms of
+    # the same reaction with the same other reactants (as for the slots of
+    # identical reactants) are combined
+    entries = collections.defaultdict(collections.OrderedDict)
+    for j, slot, coeff, pos in zip(stoichiometry.term_rxn.tolist(),
+                                   stoichiometry.term_slot.tolist(),
+                                   stoichiometry.term_coeff.tolist(),
+                                   stoichiometry.term_pos.tolist()):
+        others = tuple(reactants[j][:slot] + reactants[j][slot+1:])
+        entries[pos][(j, others)] = entries[pos].get((j, others), 0) + coeff
+    nnz = stoichiometry.jacobian_pattern.nnz
+    jacobian = []
+    for pos in range(nnz):
+        jacobian.extend(_sum_lines("j%d" % pos, [
+            _term(coeff, ["k%d" % j] + ["y%d" % k for k in others])
+            for (j, others), coeff in entries[pos].iteritems() if coeff]))
+
+    def _unpack(names, source):
+        if len(names) == 1:
+            return "    %s, = %s" % (names[0], source)
+        return "    %s = %s" % (", ".join(names), source)
+
+    ys = _unpack(["y%d" % i for i in range(nspecies)], "Y")
+    rs = _unpack(["r%d" % j for j in range(nrxns)], "rates")
+    lines = [
+        '"""',
+        "dY/dt and the Jacobian for a network of %d species and %d "
+        "reactions;" % (nspecies, nrxns),
+        "generated by brulilo.codegen, do not edit.",
+        '"""',
+        "import numpy as np",
+        "",
+        "key = %r" % key,
+        "nspecies = %d" % nspecies,
+        "nrxns = %d" % nrxns,
+        "nnz = %d" % nnz,
+        "",
+        "",
+        "def _arguments(Y, rates, density):",
+        "    Y = np.asarray(Y, dtype='float64')",
+        "    rates = np.asarray(rates, dtype='float64')",
+        "    if Y.ndim == 1:",
+        "        return Y.tolist(), rates.tolist(), float(density)",
+        "    return Y.T, rates.T, np.asarray(density, dtype='float64')",
+        "",
+        "",
+        "def rhs(Y, rates, density):",
+        "    Y, rates, rho = _arguments(Y, rates, density)",
+        ys, rs, "    zero = 0.0 * y0"] + factors + fluxes + derivatives + [
+        "    return np.array([%s]).T" % ", ".join(
+            "d%d" % i for i in range(nspecies)),
+        "",
+        "",
+        "def jacobian_data(Y, rates, density):",
+        "    Y, rates, rho = _arguments(Y, rates, density)",
+        ys, rs, "    zero = 0.0 * y0"] + factors + jacobian + [
+        "    return np.array([%s]).T" % ", ".join(
+            "j%d" % pos for pos in range(nnz)),
+        ""]
+    return "\n".join(lines)
+
+
+def load_kernels(stoichiometry, reactions, directory=None):
+    """
+    The generated module for stoichiometry and its Reactions, imported from
+    the cache in directory (default: cache_dir), where it is written
+    first if it isn't there yet.
+    """
+    if directory is None:
+        directory = cache_dir
+    key = network_key(stoichiometry, reactions)
+    name = "brulilo_kernels_%s" % key[:16]
+    path = os.path.join(directory, name + ".py")
+    if os.path.exists(path):
+        instrument.count("codegen_cache_hits")
+        module = imp.load_source(name, path)
+        if getattr(module, "key", None) == key:
+            return module
+    instrument.count("codegen_cache_misses")
+    with instrument.timer("codegen"):
+        source = generate_source(stoichiometry, key)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # written next to its final name, then renamed, so other processes
+        # never see a partly written module
+        fd, tmp_path = tempfile.mkstemp(prefix=".generating-",
+                                        suffix=".py", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(source)
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        return imp.load_source(name, path)
+
+
+class GeneratedStoichiometry(Stoichiometry):
+    def __init__(self, stoichiometry, kernels):
+        """
+        The Stoichiometry stoichiometry, with rhs and jacobian evaluated by
+        the generated module kernels (see load_kernels); the rest is
+        shared with stoichiometry.
+        """
+        self.__dict__.update(stoichiometry.__dict__)
+        self._jacobian = stoichiometry.jacobian_pattern.copy()
+        self.kernels = kernels
+
+    def rhs(self, Y, rates, density):
+        with instrument.timer("rhs"):
+            return self.kernels.rhs(Y, rates, density)
+
+    def jacobian(self, Y, rates, density):
+        with instrument.timer("jacobian"):
+            self._jacobian.data[:] = self.kernels.jacobian_data(Y, rates,
+                                                                density)
+        return self._jacobian
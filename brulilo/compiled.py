@@ -0,0 +1,294 @@
+"""
+A CompiledNetwork is the flat form of a Network: the rate coefficients,
+the stoichiometry and Jacobian-pattern arrays, the Q-values, and the
+species data (including the partition-function tables), all as plain
+NumPy arrays, with none of the Isotope and Reaction objects (and their
+closures) behind them.
+
+A CompiledNetwork is saved as a directory holding one .npy file per array.
+Other processes load it memory-mapped and read-only, so attaching takes
+only milliseconds and the arrays are shared through the page cache,
+however many processes use them.  Putting the directory on a RAM-backed
+filesystem like /dev/shm avoids the disk entirely.
+
+    compiled = CompiledNetwork.from_network(network)
+    compiled.save("/dev/shm/my_network")
+    ...
+    compiled = CompiledNetwork.load("/dev/shm/my_network")
+    Y = compiled.burn(Y0, temperature, density, dt)
+
+The reverse-rate factors are compiled as their detailed-balance
+constants, along with the partition-function tables of the species they
+need, so they are evaluated exactly as by the Network's RateEngine.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sparse
+
+from scipy.interpolate import make_interp_spline
+
+from rates import RateEngine, RateTable
+from stoichiometry import Stoichiometry
+from isotope import species_table
+import integrators
+
+_compiled_version = 4
+
+# the array attributes of the RateEngine and Stoichiometry, exported under
+# these names; the sparse matrices are split into their CSR arrays
+_engine_arrays = ["nsf_rxns", "nsf_starts", "nsf_coeffs", "single_rxns",
+                  "single_rates", "table_rxns", "reverse_rxns", "reverse_weak",
+                  "reverse_log_prefactor", "reverse_qvalue", "reverse_dn"]
+_stoichiometry_arrays = ["dup_factor", "n_reactants", "reactant_index",
+                         "density_power", "qvalue", "neutrino_energy",
+                         "term_rxn", "term_slot", "term_coeff", "term_pos",
+                         "dest_species", "dest_rxn", "dest_coeff",
+                         "dest_slot"]
+_stoichiometry_matrices = ["S", "S_plus", "_jacobian"]
+
+
+class CompiledNetwork(object):
+    def __init__(self, arrays):
+        """
+        arrays is the dict of arrays making up the compiled network, as
+        built by from_network or read by load; they are used in place, not
+        copied.
+        """
+        if int(arrays["version"]) != _compiled_version:
+            errString = ("Compiled network version %d, but we need %d" %
+                         (int(arrays["version"]), _compiled_version))
+            raise RuntimeError(errString)
+        self.arrays = arrays
+        self.species = list(arrays["species_name"])
+        self.rate_engine = _CompiledRateEngine(arrays)
+        self.stoichiometry = _build_stoichiometry(arrays)
+        self.qvalues = self.stoichiometry.qvalue
+        self._rate_table = None
+        if "rate_table_lnT" in arrays:
+            self._rate_table = _build_rate_table(arrays, self.rate_engine)
+
+    @classmethod
+    def from_network(cls, network):
+        """
+        Compile network.  If the network is interpolating its rates from a
+        RateTable, that table is compiled in too.
+        """
+        arrays = {"version": np.array(_compiled_version)}
+        arrays.update(_species_arrays(network.isotopes))
+
+        engine = network.rate_engine
+        for name in _engine_arrays:
+            arrays[name] = getattr(engine, name)
+        arrays["table_offsets"] = np.cumsum(
+            [0] + [len(t9) for t9, lograte in engine.tables])
+        arrays["table_t9"] = np.concatenate(
+            [np.zeros(0)] + [t9 for t9, lograte in engine.tables])
+        arrays["table_lograte"] = np.concatenate(
+            [np.zeros(0)] + [lograte for t9, lograte in engine.tables])
+        # the reverse species, as indices into the species arrays
+        species_index = dict((isotope.id, i)
+                             for i, isotope in enumerate(network.isotopes))
+        arrays["reverse_species"] = np.array(
+            [species_index[i] for i in engine.reverse_species], dtype='int')
+        arrays["reverse_signs_data"] = engine.reverse_signs.data
+        arrays["reverse_signs_indices"] = engine.reverse_signs.indices
+        arrays["reverse_signs_indptr"] = engine.reverse_signs.indptr
+        arrays["reverse_signs_shape"] = np.array(engine.reverse_signs.shape)
+
+        stoichiometry = network.stoichiometry
+        arrays["nspecies"] = np.array(stoichiometry.nspecies)
+        arrays["nrxns"] = np.array(stoichiometry.nrxns)
+        for name in _stoichiometry_arrays:
+            arrays[name] = getattr(stoichiometry, name)
+        for name in _stoichiometry_matrices:
+            matrix = getattr(stoichiometry, name)
+            arrays[name + "_data"] = matrix.data
+            arrays[name + "_indices"] = matrix.indices
+            arrays[name + "_indptr"] = matrix.indptr
+            arrays[name + "_shape"] = np.array(matrix.shape)
+
+        table = network._rate_table
+        if table is not None:
+            arrays["rate_table_lnT"] = table.lnT
+            arrays["rate_table_ln_rate"] = table.ln_rate
+            arrays["rate_table_dln_rate"] = table.dln_rate
+            arrays["rate_table_kind"] = np.array(table.kind)
+            arrays["rate_table_max_error"] = np.array(table.max_error)
+        return cls(arrays)
+
+    def save(self, path):
+        """
+        Write the compiled network to the directory path, replacing it if
+        it exists.  The files are written to a temporary directory next to
+        path first, so readers never see a partly written network.
+        """
+        path = os.path.abspath(path)
+        tmp_path = tempfile.mkdtemp(prefix=".compiling-",
+                                    dir=os.path.dirname(path))
+        try:
+            for name, array in self.arrays.iteritems():
+                np.save(os.path.join(tmp_path, name + ".npy"),
+                        np.asarray(array))
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.rename(tmp_path, path)
+        except:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Attach to the compiled network saved in the directory path; the
+        arrays are memory-mapped read-only, not read in.
+        """
+        arrays = {}
+        for filename in os.listdir(path):
+            if filename.endswith(".npy"):
+                arrays[filename[:-4]] = np.load(os.path.join(path, filename),
+                                                mmap_mode='r')
+        return cls(arrays)
+
+    @property
+    def _rate_source(self):
+        if self._rate_table is not None:
+            return self._rate_table
+        return self.rate_engine
+
+    def rates(self, temperature, density):
+        """
+        Same as Network.rates.
+        """
+        return self._rate_source.rates(temperature, density)
+
+    def rate_derivatives(self, temperature, density):
+        """
+        Same as Network.rate_derivatives.
+        """
+        return self._rate_source.rate_derivatives(temperature, density)
+
+    def rhs(self, Y, temperature, density):
+        """
+        Same as Network.rhs.
+        """
+        return self.stoichiometry.rhs(Y, self.rates(temperature, density),
+                                      density)
+
+    def energy_generation(self, Y, temperature, density):
+        """
+        Same as Network.energy_generation.
+        """
+        return self.stoichiometry.energy_generation(
+            Y, self.rates(temperature, density), density)
+
+    def burn(self, Y0, temperature, density, dt, method="bdf", **options):
+        """
+        Same as Network.burn.
+        """
+        integrator = integrators.methods[method](self, **options)
+        return integrator.integrate(Y0, temperature, density, dt)
+
+    def burn_self_heating(self, Y0, temperature, density, dt, specific_heat,
+                          method="bdf", **options):
+        """
+        Same as Network.burn_self_heating.
+        """
+        integrator = integrators.methods[method](self, **options)
+        return integrator.integrate_self_heating(Y0, temperature, density,
+                                                 dt, specific_heat)
+
+
+class _CompiledRateEngine(RateEngine):
+    def __init__(self, arrays):
+        """
+        A RateEngine working directly on the arrays of a CompiledNetwork.
+        """
+        self.nrxns = int(arrays["nrxns"])
+        for name in _engine_arrays:
+            setattr(self, name, arrays[name])
+        offsets = arrays["table_offsets"]
+        self.tables = [(arrays["table_t9"][start:end],
+                        arrays["table_lograte"][start:end])
+                       for start, end in zip(offsets[:-1], offsets[1:])]
+        self.reverse_signs = sparse.csr_matrix(
+            (arrays["reverse_signs_data"], arrays["reverse_signs_indices"],
+             arrays["reverse_signs_indptr"]),
+            shape=tuple(arrays["reverse_signs_shape"]))
+        self.reverse_species = arrays["reverse_species"]
+        # the partition functions of the reverse species
+        self._partf_g = 2*arrays["species_spin"][self.reverse_species] + 1
+        self._partf_t9 = arrays["partf_t9"]
+        self._partf_spline = None
+        if len(self._partf_t9) and len(self.reverse_species):
+            self._partf_spline = make_interp_spline(
+                self._partf_t9,
+                arrays["partf_log10"][self.reverse_species].T, k=3)
+
+    def _partition_functions(self, temperature):
+        """
+        Same as SpeciesTable.partition_functions, from the compiled tables.
+        """
+        if self._partf_spline is None:
+            return self._partf_g * np.ones(temperature.shape + (1,))
+        t9 = np.clip(temperature / 1e9, self._partf_t9.min(),
+                     self._partf_t9.max())
+        return self._partf_g * 10**self._partf_spline(t9)
+
+
+def _species_arrays(isotopes):
+    """
+    The species data of the network, with their partition-function tables
+    on the shared grid partf_t9: partf_log10 is (species, grid).
+    """
+    ids = [isotope.id for isotope in isotopes]
+    partf_t9 = species_table.partf_t9
+    if partf_t9 is None:
+        partf_t9 = np.zeros(0)
+    return {"species_name": np.array([str(isotope) for isotope in isotopes]),
+            "species_Z": species_table.Z[ids],
+            "species_A": species_table.A[ids],
+            "species_state": np.array([isotope.state
+                                       for isotope in isotopes], dtype='S'),
+            "species_mass_excess": species_table.mass_excess[ids],
+            "species_binding_energy": species_table.binding_energy[ids],
+            "species_spin": species_table.spin[ids],
+            "partf_t9": partf_t9,
+            "partf_log10": species_table.partf_log10[ids]}
+
+
+def _build_stoichiometry(arrays):
+    """
+    A Stoichiometry on the arrays of a CompiledNetwork.  Only the data of
+    the Jacobian, which is refilled on each call, is copied.
+    """
+    stoichiometry = Stoichiometry.__new__(Stoichiometry)
+    stoichiometry.nspecies = int(arrays["nspecies"])
+    stoichiometry.nrxns = int(arrays["nrxns"])
+    for name in _stoichiometry_arrays:
+        setattr(stoichiometry, name, arrays[name])
+    for name in _stoichiometry_matrices:
+        data = arrays[name + "_data"]
+        if name == "_jacobian":
+            data = np.array(data)
+        matrix = sparse.csr_matrix((data, arrays[name + "_indices"],
+                                    arrays[name + "_indptr"]),
+                                   shape=tuple(arrays[name + "_shape"]))
+        setattr(stoichiometry, name, matrix)
+    return stoichiometry
+
+
+def _build_rate_table(arrays, engine):
+    """
+    A RateTable on the arrays of a CompiledNetwork.
+    """
+    table = RateTable.__new__(RateTable)
+    table.engine = engine
+    table.kind = str(arrays["rate_table_kind"])
+    table.lnT = arrays["rate_table_lnT"]
+    table.dlnT = table.lnT[1] - table.lnT[0]
+    table.ln_rate = arrays["rate_table_ln_rate"]
+    table.dln_rate = arrays["rate_table_dln_rate"]
+    table.max_error = float(arrays["rate_table_max_error"])
+    return table
@@ -0,0 +1,23 @@
+"""
+Stiff integrators for burning a Network: each takes the Network and evolves
+initial molar abundances at a given temperature and density.  The implicit
+ones (BackwardEuler, BDF, Rosenbrock) use the Network's sparse Jacobian and
+a sparse LU factorization; the explicit ones (Asymptotic, QSS) only need
+the production and destruction terms, so are cheaper per step for very
+large networks.
+
+    from brulilo.integrators import BDF
+    Y = BDF(network, rtol=1e-6).integrate(Y0, temperature, density, dt)
+"""
+from base import Integrator, NetworkSystem, SelfHeatingSystem
+from backward_euler import BackwardEuler
+from bdf import BDF
+from rosenbrock import Rosenbrock
+from explicit import Asymptotic, QSS
+
+# the integrators by name, for Network.burn
+methods = {"asymptotic": Asymptotic,
+           "backward_euler": BackwardEuler,
+           "bdf": BDF,
+           "qss": QSS,
+           "rosenbrock": Rosenbrock}
@@ -0,0 +1,67 @@
+"""
+First-order implicit (backward) Euler, with a Newton iteration for each
+step and step-size control from an estimate of the local truncation error.
+"""
+import numpy as np
+
+from base import Integrator, lu_solver, rms_norm
+
+
+class BackwardEuler(Integrator):
+    # Newton iterations allowed per step, and the convergence threshold on
+    # the scaled size of the Newton updates
+    _newton_maxiter = 6
+
+    def _solve(self, system, y, t_end):
+        lu = lu_solver(system.jacobian_pattern)
+        newton_tol = max(1e-10, min(0.03, self.rtol**0.5))
+        f = self._rhs(system, y)
+        h = self._initial_step(y, f, t_end)
+        t = 0.0
+        while t < t_end:
+            self._check_step(h, t, t_end)
+            h = min(h, t_end - t)
+            self._factor(lu, self._jacobian(system, y), 1. / h)
+            converged, y_new, f_new = self._newton(system, lu, y, h,
+                                                   newton_tol)
+            if not converged:
+                self._reject_step()
+                h *= 0.25
+                continue
+            # the local truncation error is h^2/2 y'', and h y'' is about
+            # the change in f over the step
+            scale = self._scale(y, y_new)
+            error_norm = rms_norm(0.5 * h * (f_new - f) / scale)
+            if error_norm > 1:
+                self._reject_step()
+                h = self._next_step(h, error_norm, 1)
+                continue
+            self._count_step(t, t_end)
+            t += h
+            y, f = y_new, f_new
+            h = self._next_step(h, error_norm, 1)
+        return y
+
+    def _newton(self, system, lu, y, h, newton_tol):
+        """
+        Solve y_new = y + h f(y_new), starting from y; (I/h - J) is already
+        factored.  Returns whether this converged, y_new and f(y_new).
+        """
+        y_new = y.copy()
+        scale = self._scale(y)
+        dy_norm_old = None
+        for k in range(self._newton_maxiter):
+            self.stats["newton_iterations"] += 1
+            f_new = self._rhs(system, y_new)
+            dy = lu.solve(f_new - (y_new - y) / h)
+            dy_norm = rms_norm(dy / scale)
+            y_new += dy
+            if not np.all(np.isfinite(y_new)):
+                break
+            if dy_norm < newton_tol:
+                return True, y_new, self._rhs(system, y_new)
+            if dy_norm_old is not None and dy_norm > dy_norm_old:
+                # diverging
+                break
+            dy_norm_old = dy_norm
+        return False, y, None
@@ -0,0 +1,382 @@
+"""
+The machinery shared by the integrators: the systems of equations being
+integrated (at a fixed temperature, or self-heating), the sparse and
+dense LU solvers, and the Integrator base class with its error norm and step-size
+selection.
+"""
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.linalg import splu
+from scipy.linalg.lapack import dgetrf, dgetrs
+
+from ..util.instrument import instrument, clock
+
+
+class NetworkSystem(object):
+    def __init__(self, network, temperature, density):
+        """
+        dY/dt, and its Jacobian, for the abundances of a Network burning at
+        a fixed temperature and density.  As neither changes, the rates are
+        only evaluated once.
+        """
+        self.stoichiometry = network.stoichiometry
+        self.rates = network.rates(temperature, density)
+        self.density = density
+        self.size = self.stoichiometry.nspecies
+
+    @property
+    def jacobian_pattern(self):
+        return self.stoichiometry.jacobian_pattern
+
+    def rhs(self, y):
+        return self.stoichiometry.rhs(y, self.rates, self.density)
+
+    def jacobian(self, y):
+        return self.stoichiometry.jacobian(y, self.rates, self.density)
+
+    def production_destruction(self, y):
+        return self.stoichiometry.production_destruction(y, self.rates,
+                                                         self.density)
+
+
+class SelfHeatingSystem(object):
+    def __init__(self, network, density, specific_heat):
+        """
+        dY/dt and the temperature equation
+
+            dT/dt = (eps_nuc - eps_nu) / c_v
+
+        for a Network burning at a fixed density, with the temperature
+        (the last element of the state) heated by the burning.
+        specific_heat is c_v, in erg/g/K, taken to be constant.  The
+        rates, and their temperature derivatives, are evaluated for each
+        new temperature.
+        """
+        self.network = network
+        self.stoichiometry = network.stoichiometry
+        self.density = density
+        self.specific_heat = specific_heat
+        nspecies = self.stoichiometry.nspecies
+        self.size = nspecies + 1
+        self._T = None
+
+        # the Jacobian adds a full last row and column to that of the
+        # species; the last column comes last in each row
+        pattern = self.stoichiometry.jacobian_pattern
+        rows = np.repeat(np.arange(nspecies), np.diff(pattern.indptr))
+        self._species_pos = np.arange(pattern.nnz) + rows
+        self._column_pos = pattern.indptr[1:] + np.arange(nspecies)
+        self._row_pos = pattern.nnz + nspecies + np.arange(nspecies + 1)
+        indices = np.empty(pattern.nnz + 2*nspecies + 1, dtype=np.int32)
+        indices[self._species_pos] = pattern.indices
+        indices[self._column_pos] = nspecies
+        indices[self._row_pos] = np.arange(nspecies + 1)
+        indptr = np.append(pattern.indptr + np.arange(nspecies + 1),
+                           len(indices))
+        self._jacobian = sparse.csr_matrix(
+            (np.zeros(len(indices)), indices, indptr),
+            shape=(self.size, self.size))
+
+    @property
+    def jacobian_pattern(self):
+        return self._jacobian
+
+    def _rates(self, T):
+        if T != self._T:
+            self._T = T
+            self._rate_values = self.network.rates(T, self.density)
+            self._rate_derivatives = self.network.rate_derivatives(
+                T, self.density)
+        return self._rate_values, self._rate_derivatives
+
+    def _heating(self, Y, rates):
+        eps_nuc, eps_nu = self.stoichiometry.energy_generation(
+            Y, rates, self.density)
+        return (eps_nuc - eps_nu) / self.specific_heat
+
+    def rhs(self, y):
+        Y, T = y[:-1], y[-1]
+        rates = self._rates(T)[0]
+        return np.append(self.stoichiometry.rhs(Y, rates, self.density),
+                         self._heating(Y, rates))
+
+    def jacobian(self, y):
+        Y, T = y[:-1], y[-1]
+        rates, derivatives = self._rates(T)
+        data = self._jacobian.data
+        data[self._species_pos] = self.stoichiometry.jacobian(
+            Y, rates, self.density).data
+        # dY/dt is linear in the rates, and so is eps_nuc
+        data[self._column_pos] = self.stoichiometry.rhs(Y, derivatives,
+                                                        self.density)
+        data[self._row_pos[:-1]] = (
+            self.stoichiometry.heating_gradient(Y, rates, self.density) /
+            self.specific_heat)
+        data[self._row_pos[-1]] = self._heating(Y, derivatives)
+        return self._jacobian
+
+    def production_destruction(self, y):
+        Y, T = y[:-1], y[-1]
+        rates = self._rates(T)[0]
+        production, destruction = self.stoichiometry.production_destruction(
+            Y, rates, self.density)
+        heating = self._heating(Y, rates)
+        return (np.append(production, max(heating, 0.0)),
+                np.append(destruction, max(-heating, 0.0) / T))
+
+
+class SparseLU(object):
+    # a diagonal entry is kept as the pivot unless some other entry of its
+    # column is more than 1/pivot_threshold times larger, so that row
+    # pivoting rarely undoes the ordering
+    pivot_threshold = 0.01
+
+    def __init__(self, pattern):
+        """
+        Factors and solves (shift*I - J) for Jacobians J that all share the
+        CSR sparsity pattern pattern, which must include the diagonal.
+
+        SuperLU, through scipy, always redoes its symbolic analysis, so the
+        fill-reducing ordering is instead worked out once here: a minimum
+        degree ordering on the pattern of J + J^T, which SuperLU computes
+        for a stand-in matrix with this pattern.  It is applied
+        symmetrically, along with a precomputed map from J's data array to
+        the permuted CSC matrix handed to splu, which then keeps the
+        ordering as it is.
+        """
+        n = pattern.shape[0]
+        # tag each entry of the pattern with its position, and see where
+        # the tags land after permuting
+        tagged = sparse.csr_matrix((np.arange(1, pattern.nnz + 1,
+                                              dtype='float64'),
+                                    pattern.indices, pattern.indptr),
+                                   shape=pattern.shape)
+        # any diagonally dominant matrix with the pattern will do
+        stand_in = sparse.csc_matrix(tagged) + n * pattern.nnz * sparse.eye(n)
+        self.perm = np.argsort(splu(stand_in.tocsc(),
+                                    permc_spec="MMD_AT_PLUS_A",
+                                    diag_pivot_thresh=0.,
+                                    options=dict(SymmetricMode=True)).perm_c)
+        self.iperm = np.argsort(self.perm)
+        permuted = tagged[self.perm][:, self.perm].tocsc()
+        permuted.sort_indices()
+        self.data_map = permuted.data.astype('int') - 1
+        self.matrix = permuted
+        # positions of the diagonal in the permuted matrix
+        columns = np.repeat(np.arange(n), np.diff(permuted.indptr))
+        self.diagonal = np.flatnonzero(columns == permuted.indices)
+        if len(self.diagonal) != n:
+            raise ValueError("The Jacobian pattern must include the diagonal")
+        self.lu = None
+
+    def factor(self, jacobian, shift):
+        """
+        LU-factor shift*I - jacobian.
+        """
+        with instrument.timer("lu"):
+            self.matrix.data = -jacobian.data[self.data_map]
+            self.matrix.data[self.diagonal] += shift
+            self.lu = splu(self.matrix, permc_spec="NATURAL",
+                           diag_pivot_thresh=self.pivot_threshold)
+
+    def solve(self, b):
+        with instrument.timer("lu_solve"):
+            return self.lu.solve(b[self.perm])[self.iperm]
+
+
+class DenseLU(object):
+    def __init__(self, pattern):
+        """
+        The same as SparseLU, but factoring a dense copy of the matrix with
+        LAPACK.  For small networks, like the 13-isotope alpha chain, this
+        is several times faster than SuperLU, whose setup costs dominate.
+        """
+        n = pattern.shape[0]
+        self.size = n
+        self.rows = np.repeat(np.arange(n), np.diff(pattern.indptr))
+        self.columns = pattern.indices
+        self.lu = None
+
+    def factor(self, jacobian, shift):
+        """
+        LU-factor shift*I - jacobian.
+        """
+        with instrument.timer("lu"):
+            matrix = np.zeros((self.size, self.size))
+            matrix[self.rows, self.columns] = -jacobian.data
+            matrix.flat[::self.size + 1] += shift
+            lu, pivots, info = dgetrf(matrix, overwrite_a=True)
+            if info > 0:
+                raise RuntimeError("Factor is exactly singular")
+            self.lu = lu, pivots
+
+    def solve(self, b):
+        with instrument.timer("lu_solve"):
+            return dgetrs(self.lu[0], self.lu[1], b)[0]
+
+
+# networks up to this size are factored with DenseLU, and larger ones with
+# SparseLU
+dense_lu_size = 64
+
+
+def lu_solver(pattern):
+    """
+    A DenseLU or SparseLU, depending on the size of the pattern.
+    """
+    if pattern.shape[0] <= dense_lu_size:
+        return DenseLU(pattern)
+    return SparseLU(pattern)
+
+
+def rms_norm(x):
+    return np.sqrt(np.dot(x, x) / x.size)
+
+
+class Integrator(object):
+    # step-size changes are bounded by these factors
+    _min_factor = 0.2
+    _max_factor = 5.0
+    _safety = 0.9
+
+    def __init__(self, network, rtol=1e-6, atol=1e-12, first_step=None,
+                 max_steps=100000):
+        """
+        network is the Network to burn.  rtol and atol are the relative
+        and absolute tolerances on the molar abundances, first_step an
+        optional initial timestep (otherwise one is estimated), and
+        max_steps the number of steps after which we give up.
+        """
+        self.network = network
+        self.rtol = rtol
+        self.atol = atol
+        self.first_step = first_step
+        self.max_steps = max_steps
+        self.stats = {}
+
+    def integrate(self, Y0, temperature, density, t_end):
+        """
+        Burn the molar abundances Y0 at this temperature and density for a
+        time t_end, returning the final abundances.  Counters for the work
+        done are left in self.stats.
+        """
+        return self.solve(NetworkSystem(self.network, temperature, density),
+                          Y0, t_end)
+
+    def integrate_self_heating(self, Y0, temperature, density, t_end,
+                               specific_heat):
+        """
+        Same as integrate, but with the temperature heated by the burning
+        (see SelfHeatingSystem), starting from temperature; returns the
+        final abundances and temperature.
+        """
+        y = self.solve(SelfHeatingSystem(self.network, density,
+                                         specific_heat),
+                       np.append(Y0, temperature), t_end)
+        return y[:-1], y[-1]
+
+    def solve(self, system, y0, t_end):
+        """
+        Integrate dy/dt = system.rhs(y) from y0 over a time t_end.  system
+        also provides jacobian(y), returning a sparse matrix with the
+        structure of system.jacobian_pattern, for the implicit methods,
+        and production_destruction(y), returning F+ and k with
+        dy/dt = F+ - k y, for the explicit ones.
+        """
+        self.stats = dict(steps=0, rejected_steps=0, rhs_evaluations=0,
+                          jacobian_evaluations=0, lu_factorizations=0,
+                          newton_iterations=0)
+        y = np.array(y0, dtype='float64')
+        if t_end <= 0:
+            return y
+        try:
+            with instrument.timer("burn"):
+                return self._solve(system, y, float(t_end))
+        finally:
+            # the work of every burn adds up in the instrumentation
+            instrument.count("burns")
+            for name, n in self.stats.iteritems():
+                instrument.count(name, n)
+
+    def _solve(self, system, y, t_end):
+        raise NotImplementedError
+
+    # the bookkeeping wrappers around the system
+    def _rhs(self, system, y):
+        self.stats["rhs_evaluations"] += 1
+        return system.rhs(y)
+
+    def _production_destruction(self, system, y):
+        self.stats["rhs_evaluations"] += 1
+        return system.production_destruction(y)
+
+    def _jacobian(self, system, y):
+        self.stats["jacobian_evaluations"] += 1
+        return system.jacobian(y)
+
+    def _factor(self, lu, jacobian, shift):
+        self.stats["lu_factorizations"] += 1
+        lu.factor(jacobian, shift)
+
+    def _scale(self, *ys):
+        return self.atol + self.rtol * np.max(np.abs(ys), axis=0)
+
+    def _initial_step(self, y, f, t_end):
+        """
+        A first guess at the timestep: 1% of the time for the solution to
+        change by its own (scaled) size.
+        """
+        if self.first_step is not None:
+            return min(self.first_step, t_end)
+        scale = self._scale(y)
+        d0 = rms_norm(y / scale)
+        d1 = rms_norm(f / scale)
+        if d0 < 1e-5 or d1 < 1e-5:
+            h = 1e-6 * t_end
+        else:
+            h = 0.01 * d0 / d1
+        return min(h, t_end)
+
+    def _next_step(self, h, error_norm, order):
+        """
+        The new timestep after a step of size h with this error norm, for a
+        method whose local error goes as h^(order + 1).
+        """
+        if error_norm == 0:
+            factor = self._max_factor
+        else:
+            factor = self._safety * error_norm**(-1. / (order + 1))
+        return h * min(self._max_factor, max(self._min_factor, factor))
+
+    # when the current attempt at a step started, for timing the rejected
+    # ones (see _reject_step)
+    _attempt_start = None
+
+    def _check_step(self, h, t, t_end):
+        """
+        Called at the start of every attempt at a step; gives up if the
+        step size has become too small.
+        """
+        if instrument.enabled:
+            self._attempt_start = clock()
+        if h < 1e-14 * t_end:
+            errString = ("%s step size fell to %g at t = %g of %g" %
+                         (self.__class__.__name__, h, t, t_end))
+            raise RuntimeError(errString)
+
+    def _reject_step(self):
+        """
+        Count a rejected step, and its time since _check_step as the
+        step_rejects phase.
+        """
+        self.stats["rejected_steps"] += 1
+        if self._attempt_start is not None:
+            instrument.add_time("step_rejects", self._attempt_start, clock())
+
+    def _count_step(self, t, t_end):
+        self.stats["steps"] += 1
+        if self.stats["steps"] > self.max_steps:
+            errString = ("%s took more than %d steps; stopped at t = %g of %g"
+                         % (self.__class__.__name__, self.max_steps, t,
+                            t_end))
+            raise RuntimeError(errString)
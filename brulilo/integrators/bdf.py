@@ -0,0 +1,190 @@
+"""
+A variable-order (1 to 5), variable-step backward differentiation formula
+integrator.  This follows the quasi-constant step size, numerical
+differentiation formula (NDF) scheme of Shampine & Reichelt (1997), as in
+MATLAB's ode15s and scipy's BDF: the solution history is kept as backward
+differences, which are rescaled whenever the step size changes.
+
+The Jacobian and its LU factorization are kept from step to step, and
+only updated when the Newton iteration fails to converge or the step size
+or order changes.
+"""
+import numpy as np
+
+from base import Integrator, lu_solver, rms_norm
+
+MAX_ORDER = 5
+NEWTON_MAXITER = 4
+
+
+def _compute_R(order, factor):
+    """
+    The matrix that rescales the backward differences for a step size
+    change by factor.
+    """
+    I = np.arange(1, order + 1, dtype='float64')[:, np.newaxis]
+    J = np.arange(1, order + 1, dtype='float64')
+    M = np.zeros((order + 1, order + 1))
+    M[1:, 1:] = (I - 1 - factor * J) / I
+    M[0] = 1
+    return np.cumprod(M, axis=0)
+
+
+def _change_D(D, order, factor):
+    R = _compute_R(order, factor)
+    U = _compute_R(order, 1)
+    RU = R.dot(U)
+    D[:order + 1] = np.dot(RU.T, D[:order + 1])
+
+
+class BDF(Integrator):
+    _max_factor = 10.0
+
+    # the NDF modification of the BDF coefficients
+    _kappa = np.array([0, -0.1850, -1./9., -0.0823, -0.0415, 0])
+    _gamma = np.hstack((0, np.cumsum(1. / np.arange(1, MAX_ORDER + 1))))
+    _alpha = (1 - _kappa) * _gamma
+    _error_const = _kappa * _gamma + 1. / np.arange(1, MAX_ORDER + 2)
+
+    def _solve(self, system, y, t_end):
+        lu = lu_solver(system.jacobian_pattern)
+        newton_tol = max(1e-10, min(0.03, self.rtol**0.5))
+        f = self._rhs(system, y)
+        h = self._initial_step(y, f, t_end)
+
+        D = np.zeros((MAX_ORDER + 3, len(y)))
+        D[0] = y
+        D[1] = f * h
+        order = 1
+        n_equal_steps = 0
+        jacobian = self._jacobian(system, y)
+        current_jacobian = True
+        factored_c = None
+        t = 0.0
+
+        while t < t_end:
+            step_accepted = False
+            while not step_accepted:
+                self._check_step(h, t, t_end)
+                if t + h > t_end:
+                    factor = (t_end - t) / h
+                    _change_D(D, order, factor)
+                    h *= factor
+                    n_equal_steps = 0
+
+                y_predict = np.sum(D[:order + 1], axis=0)
+                scale = self._scale(y_predict)
+                psi = (np.dot(D[1:order + 1].T, self._gamma[1:order + 1]) /
+                       self._alpha[order])
+                c = h / self._alpha[order]
+
+                converged = False
+                while not converged:
+                    if factored_c != c:
+                        # factor (I - c J), as (1/c) I - J
+                        self._factor(lu, jacobian, 1. / c)
+                        factored_c = c
+                    converged, n_iter, y_new, d = self._newton(
+                        system, lu, y_predict, c, psi, scale, newton_tol)
+                    if not converged:
+                        if current_jacobian:
+                            break
+                        jacobian = self._jacobian(system, y_predict)
+                        current_jacobian = True
+                        factored_c = None
+
+                if not converged:
+                    self._reject_step()
+                    _change_D(D, order, 0.5)
+                    h *= 0.5
+                    n_equal_steps = 0
+                    continue
+
+                safety = (0.9 * (2 * NEWTON_MAXITER + 1) /
+                          (2 * NEWTON_MAXITER + n_iter))
+                scale = self._scale(y_new)
+                error_norm = rms_norm(self._error_const[order] * d / scale)
+                if error_norm > 1:
+                    self._reject_step()
+                    factor = max(self._min_factor,
+                                 safety * error_norm**(-1. / (order + 1)))
+                    _change_D(D, order, factor)
+                    h *= factor
+                    n_equal_steps = 0
+                else:
+                    step_accepted = True
+
+            self._count_step(t, t_end)
+            n_equal_steps += 1
+            t += h
+            y = y_new
+            # the Jacobian is now from an older step
+            current_jacobian = False
+
+            # update the differences; d is the (order + 1)-th difference
+            D[order + 2] = d - D[order + 1]
+            D[order + 1] = d
+            for i in reversed(range(order + 1)):
+                D[i] += D[i + 1]
+
+            if n_equal_steps < order + 1:
+                continue
+
+            # consider changing the order, and the step size with it
+            if order > 1:
+                error_m = self._error_const[order - 1] * D[order]
+                error_m_norm = rms_norm(error_m / scale)
+            else:
+                error_m_norm = np.inf
+            if order < MAX_ORDER:
+                error_p = self._error_const[order + 1] * D[order + 2]
+                error_p_norm = rms_norm(error_p / scale)
+            else:
+                error_p_norm = np.inf
+            error_norms = np.array([error_m_norm, error_norm, error_p_norm])
+            with np.errstate(divide='ignore'):
+                factors = error_norms**(-1. / np.arange(order, order + 3))
+            order += np.argmax(factors) - 1
+            factor = min(self._max_factor, safety * np.max(factors))
+            _change_D(D, order, factor)
+            h *= factor
+            n_equal_steps = 0
+        return y
+
+    def _newton(self, system, lu, y_predict, c, psi, scale, newton_tol):
+        """
+        Solve the implicit BDF equations for the new solution with a
+        (simplified) Newton iteration, estimating the convergence rate as
+        we go.  Returns whether this converged, the number of iterations,
+        the new solution and its difference d from the prediction.
+        """
+        d = 0
+        y = y_predict.copy()
+        dy_norm_old = None
+        converged = False
+        for k in range(NEWTON_MAXITER):
+            self.stats["newton_iterations"] += 1
+            f = self._rhs(system, y)
+            if not np.all(np.isfinite(f)):
+                break
+            # lu holds (1/c) I - J, i.e. (I - c J) / c
+            dy = lu.solve(f - (psi + d) / c)
+            dy_norm = rms_norm(dy / scale)
+            if dy_norm_old is None:
+                rate = None
+            else:
+                rate = dy_norm / dy_norm_old
+            if (rate is not None and
+                    (rate >= 1 or
+                     rate**(NEWTON_MAXITER - k) / (1 - rate) * dy_norm >
+                     newton_tol)):
+                break
+            y += dy
+            d += dy
+            if (dy_norm == 0 or
+                    rate is not None and
+                    rate / (1 - rate) * dy_norm < newton_tol):
+                converged = True
+                break
+            dy_norm_old = dy_norm
+        return converged, k + 1, y, d
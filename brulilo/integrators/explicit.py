@@ -0,0 +1,83 @@
+"""
+Explicit integrators for stiff networks, which need no Jacobian and no
+linear solve, so the cost of a step is linear in the number of reactions.
+Both work with dY/dt split into production and destruction,
+
+    dY_i/dt = F+_i - k_i Y_i
+
+and take a predictor-corrector step in which each species is advanced by
+
+    Y_i + h (F+_i - k_i Y_i) / (1 + alpha_i h k_i)
+
+with the corrector using averages of the predictor's and the start of
+step's F+ and k.  The two differ only in alpha:
+
+    Asymptotic: alpha = 1 for the stiff species (h k > 1), which then take
+                the asymptotic update (Y + h F+) / (1 + h k), and 1/2 for
+                the rest (Guidry et al. 2013, Mott et al. 2000).
+    QSS:        alpha(h k) interpolates smoothly between the two limits,
+                giving the alpha-QSS method of Mott, Oran & van Leer as in
+                CHEMEQ2.
+
+The difference between the corrector and the predictor is the error
+estimate used to pick the step size.
+"""
+import numpy as np
+
+from base import Integrator, rms_norm
+
+
+class _ExplicitIntegrator(Integrator):
+    def _alpha(self, hk):
+        raise NotImplementedError
+
+    def _update(self, y, h, production, destruction, alpha):
+        return y + h * (production - destruction * y) / \
+            (1 + alpha * h * destruction)
+
+    def _solve(self, system, y, t_end):
+        production, destruction = self._production_destruction(system, y)
+        h = self._initial_step(y, production - destruction * y, t_end)
+        t = 0.0
+        while t < t_end:
+            self._check_step(h, t, t_end)
+            h = min(h, t_end - t)
+            alpha = self._alpha(h * destruction)
+            y_pred = self._update(y, h, production, destruction, alpha)
+            production_pred, destruction_pred = \
+                self._production_destruction(system, y_pred)
+            destruction_avg = 0.5 * (destruction + destruction_pred)
+            alpha_avg = self._alpha(h * destruction_avg)
+            production_avg = (alpha_avg * production_pred +
+                              (1 - alpha_avg) * production)
+            y_new = self._update(y, h, production_avg, destruction_avg,
+                                 alpha_avg)
+            error_norm = rms_norm((y_new - y_pred) / self._scale(y, y_new))
+            if not np.isfinite(error_norm) or error_norm > 1:
+                self._reject_step()
+                h = self._next_step(h, error_norm, 1) \
+                    if np.isfinite(error_norm) else h * self._min_factor
+                continue
+            self._count_step(t, t_end)
+            t += h
+            y = y_new
+            production, destruction = self._production_destruction(system,
+                                                                   y)
+            h = self._next_step(h, error_norm, 1)
+        return y
+
+
+class Asymptotic(_ExplicitIntegrator):
+    def _alpha(self, hk):
+        return np.where(hk > 1, 1.0, 0.5)
+
+
+class QSS(_ExplicitIntegrator):
+    def _alpha(self, hk):
+        # in terms of r = 1/(h k), alpha = (180r^3 + 60r^2 + 11r + 1) /
+        # (360r^3 + 60r^2 + 12r + 1), multiplied through by (h k)^3 so that
+        # h k = 0 is fine
+        hk2 = hk * hk
+        hk3 = hk2 * hk
+        return ((180 + 60*hk + 11*hk2 + hk3) /
+                (360 + 60*hk + 12*hk2 + hk3))
@@ -0,0 +1,62 @@
+"""
+A fourth-order, L-stable Rosenbrock (Kaps-Rentrop) method with an embedded
+third-order error estimate, using Shampine's parameters as in Numerical
+Recipes' stiff().  Each step takes one Jacobian, one LU factorization and
+four linear solves, but no Newton iteration.
+"""
+from base import Integrator, lu_solver, rms_norm
+
+
+class Rosenbrock(Integrator):
+    _gam = 1./2.
+    _a21 = 2.
+    _a31 = 48./25.
+    _a32 = 6./25.
+    _c21 = -8.
+    _c31 = 372./25.
+    _c32 = 12./5.
+    _c41 = -112./125.
+    _c42 = -54./125.
+    _c43 = -2./5.
+    _b1 = 19./9.
+    _b2 = 1./2.
+    _b3 = 25./108.
+    _b4 = 125./108.
+    _e1 = 17./54.
+    _e2 = 7./36.
+    _e3 = 0.
+    _e4 = 125./108.
+
+    def _solve(self, system, y, t_end):
+        lu = lu_solver(system.jacobian_pattern)
+        f = self._rhs(system, y)
+        h = self._initial_step(y, f, t_end)
+        t = 0.0
+        jacobian = self._jacobian(system, y)
+        while t < t_end:
+            self._check_step(h, t, t_end)
+            h = min(h, t_end - t)
+            self._factor(lu, jacobian, 1. / (self._gam * h))
+            g1 = lu.solve(f)
+            f2 = self._rhs(system, y + self._a21*g1)
+            g2 = lu.solve(f2 + self._c21*g1/h)
+            f3 = self._rhs(system, y + self._a31*g1 + self._a32*g2)
+            g3 = lu.solve(f3 + (self._c31*g1 + self._c32*g2)/h)
+            g4 = lu.solve(f3 + (self._c41*g1 + self._c42*g2 +
+                                self._c43*g3)/h)
+            y_new = (y + self._b1*g1 + self._b2*g2 + self._b3*g3 +
+                     self._b4*g4)
+            error = (self._e1*g1 + self._e2*g2 + self._e3*g3 +
+                     self._e4*g4)
+            error_norm = rms_norm(error / self._scale(y, y_new))
+            if error_norm > 1:
+                self._reject_step()
+                h = self._next_step(h, error_norm, 3)
+                continue
+            self._count_step(t, t_end)
+            t += h
+            y = y_new
+            f = self._rhs(system, y)
+            jacobian = self._jacobian(system, y)
+            h = self._next_step(h, error_norm, 3)
+        return y
@@ -1,30 +1,183 @@
 """
 An Isotope is a container holding a species mass, atomic number, etc.
+
+The data of every Isotope lives in the SpeciesTable, species_table, which
+gives each nuclide a dense integer ID when it is first created and keeps
+Z, A, N, spin, mass excess and binding energy in parallel NumPy arrays
+indexed by that ID.  An Isotope is just a light view onto its row, so
+hashing and comparing Isotopes are O(1), and network-level code can index
+the arrays directly with the IDs of its Isotopes.
+
+The Webnucleo partition-function tables all sit on one shared T9 grid, so
+the species table also keeps them as a single (species, grid) array, and
+interpolates them all with a single vector-valued cubic spline.  Its basis
+functions are evaluated once per call, at one temperature or a whole array
+of them, and only the coefficients of the species asked for are used.
 """
 import numpy as np
-from scipy.interpolate import interp1d
+from scipy.interpolate import make_interp_spline, BSpline
 
-from util.species import get_Z_A, element_lut, Zdict
+from util.species import get_Z_A, get_state, element_lut, Zdict
 from util.constants import MeV2erg
 from util.webnucleo import webnucleo
 
+# the Isotopes, by name (see SpeciesTable.registered_name)
 isotope_registry = {}
 
 
+class SpeciesTable(object):
+    # the per-species arrays, with their dtypes
+    _columns = [("Z", 'int32'), ("A", 'int32'), ("N", 'int32'),
+                ("spin", 'float64'), ("mass_excess", 'float64'),
+                ("binding_energy", 'float64')]
+
+    def __init__(self, capacity=64):
+        """
+        The table of all the species created so far.  The arrays (Z, A, N,
+        spin, mass_excess and binding_energy, the latter two in erg) are
+        indexed by species ID; they grow as needed, so don't hold on to
+        them across the creation of new Isotopes.
+        """
+        self.size = 0
+        self.ids = {}
+        self.names = []
+        self.states = []
+        self._data = dict((name, np.zeros(capacity, dtype=dtype))
+                          for name, dtype in self._columns)
+        # the shared T9 grid of the partition-function tables, and each
+        # species' log10(partition function / (2J + 1)) on it
+        self.partf_t9 = None
+        self._partf_rows = []
+        self._partf_log10 = None
+        self._partf_spline = None
+        self._partf_basis = None
+
+    @staticmethod
+    def registered_name(name):
+        """
+        The name a species is registered under; e.g. 'p' and 'H1' are both
+        'H1'.
+        """
+        Z, A = get_Z_A(name)
+        if Z == 0:  # neutron
+            return "n"
+        return "%s%d%s" % (element_lut[Z], A, get_state(name))
+
+    def register(self, name, partf_t9=(), partf_log10=(), **values):
+        """
+        Add the species name, with the given values of the columns and its
+        (partf_t9, partf_log10) partition-function table, if it has one,
+        and return its new ID.
+        """
+        species_id = self.size
+        capacity = len(self._data["Z"])
+        if species_id == capacity:
+            for column, array in self._data.items():
+                self._data[column] = np.concatenate(
+                    [array, np.zeros_like(array)])
+        for column, value in values.iteritems():
+            self._data[column][species_id] = value
+        self.ids[name] = species_id
+        self.names.append(name)
+        self.states.append(get_state(name))
+        self._add_partf_row(np.asarray(partf_t9, dtype='float64'),
+                            np.asarray(partf_log10, dtype='float64'))
+        self.size += 1
+        return species_id
+
+    def _add_partf_row(self, t9, log10):
+        """
+        Put a species' partition-function table onto the shared grid.  The
+        first table seen sets the grid; species without a table get zeros
+        (a partition function of just 2J + 1), and the (unexpected) tables
+        on some other grid are resampled onto it with their own cubic
+        spline.
+        """
+        if not len(t9):
+            row = None
+        elif self.partf_t9 is None:
+            self.partf_t9 = t9
+            row = log10
+        elif (len(t9) == len(self.partf_t9) and
+              np.allclose(t9, self.partf_t9)):
+            row = log10
+        else:
+            spline = make_interp_spline(t9, log10, k=3)
+            row = spline(np.clip(self.partf_t9, t9.min(), t9.max()))
+        self._partf_rows.append(row)
+        self._partf_log10 = None
+        self._partf_spline = None
+
+    @property
+    def partf_log10(self):
+        """
+        The (species, grid) array of log10(partition function / (2J + 1))
+        on the grid partf_t9.
+        """
+        if self._partf_log10 is None:
+            npoints = 0 if self.partf_t9 is None else len(self.partf_t9)
+            self._partf_log10 = np.zeros((self.size, npoints))
+            for species_id, row in enumerate(self._partf_rows):
+                if row is not None:
+                    self._partf_log10[species_id] = row
+        return self._partf_log10
+
+    def partition_functions(self, temperature, ids=None):
+        """
+        The partition functions G(T) of the species with these IDs (all of
+        them by default), at a temperature or an array of temperatures; the
+        result has shape temperature.shape + (len(ids),).  Between the grid
+        points, log10(G) is a cubic spline (the same as an interp1d of kind
+        'cubic'), and it is held constant beyond the ends of the grid.
+        """
+        t9 = np.asarray(temperature, dtype='float64') / 1e9
+        if ids is None:
+            ids = slice(None)
+        g = 2*self.spin[ids] + 1
+        if self.partf_t9 is None:
+            return g * np.ones(t9.shape + (1,))
+        if self._partf_spline is None:
+            self._partf_spline = make_interp_spline(
+                self.partf_t9, self.partf_log10.T, k=3)
+            # the B-spline basis functions themselves, so only the rows of
+            # the species asked for are evaluated
+            self._partf_basis = BSpline(
+                self._partf_spline.t, np.eye(len(self._partf_spline.c)),
+                self._partf_spline.k)
+        t9 = np.clip(t9, self.partf_t9.min(), self.partf_t9.max())
+        return g * 10**np.dot(self._partf_basis(t9),
+                              self._partf_spline.c[:, ids])
+
+    def __getattr__(self, column):
+        # the columns, trimmed to the species registered so far
+        try:
+            return self.__dict__["_data"][column][:self.size]
+        except KeyError:
+            raise AttributeError(column)
+
+
+species_table = SpeciesTable()
+
+
+def _column(name):
+    return property(
+        lambda isotope: species_table._data[name][isotope.id].item(),
+        doc="This Isotope's entry in species_table.%s" % name)
+
+
 class Isotope(object):
+    __slots__ = ["id", "name"]
+
     # some properties for plotting the isotope and it's box
     _width = 0.9
     _label_pad = 0.2
     _box_size = _width - 2*_label_pad
 
     def __new__(cls, name, **kwargs):
-        Z, A = get_Z_A(name)
-        if Z != 0:
-            registered_name = "%s%d" % (element_lut[Z], A)
-        else:  # neutron
-            registered_name = "n"
+        registered_name = SpeciesTable.registered_name(name)
         if registered_name not in isotope_registry:
-            this_isotope = super(Isotope, cls).__new__(cls, name, **kwargs)
+            this_isotope = super(Isotope, cls).__new__(cls)
+            this_isotope._build_nuclear_data(registered_name)
             isotope_registry[registered_name] = this_isotope
 
         return isotope_registry[registered_name]
@@ -33,76 +186,79 @@ class Isotope(object):
         """
         You specify the name of the isotope and the mass as a single string
         (e.g. "He4").  Nuclear properties, like mass_excess, will be looked up
-        in a nuclear data file from ReacLib/Webnucleo.
+        in a nuclear data file from ReacLib/Webnucleo, the first time this
+        isotope is created; after that, the same Isotope is returned.
 
         pbar can be a progressbar instance, useful for ticking along for large
         networks to show progress.
         """
-        self.Z, self.A = get_Z_A(name)
-        self.symbol = element_lut[self.Z]
-        self._plot_nz = np.array([self.A-self.Z,
-                                  self.Z], dtype='int')
-
-        # look up the nuclear data and build the partition function
         if pbar is not None:
             pbar.update(str(self))
-        self._build_nuclear_data()
 
-    def _build_nuclear_data(self):
+    Z = _column("Z")
+    A = _column("A")
+    N = _column("N")
+    spin = _column("spin")
+    mass_excess = _column("mass_excess")
+    binding_energy = _column("binding_energy")
+
+    @property
+    def state(self):
+        # isomeric state, e.g. 'g' or 'm' for Al26; '' for most nuclides
+        return species_table.states[self.id]
+
+    @property
+    def symbol(self):
+        return element_lut[self.Z]
+
+    @property
+    def _plot_nz(self):
+        return np.array([self.N, self.Z], dtype='int')
+
+    def _build_nuclear_data(self, name):
+        self.name = name
+        Z, A = get_Z_A(name)
         # find my entry in the Webnucleo data file
-        my_data = webnucleo.get_isotope_data(self)
-        # mass excess and spin
-        # TODO -- make this work with nuclides with different states like Al26
-        for attr in ["mass_excess", "spin"]:
-            setattr(self, attr, float(my_data.find(attr).text))
+        my_data = webnucleo.find_nuclide(Z, A, get_state(name))
         # binding energy
-        self.binding_energy = (self.Z*webnucleo.proton_mass_excess +
-                               (self.A-self.Z)*webnucleo.neutron_mass_excess -
-                               self.mass_excess)
+        binding_energy = (Z*webnucleo.proton_mass_excess +
+                          (A-Z)*webnucleo.neutron_mass_excess -
+                          my_data.mass_excess)
         # swap to cgs units
-        self.binding_energy *= MeV2erg
-        self.mass_excess *= MeV2erg
-        # get the partition table entry
-        ptable = my_data.find("partf_table")
-        if ptable is None:
-            # partition table data does not exist, so the partition function
-            # is just the number of states of the ground state
-            self.partition_function = lambda temperature: 2*self.spin + 1
-        else:
-            # now the actual data: (t9, log10(f)) pairs, where f is related
-            # to the partition function -- see Webnucleo documentation
-            part_t9 = map(float, [t9.text for t9 in ptable.xpath("point/t9")])
-            part_lf = map(float, [lf.text
-                                  for lf in ptable.xpath("point/log10_partf")])
-            self.partition_function = self._build_partition_function(part_t9,
-                                                                     part_lf)
-
-    def _build_partition_function(self, table_t9, table_logf):
-        fit = interp1d(table_t9, table_logf, kind='cubic')
-        minT9 = min(table_t9)
-        maxT9 = max(table_t9)
-
-        def _part_function(isotope, temperature):
-            t9 = temperature / 1e9
-            # no extrapolation
-            t9 = min(maxt9, max(mint9, t9))
-            return (2*self.spin + 1) * 10**fit(t9)
-
-        return _part_function
+        self.id = species_table.register(
+            name, Z=Z, A=A, N=A-Z, spin=my_data.spin,
+            mass_excess=my_data.mass_excess*MeV2erg,
+            binding_energy=binding_energy*MeV2erg,
+            # (t9, log10(f)) pairs, where f is related to the partition
+            # function -- see Webnucleo documentation; without them, the
+            # partition function is just the number of states of the ground
+            # state
+            partf_t9=my_data.partf_t9, partf_log10=my_data.partf_log10)
 
+    def partition_function(self, temperature):
+        """
+        This Isotope's partition function at temperature (a scalar or an
+        array).  For many Isotopes at once, use
+        species_table.partition_functions.
+        """
+        return species_table.partition_functions(temperature,
+                                                 [self.id])[..., 0]
+
+    # there is only ever one Isotope per species, so identity is equality
     def __hash__(self):
-        # just so we can make a set...
-        return isotope_registry.keys().index(str(self))
+        return self.id
 
-    def __cmp__(self, other):
-        # just so we can make a set...
-        return cmp(hash(self), hash(other))
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
 
     def __str__(self):
-        my_str = self.symbol
-        if my_str != 'n':
-            my_str += str(self.A)
-        return my_str
+        return self.name
+
+    def __repr__(self):
+        return "Isotope(%r)" % self.name
 
     def _plot_build_label(self):
         """
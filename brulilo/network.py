@@ -5,10 +5,18 @@ link the isotopes together.
 import types
 import lxml.etree as etree
 import os.path
+import multiprocessing
+import numpy as np
 
 from reaction import Reaction
 from isotope import Isotope
+from rates import RateEngine, RateTable
+from stoichiometry import Stoichiometry
+from compiled import CompiledNetwork
+import integrators
 from util.progressbar import IntProgressBar
+from util.rxnfile import iter_rxn_specs
+from util.webnucleo import webnucleo
 # import brulilo.util.reaclib as rl
 import brulilo
 
@@ -27,23 +35,58 @@ class Network(object):
             rl.get_rate_data(self)
 #            self._build_rxn_rates()
 
-        for rxn in self.reactions:
-            rxn.update_rxn_vector(self.isotopes)
+        # sort the isotopes in some predictable fashion
+        self.isotopes.sort(key=lambda isotope: (isotope.Z, isotope.A,
+                                                isotope.state))
+        # their rows in isotope.species_table
+        self.species_ids = np.array([isotope.id for isotope in self.isotopes],
+                                    dtype='int')
 
     @classmethod
-    def from_rxn_file(cls, rxn_file):
-        reactions = []
-        with open(rxn_file, 'r') as f:
-            nrxns = sum(1 for line in f)
-        pbar = IntProgressBar('Building rxns and Isotopes', nrxns)
+    def from_rxn_file(cls, rxn_file, progress=False, lazy=False,
+                      subset=False):
+        """
+        Build the Network from a reaction file, with one reaction string
+        per line; see util.rxnfile for the format.  The file is read once,
+        as a stream, skipping comments and duplicate reactions.  If
+        progress, a progress bar is shown while the Reactions are built.
+        lazy and subset are as for from_rxn_strings.
+        """
         with open(rxn_file, 'r') as f:
-            for rxn in f:
-                reactions.append(Reaction(rxn.strip(), pbar=pbar))
-        for reaction in reactions:
-            print str(reaction)
-            print reaction.isotopes
-            print reaction.reactants
-            print reaction.products
+            return cls.from_rxn_strings(f, progress=progress, lazy=lazy,
+                                        subset=subset)
+
+    @classmethod
+    def from_rxn_strings(cls, rxn_strings, progress=False, lazy=False,
+                         subset=False):
+        """
+        Build the Network from an iterable of reaction strings, like
+        "p(p,e+nu_e)d"; the isotopes are those taking part in the
+        reactions.  The rate data of all the reactions is looked up in one
+        batch, before any Reaction is built or, if lazy, when the rates
+        are first needed (see resolve_reactions), so that a Network that
+        is only plotted or printed never looks them up at all.
+
+        If subset, only the records of these reactions and their nuclides
+        are loaded from the Webnucleo data, replacing whatever was loaded
+        before (see WebnucleoDataParser.load_subset); this keeps the
+        memory of processes that only burn this one network small.  Any
+        Network built later that needs more of the data loads all of it
+        again.
+        """
+        specs = list(iter_rxn_specs(rxn_strings))
+        if subset:
+            webnucleo.load_subset(specs)
+        if lazy:
+            all_rate_data = [None] * len(specs)
+        else:
+            all_rate_data = webnucleo.get_rate_data_batch(specs)
+        pbar = None
+        if progress:
+            pbar = IntProgressBar('Building rxns and Isotopes', len(specs))
+        reactions = [Reaction(spec.rxnString, pbar=pbar, spec=spec,
+                              rate_data=rate_data, lazy=lazy)
+                     for spec, rate_data in zip(specs, all_rate_data)]
         isotopes = []
         for reaction in reactions:
             isotopes.extend(reaction.isotopes)
@@ -82,6 +125,211 @@ class Network(object):
         for reaction in self.reactions:
             reaction.build_rxn_rate(rxn_data_root)
 
+    def resolve_reactions(self):
+        """
+        Look up the rate data of all the lazy Reactions that don't have it
+        yet, in one batch, and build their rates; see Reaction.resolve.
+        """
+        unresolved = [reaction for reaction in self.reactions
+                      if not reaction.resolved]
+        if not unresolved:
+            return
+        all_rate_data = webnucleo.get_rate_data_batch(
+            [reaction.spec for reaction in unresolved])
+        for reaction, rate_data in zip(unresolved, all_rate_data):
+            reaction.resolve(rate_data)
+
+    # the vectorized rate evaluation for the whole network; built on first use
+    _rate_engine = None
+
+    @property
+    def rate_engine(self):
+        if self._rate_engine is None:
+            self.resolve_reactions()
+            self._rate_engine = RateEngine(self.reactions)
+        return self._rate_engine
+
+    # when set (see use_rate_table), rates are interpolated from this table
+    _rate_table = None
+
+    def use_rate_table(self, t9_min=1e-2, t9_max=10., points_per_decade=50,
+                       kind="cubic", tolerance=1e-3):
+        """
+        Precompute all the rates on a log(T9) grid and interpolate them from
+        then on, instead of evaluating the fits.  See RateTable for the
+        arguments; the table's largest relative interpolation error is
+        returned.
+        """
+        self._rate_table = RateTable(self.rate_engine, t9_min=t9_min,
+                                     t9_max=t9_max,
+                                     points_per_decade=points_per_decade,
+                                     kind=kind, tolerance=tolerance)
+        return self._rate_table.max_error
+
+    def use_exact_rates(self):
+        """
+        Go back to evaluating the rate fits directly.
+        """
+        self._rate_table = None
+
+    @property
+    def _rate_source(self):
+        if self._rate_table is not None:
+            return self._rate_table
+        return self.rate_engine
+
+    def rates(self, temperature, density):
+        """
+        Returns the array of the rates of all the Reactions, in the order of
+        self.reactions, at this temperature and density.  Given 1-D arrays
+        of temperatures and densities (one per zone), this returns a
+        (zones, reactions) array, computed for all zones at once.
+        """
+        return self._rate_source.rates(temperature, density)
+
+    def rate_derivatives(self, temperature, density):
+        """
+        Same as rates, but for d(rate)/dT.
+        """
+        return self._rate_source.rate_derivatives(temperature, density)
+
+    # the sparse stoichiometry of the network; built on first use
+    _stoichiometry = None
+    # when set (see use_generated_kernels), the same with generated code
+    # for dY/dt and the Jacobian
+    _generated_stoichiometry = None
+
+    @property
+    def stoichiometry(self):
+        if self._generated_stoichiometry is not None:
+            return self._generated_stoichiometry
+        if self._stoichiometry is None:
+            # the Q-values come with the rate data
+            self.resolve_reactions()
+            self._stoichiometry = Stoichiometry(self.isotopes,
+                                                self.reactions)
+        return self._stoichiometry
+
+    def use_generated_kernels(self, cache_dir=None):
+        """
+        Evaluate dY/dt and the Jacobian with Python code generated for this
+        network from then on, instead of the generic indexed kernels; see
+        codegen.  The generated module is cached in cache_dir (default:
+        codegen.cache_dir), and imported from there by later runs.
+        """
+        import codegen
+        stoichiometry = self.stoichiometry
+        kernels = codegen.load_kernels(stoichiometry, self.reactions,
+                                       cache_dir)
+        self._generated_stoichiometry = codegen.GeneratedStoichiometry(
+            stoichiometry, kernels)
+
+    def use_generic_kernels(self):
+        """
+        Go back to the generic kernels for dY/dt and the Jacobian.
+        """
+        self._generated_stoichiometry = None
+
+    def rhs(self, Y, temperature, density):
+        """
+        The time derivatives, dY/dt, of the molar abundances Y of
+        self.isotopes at this temperature and density.  Y may also be a
+        (zones, species) array, with 1-D arrays of temperatures and
+        densities, in which case so is the result.
+        """
+        return self.stoichiometry.rhs(Y, self.rates(temperature, density),
+                                      density)
+
+    def jacobian(self, Y, temperature, density):
+        """
+        The Jacobian d(dY_i/dt)/dY_k of rhs, for a single zone, as a sparse
+        CSR matrix.  Its sparsity pattern is computed once, and the same
+        matrix is refilled on each call.
+        """
+        return self.stoichiometry.jacobian(Y, self.rates(temperature,
+                                                         density),
+                                           density)
+
+    def energy_generation(self, Y, temperature, density):
+        """
+        eps_nuc, the nuclear energy generation rate (erg/g/s), and eps_nu,
+        the part of it lost to neutrinos, for the molar abundances Y at
+        this temperature and density.  As for rhs, Y may be a (zones,
+        species) array, giving (zones,) arrays of both.
+        """
+        return self.stoichiometry.energy_generation(
+            Y, self.rates(temperature, density), density)
+
+    def burn(self, Y0, temperature, density, dt, method="bdf", **options):
+        """
+        Burn the molar abundances Y0 (ordered as self.isotopes) at this
+        temperature and density for a time dt, returning the final
+        abundances.  method names one of brulilo.integrators.methods, and
+        options (rtol, atol, ...) are passed on to it.
+        """
+        integrator = integrators.methods[method](self, **options)
+        return integrator.integrate(Y0, temperature, density, dt)
+
+    def burn_self_heating(self, Y0, temperature, density, dt, specific_heat,
+                          method="bdf", **options):
+        """
+        Same as burn, but with the temperature, starting from temperature,
+        heated by the burning at the constant specific heat specific_heat
+        (erg/g/K); returns the final abundances and temperature.
+        """
+        integrator = integrators.methods[method](self, **options)
+        return integrator.integrate_self_heating(Y0, temperature, density,
+                                                 dt, specific_heat)
+
+    def reducer(self, **options):
+        """
+        A NetworkReducer, which builds (and caches) smaller Networks with
+        only the species and reactions that matter under given
+        conditions; options are passed on to it.
+        """
+        from reduction import NetworkReducer
+        return NetworkReducer(self, **options)
+
+    def compile(self):
+        """
+        The flat CompiledNetwork form of this Network, for sharing with
+        other processes.
+        """
+        return CompiledNetwork.from_network(self)
+
+    def zone_burner(self, method="bdf", processes=None, compiled_path=None,
+                    **options):
+        """
+        A ZoneBurner, which burns many independent zones of this Network
+        on a pool of worker processes that it keeps until it is closed, so
+        a hydro code can use it on every timestep; see zones.ZoneBurner
+        for the arguments.
+        """
+        from zones import ZoneBurner
+        return ZoneBurner(self, method=method, processes=processes,
+                          compiled_path=compiled_path, **options)
+
+    def burn_zones(self, Y0, temperature, density, dt, method="bdf",
+                   processes=None, chunksize=None, compiled_path=None,
+                   **options):
+        """
+        Burn many independent zones, e.g. those of a hydro grid, for a time
+        dt, with a ZoneBurner that is closed again afterwards; see
+        ZoneBurner.burn for Y0, temperature, density and chunksize, and
+        zone_burner for the rest.  Each call starts the worker processes
+        anew, so when burning the same zones over and over, keep a
+        zone_burner instead.
+        """
+        nzones = np.atleast_2d(Y0).shape[0]
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        with self.zone_burner(method=method,
+                              processes=min(processes, nzones),
+                              compiled_path=compiled_path,
+                              **options) as burner:
+            return burner.burn(Y0, temperature, density, dt,
+                               chunksize=chunksize)
+
     def pprint(self):
         print 'Isotopes:'
         for isotope in self.isotopes:
@@ -137,3 +385,4 @@ class Network(object):
         zextent = [min(zs) - general_pad,
                    max(zs) + general_pad + box_width_pad]
         return nextent, zextent
+
@@ -0,0 +1,407 @@
+"""
+Network-wide evaluation of reaction rates.  Rather than calling each
+Reaction's own rate closure, a RateEngine stacks the rate data of all the
+Reactions in a Network into flat arrays, so that every rate is evaluated
+at once with a handful of NumPy operations.
+
+For the non-smoker (ReacLib) fits, the rate of a reaction is
+
+    sum_sets exp(a1 + a2/T9 + a3/T9^(1/3) + a4 T9^(1/3) + a5 T9
+                 + a6 T9^(5/3) + a7 ln(T9))
+
+so all the sets of all the reactions are stacked into one (n_sets, 7)
+coefficient matrix, the seven temperature factors are computed once, and
+the rates come from a single matrix-vector product followed by a segmented
+sum over each reaction's sets.
+
+All the methods take either scalar temperatures and densities, giving an
+array of rates, or 1-D arrays of them (e.g. the zones of a hydro grid),
+giving a (zones, reactions) array of rates; the zones are evaluated
+together, not in a loop.
+
+Reactions whose rate data is for the opposite direction are multiplied by
+their detailed-balance factors.  The temperature-independent parts of
+these (see util.webnucleo.detailed_balance_constants) are worked out once,
+so all the factors come from a few outer products and one sparse product
+with the logs of the partition functions.
+"""
+import numpy as np
+import scipy.sparse as sparse
+
+from isotope import species_table
+from util.constants import boltzmann
+from util.instrument import instrument
+from util.webnucleo import (temperature_factors, detailed_balance_constants,
+                            thermal_log_factor, rate_table_interpolant)
+
+
+class RateEngine(object):
+    def __init__(self, reactions):
+        """
+        reactions is the list of Reactions (with their rate data already
+        built) whose rates we evaluate; rates are returned in this order.
+        """
+        self.nrxns = len(reactions)
+        # non-smoker fits: the sets of reaction nsf_rxns[i] are the rows
+        # nsf_starts[i]:nsf_starts[i+1] of nsf_coeffs
+        nsf_rxns, nsf_starts, nsf_coeffs = [], [], []
+        single_rxns, single_rates = [], []
+        table_rxns, tables = [], []
+        for i, reaction in enumerate(reactions):
+            rate_data = reaction.rate_data
+            if rate_data.rate_type == "non_smoker_fit":
+                nsf_rxns.append(i)
+                nsf_starts.append(len(nsf_coeffs))
+                nsf_coeffs.extend(rate_data.data)
+            elif rate_data.rate_type == "single_rate":
+                single_rxns.append(i)
+                single_rates.append(rate_data.data)
+            else:
+                table_t9, table_rate, table_sef = rate_data.data
+                table_rxns.append(i)
+                tables.append((np.asarray(table_t9),
+                               np.log10(table_rate) + np.log10(table_sef)))
+        self.nsf_rxns = np.array(nsf_rxns, dtype='int')
+        self.nsf_starts = np.array(nsf_starts, dtype='int')
+        self.nsf_coeffs = np.array(nsf_coeffs,
+                                   dtype='float64').reshape(-1, 7)
+        self.single_rxns = np.array(single_rxns, dtype='int')
+        self.single_rates = np.array(single_rates, dtype='float64')
+        self.table_rxns = np.array(table_rxns, dtype='int')
+        self.tables = tables
+
+        # the reverse reactions still need their detailed-balance factors;
+        # the constant parts of all of them are stacked, and the partition
+        # functions come in through the sparse (reverse reactions, species)
+        # matrix of signs, reverse_signs
+        reverse_rxns, reverse_weak = [], []
+        log_prefactors, qvalues, dns = [], [], []
+        species_ids, sign_rows = [], []
+        for i, reaction in enumerate(reactions):
+            if not reaction.is_reverse:
+                continue
+            reverse_rxns.append(i)
+            reverse_weak.append(reaction.is_weak)
+            if reaction.is_weak:
+                log_prefactors.append(0.0)
+                qvalues.append(0.0)
+                dns.append(0)
+                sign_rows.append(([], []))
+                continue
+            constants = detailed_balance_constants(reaction.isotope_reactants,
+                                                   reaction.isotope_products)
+            log_prefactors.append(constants.log_prefactor)
+            qvalues.append(constants.qvalue)
+            dns.append(constants.dn)
+            species_ids.extend(constants.ids)
+            sign_rows.append((constants.ids, constants.signs))
+        self.reverse_rxns = np.array(reverse_rxns, dtype='int')
+        self.reverse_weak = np.array(reverse_weak, dtype='bool')
+        self.reverse_log_prefactor = np.array(log_prefactors,
+                                              dtype='float64')
+        self.reverse_qvalue = np.array(qvalues, dtype='float64')
+        self.reverse_dn = np.array(dns, dtype='float64')
+        # the species_table IDs of the species in the reverse reactions
+        self.reverse_species = np.unique(np.array(species_ids, dtype='int'))
+        rows = np.repeat(np.arange(len(sign_rows)),
+                         [len(ids) for ids, signs in sign_rows])
+        columns = np.searchsorted(self.reverse_species, np.concatenate(
+            [np.zeros(0, dtype='int')] +
+            [np.asarray(ids, dtype='int') for ids, signs in sign_rows]))
+        signs = np.concatenate([np.zeros(0)] +
+                               [signs for ids, signs in sign_rows])
+        # duplicate (row, column) pairs, as for He4 + He4, are summed
+        self.reverse_signs = sparse.csr_matrix(
+            (signs, (rows, columns)),
+            shape=(len(sign_rows), len(self.reverse_species)))
+
+    def forward_rates(self, temperature):
+        """
+        The forward rates of all the reactions at this temperature, or at
+        each of an array of temperatures.
+        """
+        t9 = np.asarray(temperature, dtype='float64') / 1e9
+        # work with reactions along the first axis; transposed at the end
+        rates = np.empty((self.nrxns,) + t9.shape, dtype='float64')
+        if len(self.nsf_rxns):
+            set_rates = np.exp(np.tensordot(self.nsf_coeffs,
+                                            temperature_factors(temperature),
+                                            axes=1))
+            rates[self.nsf_rxns] = np.add.reduceat(set_rates,
+                                                   self.nsf_starts, axis=0)
+        rates[self.single_rxns] = self.single_rates.reshape(
+            (-1,) + (1,)*t9.ndim)
+        for i, table_rate in zip(self.table_rxns, self.table_rates):
+            rates[i] = table_rate(t9)
+        return rates.T
+
+    _table_rates = None
+
+    @property
+    def table_rates(self):
+        """
+        The interpolants of the (t9, log10(rate)) tables, built on first
+        use; the same as those of the Reactions' own rate functions.
+        """
+        if self._table_rates is None:
+            self._table_rates = [rate_table_interpolant(table_t9,
+                                                        table_lograte)
+                                 for table_t9, table_lograte in self.tables]
+        return self._table_rates
+
+    def _partition_functions(self, temperature):
+        """
+        The partition functions of the reverse_species at each of the 1-D
+        array of temperatures, (len(temperature), len(reverse_species)).
+        """
+        return species_table.partition_functions(temperature,
+                                                 self.reverse_species)
+
+    def ln_forward_rates(self, temperature):
+        """
+        ln(forward_rates), at a 1-D array of temperatures, worked out
+        without exponentiating, so that rates too small (or large) for a
+        float keep their logs; each reaction's sets are added up with a
+        log-sum-exp.  Zero rates come back as -inf.
+        """
+        t9 = np.asarray(temperature, dtype='float64') / 1e9
+        ln_rates = np.empty((self.nrxns,) + t9.shape, dtype='float64')
+        if len(self.nsf_rxns):
+            exponents = np.tensordot(self.nsf_coeffs,
+                                     temperature_factors(temperature), axes=1)
+            largest = np.maximum.reduceat(exponents, self.nsf_starts, axis=0)
+            sets = np.repeat(np.arange(len(self.nsf_starts)),
+                             np.diff(np.append(self.nsf_starts,
+                                               len(self.nsf_coeffs))))
+            ln_rates[self.nsf_rxns] = largest + np.log(np.add.reduceat(
+                np.exp(exponents - largest[sets]), self.nsf_starts, axis=0))
+        with np.errstate(divide='ignore'):
+            ln_rates[self.single_rxns] = np.log(self.single_rates).reshape(
+                (-1,) + (1,)*t9.ndim)
+            for i, table_rate in zip(self.table_rxns, self.table_rates):
+                ln_rates[i] = np.log(table_rate(t9))
+        return ln_rates.T
+
+    def ln_reverse_factors(self, temperature):
+        """
+        ln(reverse_factors), at a 1-D array of temperatures; (temperatures,
+        reactions).  The factors of reverse rates whose forward rate is
+        weak come back as -inf.
+        """
+        T = np.asarray(temperature, dtype='float64')
+        ln_factors = np.zeros((len(T), self.nrxns), dtype='float64')
+        if not len(self.reverse_rxns):
+            return ln_factors
+        ln_factor = (self.reverse_log_prefactor +
+                     np.outer(thermal_log_factor(T), self.reverse_dn) +
+                     np.outer(1. / (boltzmann * T), self.reverse_qvalue))
+        if len(self.reverse_species):
+            ln_factor += self.reverse_signs.dot(
+                np.log(self._partition_functions(T)).T).T
+        ln_factor[:, self.reverse_weak] = -np.inf
+        ln_factors[:, self.reverse_rxns] = ln_factor
+        return ln_factors
+
+    def reverse_factors(self, temperature, density):
+        """
+        The detailed-balance factors for all the reactions; unity for
+        reactions that are not reverse rates, and zero for those whose
+        forward rate is weak.  The density cancels out of the factors.
+        """
+        temperature, density = np.broadcast_arrays(
+            np.asarray(temperature, dtype='float64'),
+            np.asarray(density, dtype='float64'))
+        return np.exp(self.ln_reverse_factors(temperature.ravel())).reshape(
+            temperature.shape + (self.nrxns,))
+
+    def rates(self, temperature, density):
+        """
+        The rates of all the reactions at this temperature and density.  For
+        1-D arrays of temperatures and densities, this is a (zones,
+        reactions) array.
+        """
+        instrument.count("rate_evaluations", np.size(temperature))
+        with instrument.timer("rates"):
+            return (self.forward_rates(temperature) *
+                    self.reverse_factors(temperature, density))
+
+    def rate_derivatives(self, temperature, density, delta=1e-5):
+        """
+        d(rate)/dT for all the reactions, by a centered difference in ln(T).
+        """
+        temperature = np.asarray(temperature, dtype='float64')
+        up = self.rates(temperature * np.exp(delta), density)
+        down = self.rates(temperature * np.exp(-delta), density)
+        return (up - down) / (2 * delta * temperature[..., np.newaxis])
+
+
+def interpolate_table(grid, values, slopes, x, kind="cubic"):
+    """
+    Interpolate a table of values, and their slopes, on the uniform grid
+    to the (1-D array) x, which must be within the grid, either linearly
+    (kind="linear") or with cubic Hermite polynomials (kind="cubic").
+    values and slopes are (len(grid), n); returns the interpolated values
+    and slopes, each (len(x), n).
+    """
+    dx = grid[1] - grid[0]
+    k = np.clip(((x - grid[0]) / dx).astype('int'), 0, len(grid) - 2)
+    s = ((x - grid[k]) / dx)[:, np.newaxis]
+    y0, y1 = values[k], values[k+1]
+    if kind == "linear":
+        y = y0 + s*(y1 - y0)
+        dy = slopes[k] + s*(slopes[k+1] - slopes[k])
+    else:
+        m0 = slopes[k] * dx
+        m1 = slopes[k+1] * dx
+        s2 = s*s
+        s3 = s2*s
+        y = ((2*s3 - 3*s2 + 1)*y0 + (s3 - 2*s2 + s)*m0 +
+             (3*s2 - 2*s3)*y1 + (s3 - s2)*m1)
+        dy = ((6*s2 - 6*s)*(y0 - y1) + (3*s2 - 4*s + 1)*m0 +
+              (3*s2 - 2*s)*m1) / dx
+    return y, dy
+
+
+class RateTable(object):
+    # only rates in this range count towards max_error; the rest under- or
+    # overflow once exponentiated, whatever the table says
+    _tiny = 1e-300
+    _huge = 1e300
+    # what the table stores for ln(0), e.g. for the reverse factors of weak
+    # reactions; finite, so that the Hermite polynomials don't give NaN
+    _ln_zero = -1e300
+
+    def __init__(self, engine, t9_min=1e-2, t9_max=10.,
+                 points_per_decade=50, kind="cubic", tolerance=1e-3):
+        """
+        Tabulate the logs of the forward rates and reverse factors of all
+        of the reactions handled by the RateEngine engine on a grid uniform
+        in log(T9), from t9_min to t9_max with points_per_decade points per
+        decade.  The logs are worked out directly (see
+        RateEngine.ln_forward_rates), so even rates far too small for a
+        float are tabulated, and have accurate slopes.  At run time, rates are interpolated in ln(rate) vs. ln(T),
+        either linearly (kind="linear") or with cubic Hermite polynomials
+        built from the tabulated slopes (kind="cubic").  Temperatures
+        outside the table fall back to the exact fits.
+
+        The reverse factors only depend on temperature, so they are
+        tabulated at unit density.
+
+        After building the table, the interpolated rates are compared with
+        the exact fits halfway between grid points, where the
+        interpolation error is largest; the largest relative error, among
+        the rates between _tiny and _huge, is kept as max_error, and a
+        RuntimeError is raised if it is above tolerance.
+        """
+        if kind not in ("linear", "cubic"):
+            raise ValueError("kind must be 'linear' or 'cubic', not %s" %
+                             kind)
+        self.engine = engine
+        self.kind = kind
+        npoints = int(np.ceil(np.log10(t9_max / t9_min) *
+                              points_per_decade)) + 1
+        self.lnT = np.linspace(np.log(t9_min * 1e9), np.log(t9_max * 1e9),
+                               npoints)
+        self.dlnT = self.lnT[1] - self.lnT[0]
+        # values and slopes (d ln / d lnT) of ln(forward) and ln(reverse);
+        # all are (npoints, reactions)
+        self.ln_forward, self.dln_forward = self._tabulate(
+            engine.ln_forward_rates)
+        self.ln_reverse, self.dln_reverse = self._tabulate(
+            engine.ln_reverse_factors)
+        # what actually gets interpolated is the full rate
+        self.ln_rate = self.ln_forward + self.ln_reverse
+        self.dln_rate = self.dln_forward + self.dln_reverse
+
+        # check the interpolation against the exact fits
+        mid_T = np.exp(self.lnT[:-1] + 0.5*self.dlnT)
+        exact = (engine.ln_forward_rates(mid_T) +
+                 engine.ln_reverse_factors(mid_T))
+        table = self._interpolate(np.log(mid_T))[0]
+        significant = ((exact > np.log(self._tiny)) &
+                       (exact < np.log(self._huge)))
+        self.max_error = 0.0
+        if significant.any():
+            self.max_error = np.max(np.abs(np.expm1(
+                table[significant] - exact[significant])))
+        if self.max_error > tolerance:
+            errString = ("Rate table interpolation error %g exceeds the "
+                         "tolerance %g; use more points_per_decade" %
+                         (self.max_error, tolerance))
+            raise RuntimeError(errString)
+
+    def _tabulate(self, ln_function, delta=1e-5):
+        """
+        Values and slopes of ln_function on the grid; the slopes are
+        centered differences in ln(T).  -inf values are stored as _ln_zero,
+        with zero slopes.
+        """
+        T = np.exp(self.lnT)
+        values = ln_function(T)
+        slopes = (ln_function(T * np.exp(delta)) -
+                  ln_function(T * np.exp(-delta))) / (2 * delta)
+        slopes[~np.isfinite(slopes)] = 0.0
+        return np.maximum(values, self._ln_zero), slopes
+
+    def _interpolate(self, lnT):
+        """
+        Interpolated ln(rate) and d ln(rate) / d ln(T) at the (1-D array)
+        lnT, which must be within the table; each is (len(lnT), reactions).
+        """
+        return interpolate_table(self.lnT, self.ln_rate, self.dln_rate, lnT,
+                                 self.kind)
+
+    # the last (temperature, density) evaluated, and its (rates,
+    # derivatives); the integrators ask for the rates and then their
+    # derivatives at the same point
+    _last_key = None
+    _last_result = None
+
+    def _evaluate(self, temperature, density):
+        """
+        Rates and d(rate)/dT, from the table where temperature is inside
+        it and from the exact fits elsewhere.  Both come out of one
+        evaluation, which is kept for the next call at the same
+        temperature and density.
+        """
+        temperature, density = np.broadcast_arrays(
+            np.asarray(temperature, dtype='float64'),
+            np.asarray(density, dtype='float64'))
+        key = (temperature.shape, temperature.tostring(), density.tostring())
+        if key == self._last_key:
+            return self._last_result
+        instrument.count("rate_table_evaluations", temperature.size)
+        T = temperature.ravel()
+        lnT = np.log(T)
+        inside = (lnT >= self.lnT[0]) & (lnT <= self.lnT[-1])
+        rates = np.empty((len(T), self.engine.nrxns))
+        drates = np.empty_like(rates)
+        if inside.any():
+            ln_rate, dln_rate = self._interpolate(lnT[inside])
+            rates[inside] = np.exp(ln_rate)
+            drates[inside] = (rates[inside] * dln_rate /
+                              T[inside][:, np.newaxis])
+        if not inside.all():
+            outside = ~inside
+            rho = density.ravel()[outside]
+            rates[outside] = self.engine.rates(T[outside], rho)
+            drates[outside] = self.engine.rate_derivatives(T[outside], rho)
+        shape = temperature.shape + (self.engine.nrxns,)
+        self._last_key = key
+        self._last_result = rates.reshape(shape), drates.reshape(shape)
+        return self._last_result
+
+    def rates(self, temperature, density):
+        """
+        Same as RateEngine.rates, but interpolated from the table.
+        """
+        with instrument.timer("rate_table"):
+            return self._evaluate(temperature, density)[0]
+
+    def rate_derivatives(self, temperature, density):
+        """
+        Same as RateEngine.rate_derivatives, but interpolated from the
+        table.
+        """
+        with instrument.timer("rate_table"):
+            return self._evaluate(temperature, density)[1]
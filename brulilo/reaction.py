@@ -7,25 +7,31 @@ could be anything that takes in a temperature and density.
 import numpy as np
 # import collections
 # import sys
-import re
 
-from util.webnucleo import webnucleo
-from util.species import \
-    sanitize_species, form_rate_string, PLUS, isotope_lut, leptons
+from util.webnucleo import webnucleo, reaction_key
+from util.species import form_rate_string, is_isotope, leptons
+from util.rxnfile import parse_rxn_string
 from isotope import Isotope
 from util.constants import electron_mass, light_speed
-
-rate_breaker = re.compile("(.*)\((.*),(.*)\)(.*)")
+from util.instrument import instrument
 
 class Reaction(object):
 
     # some properties that modify some values
-    is_reverse = False
     is_weak = False
     is_betaplus = False
     is_electron_capture = False
+    is_positron_capture = False
+
+    # the attributes built from the rate and nuclear data; a lazy Reaction
+    # only builds them (see resolve) when one of them is first used
+    _resolved_attributes = frozenset(["rate_data", "is_reverse",
+                                      "forward_rate", "reverse_factor",
+                                      "rate", "qvalue", "neutrino_energy"])
+    resolved = False
 
-    def __init__(self, rxnString, pbar=None):
+    def __init__(self, rxnString, pbar=None, spec=None, rate_data=None,
+                 lazy=False):
         """
         rxnString is the reaction rate in typical astrophysical notation, 
         including leptons using syntax defined in the README.  For example,
@@ -38,93 +44,94 @@ class Reaction(object):
 
         pbar is a progress bar object, which is useful for tracking the 
         progress of Network creation on large numbers of Reactions.
+
+        spec, the already parsed RxnSpec of rxnString, and rate_data, its
+        already found RateData record, can be passed in by loaders that
+        handle many reactions at once (see util.rxnfile); otherwise they
+        are worked out here.
+
+        If lazy, only the species are worked out for now, which is all
+        that the topology of a network needs; the rate data is looked up,
+        and the rate functions and Q-value are built, on first use (or
+        when resolve is called, as Network does for all of its lazy
+        Reactions at once).
         """
         self.rxnString = rxnString
         # parse into reactants and products
-        self._parse_rate()
+        if spec is None:
+            spec = parse_rxn_string(rxnString)
+        self.spec = spec
+        self.reactants = spec.reactants
+        self.products = spec.products
 
         # some reaction rate qualifiers
         self.is_weak = any([species in self.reactants + self.products
                             for species in leptons])
         self.is_betaplus = all([species in self.products
-                                for species in ["electron", "neutrino_e"]])
-        self.is_electron_capture = (any([species in self.reactants
-                                         for species in ["positron",
-                                                         "anti-neutrino_e"]])
-                                    and
-                                    any([species in self.reactants
-                                         for species in ["positron",
-                                                         "anti-neutrino_e"]]))
+                                for species in ["positron", "neutrino_e"]])
+        self.is_electron_capture = "electron" in self.reactants
+        self.is_positron_capture = "positron" in self.reactants
 
         # make the Isotope objects for this reaction
         self.isotope_reactants = [Isotope(reactant) for reactant in
                                   self.reactants
-                                  if reactant in isotope_lut]
+                                  if is_isotope(reactant)]
         self.isotope_products = [Isotope(product) for product in
                                  self.products
-                                 if product in isotope_lut]
+                                 if is_isotope(product)]
+        # the unique isotopes involved
+        self.isotopes = list(set(self.isotope_reactants +
+                                 self.isotope_products))
 
-        # let's find our reaction data in the data file
         if pbar is not None:
             pbar.update(self.rxnString)
-        self._build_rxn_data()
-        self._build_qvalue()
+        if not lazy:
+            self.resolve(rate_data)
+
+    def resolve(self, rate_data=None):
+        """
+        Find our reaction data in the data file (unless its RateData
+        record is given), and build the rate functions and the Q-value.
+        Does nothing if that's already been done.
+        """
+        if self.resolved:
+            return
+        with instrument.timer("rate_build"):
+            self._build_rxn_data(rate_data)
+            self._build_qvalue()
+        self.resolved = True
+
+    def __getattr__(self, name):
+        # only called for missing attributes: those of a lazy Reaction
+        # that hasn't been resolved yet
+        if name in self._resolved_attributes and not self.resolved:
+            self.resolve()
+            return getattr(self, name)
+        raise AttributeError(name)
 
     def __str__(self):
         # kludge to use the form_rate_string
         return form_rate_string([self.reactants[0]], self.reactants[1:],
                                 self.products[1:], [self.products[0]])
 
-    def _parse_rate(self):
-        """
-        Takes a rxnString in the form of 
-        
-        He4(aa,g)C12
-
-        and parses it into the target nucleus - He4 -, the reactants -
-        [He4,He4,He4] -, and the products - [gamma,C12] - useful for
-        searching the ReacLib database.  Handling of special
-        characters (e.g. aa, g) is done via the sanitize_species
-        method from the util.species module.
-        """
-        # tokenize the rate string and apply any sanitizations
-        tokenized = map(sanitize_species,
-                        rate_breaker.match(self.rxnString).groups())
-        reactants = tokenized[:2]
-        products = tokenized[2:]
-        print 'reactants', reactants
-        print 'products', products
-        # target = sanitize_species(self.rxnString.split('(')[0])
-        # internals = self.rxnString.split('(')[1].split(')')[0].split(',')
-        # reactants, products = [sanitize_species(spec) for spec in internals]
-        # endState = sanitize_species(self.rxnString.split(')')[1])
-        
-
-        self.reactants = reactants  #.split(PLUS)
-        self.products = products  #.split(PLUS)
-
-        # # this is of the form a + b -> c + d, with special character handling
-        # rateString = form_rate_string(*tokenized)
-
-        # # split this into reactants and products, for easier searching of the
-        # # various permutations in the ReacLib database
-        # self.reactants = rateString.split(rl.TO)[0].split(rl.PLUS)
-        # self.products = rateString.split(rl.TO)[1].split(rl.PLUS)
-
-
-    def _build_rxn_data(self):
-        # find this reaction in the reaction rate file
-        rate_data = webnucleo.get_rate_data(self)
+    def _build_rxn_data(self, rate_data=None):
+        # find this reaction in the reaction rate file, unless we were
+        # handed its record; the record is for the reverse reaction if its
+        # reactants aren't ours
+        if rate_data is None:
+            rate_data = webnucleo.get_rate_data(self)
+        else:
+            self.is_reverse = (rate_data.reactants !=
+                               reaction_key(self.reactants,
+                                            self.products)[0])
+        self.rate_data = rate_data
         # rate data is stored in several formats
         rate_builders = {"non_smoker_fit": webnucleo.build_non_smoker_rate,
                          "single_rate": webnucleo.build_single_rate,
                          "rate_table": webnucleo.build_rate_table_rate}
-        for rate_type, rate_builder in rate_builders.iteritems():
-            this_rate = rate_data.find(rate_type)
-            # if the storage type matches, then read the data and build
-            # the rate function, a function of temperature only
-            if this_rate:
-                rate_builder(self, rate_data)
+        # build the rate function, a function of temperature only, for
+        # this storage type
+        rate_builders[rate_data.rate_type](self, rate_data)
 
         # we need to build the reverse factor; for a non-reverse rate, this is
         # just unity
@@ -133,47 +140,46 @@ class Reaction(object):
 
         # the full reaction rate
         def _full_rate(reaction, temperature, density):
-            return (reaction.reverse_factor(temperature, density) *
-                    reaction.forward_rate(temperature))
+            return (reaction.reverse_factor(reaction, temperature, density) *
+                    reaction.forward_rate(reaction, temperature))
         self.rate = _full_rate
 
     def _build_qvalue(self):
         """
-        Calculate the Q-value of the reaction, including modifiers for 
-        electron-capture and beta+ decay.
+        Calculate the Q-value of the reaction from the (atomic) mass
+        excesses, including the modifier for positron capture, and the
+        part of it carried off by neutrinos.
         """
         qvalue = np.sum([isotope.mass_excess
                          for isotope in self.isotope_reactants])
-        qvaue -= np.sum([isotope.mass_excess
+        qvalue -= np.sum([isotope.mass_excess
                          for isotope in self.isotope_products])
-        # if this is a beta decay, we lose twice electron mass
-        if self.is_betaplus:
-            qvalue -= 2 * electron_mass * light_speed * light_speed
-        # if this is electron capture, we gain twice electron mass
-        elif self.is_electron_capture:
-            qvalue += 2 * electron_mass * light_speed * light_speed
+        # the atomic masses already account for the electrons in beta
+        # decays and electron captures, and the positron of a beta+ decay
+        # annihilates on the spot, so its 2 m_e c^2 is released too; a
+        # captured positron brings in its own mass, and that of the
+        # electron its daughter atom is short of
+        two_electrons = 2 * electron_mass * light_speed * light_speed
+        if self.is_positron_capture:
+            qvalue += two_electrons
         self.qvalue = qvalue
 
-    def update_rxn_vector(self, network_isotopes):
-        """
-        Each reaction has a 'direction' in a multidimensional space
-        defined by the total isotopes in a network.  We use this
-        to determine how a particular reaction acts within a network.
-        """
-        # sort the isotopes in some predictable fashion
-        network_isotopes.sort()
-        vec = np.zeros(len(network_isotopes), dtype='int')
-        indices = [i for i,isotope in enumerate(network_isotopes)
-                   if isotope in self.isotopes]
-        vec[indices] = 1
-        for i, isotope in enumerate(self.isotopes):
-            try:
-                i_net = network_isotopes.index(isotope)
-            except IndexError:
-                raise RuntimeError("%s not in network" % isotope)
+        # the part of that carried off by neutrinos; we don't have the
+        # spectra of the weak rates, so a neutrino from a capture (the
+        # only light product) is taken to carry off all of it, and one
+        # from a decay half of the leptons' kinetic energy, which is
+        # within ~20% for the CNO and pp decays; the kinetic energy of a
+        # beta+ decay leaves out the 2 m_e c^2 of the annihilation
+        self.neutrino_energy = 0.0
+        if any([species.startswith(("neutrino", "anti-neutrino"))
+                for species in self.products]):
+            if self.is_electron_capture or self.is_positron_capture:
+                self.neutrino_energy = max(qvalue, 0.0)
             else:
-                vec[i_net] *= self.coeffs[i]
-        self.rxn_vector = vec[:]
+                kinetic = qvalue
+                if self.is_betaplus:
+                    kinetic -= two_electrons
+                self.neutrino_energy = 0.5 * max(kinetic, 0.0)
 
     def plot_on(self, fig):
         """
@@ -0,0 +1,278 @@
+"""
+Dynamic reduction of a Network: at given conditions, only the reactions
+carrying a significant part of the flux into or out of some species
+matter, and the rest of the network can be dropped for the burn.
+
+Both methods rank the reactions by their normalized flux contributions
+
+    R_Aj = |S_Aj f_j| / sum_k |S_Ak f_k|
+
+the fraction of all the flux changing species A that goes through reaction
+j (S is the stoichiometry matrix and f the molar fluxes).  With
+method="flux", a reaction is kept if R_Aj is above the threshold for any
+species A it changes.  With method="drg" (the directed relation graph of
+Lu & Law 2005), species B matters to species A if
+
+    r_AB = sum_j R_Aj delta_Bj
+
+(delta_Bj is 1 if B takes part in reaction j) is above the threshold;
+the species kept are those reached from the target species along such
+links, and the reactions kept are those among them.  Either way, the
+target species (by default, those above target_abundance) are always
+kept.
+
+Given several compositions, temperatures and densities, each R_Aj is its
+largest value over them.  The instantaneous fluxes of the initial
+composition miss every path through species that are not there yet, so
+given a timestep, the reduction is instead built from the compositions
+along a burn of the full network over it (an integrated-flux reduction),
+which then holds along the whole trajectory.
+
+A NetworkReducer caches its reduced networks, keyed by bins in log(T),
+log(rho) and the log of each abundance, so that the many zones of a hydro
+grid under similar conditions share a handful of reductions:
+
+    reducer = NetworkReducer(network, threshold=1e-3)
+    Y = reducer.burn(Y0, temperature, density, dt)
+    error = reducer.error(Y0, temperature, density, dt)
+"""
+import collections
+import numpy as np
+import scipy.sparse as sparse
+
+from network import Network
+from util.instrument import instrument
+
+# a reduced network, with the positions of its species and reactions in the
+# full network
+Reduction = collections.namedtuple("Reduction", ["network", "species",
+                                                 "reactions"])
+
+reduction_methods = ["drg", "flux"]
+
+
+class NetworkReducer(object):
+    def __init__(self, network, threshold=1e-3, method="drg", targets=None,
+                 target_abundance=1e-6, log_T_bin=0.05, log_rho_bin=0.5,
+                 log_Y_bin=1., log_dt_bin=0.5, Y_floor=1e-12, nsamples=8,
+                 maxsize=128, burn_method="bdf", **burn_options):
+        """
+        Reduce the Network network with the method "drg" or "flux" (see
+        above), keeping the links or reactions whose normalized flux is
+        above threshold.  targets is a list of the Isotopes (or their
+        names) that must always be kept; if None, the species with molar
+        abundances above target_abundance are the targets.
+
+        Reductions for a timestep sample the burn of the full network, by
+        burn_method with burn_options, at nsamples times spaced
+        logarithmically up to the timestep.
+
+        Reduced networks are cached, keyed by the bins of width log_T_bin
+        in log10(T), log_rho_bin in log10(rho), log_Y_bin in the log10 of
+        each abundance (abundances below Y_floor all share a bin) and
+        log_dt_bin in log10(timestep); the maxsize most recently used are
+        kept.
+        """
+        if method not in reduction_methods:
+            errString = ("Unknown reduction method %s; use one of %s" %
+                         (method, ", ".join(reduction_methods)))
+            raise ValueError(errString)
+        self.network = network
+        self.threshold = threshold
+        self.method = method
+        self.target_abundance = target_abundance
+        self.log_T_bin = log_T_bin
+        self.log_rho_bin = log_rho_bin
+        self.log_Y_bin = log_Y_bin
+        self.log_dt_bin = log_dt_bin
+        self.Y_floor = Y_floor
+        self.nsamples = nsamples
+        self.maxsize = maxsize
+        self.burn_method = burn_method
+        self.burn_options = burn_options
+
+        species_index = dict((isotope, i)
+                             for i, isotope in enumerate(network.isotopes))
+        self.targets = None
+        if targets is not None:
+            names = dict((str(isotope), isotope)
+                         for isotope in network.isotopes)
+            self.targets = np.array(
+                [species_index[names.get(target, target)]
+                 for target in targets], dtype='int')
+        # delta_Bj: whether species B takes part in reaction j
+        rows, cols = [], []
+        for j, reaction in enumerate(network.reactions):
+            for isotope in reaction.isotopes:
+                rows.append(species_index[isotope])
+                cols.append(j)
+        self.participation = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(network.isotopes), len(network.reactions)))
+        # the same, for looking up the species of each reaction
+        self._reaction_species = self.participation.tocsc()
+
+        self._cache = collections.OrderedDict()
+        self.stats = dict(hits=0, misses=0)
+
+    def importance(self, Y, temperature, density):
+        """
+        The normalized flux contributions R_Aj as a sparse (species,
+        reactions) matrix, with the pattern of the stoichiometry matrix.
+        Y may be (samples, species), with a temperature and density per
+        sample, in which case each R_Aj is its largest over the samples.
+        """
+        Y = np.atleast_2d(np.asarray(Y, dtype='float64'))
+        temperature = np.broadcast_to(
+            np.asarray(temperature, dtype='float64'), Y.shape[:1])
+        density = np.broadcast_to(np.asarray(density, dtype='float64'),
+                                  Y.shape[:1])
+        stoichiometry = self.network.stoichiometry
+        fluxes = np.abs(stoichiometry.molar_fluxes(
+            Y, self.network.rates(temperature, density), density))
+        S = abs(stoichiometry.S.tocsr())
+        rows = np.repeat(np.arange(S.shape[0]), np.diff(S.indptr))
+        contributions = S.data * fluxes[:, S.indices]
+        totals = S.dot(fluxes.T).T[:, rows]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            normalized = np.where(totals > 0, contributions / totals, 0.0)
+        return sparse.csr_matrix((normalized.max(axis=0), S.indices,
+                                  S.indptr), shape=S.shape)
+
+    def _targets(self, Y):
+        if self.targets is not None:
+            return self.targets
+        Y = np.atleast_2d(Y)
+        targets = np.flatnonzero(Y.max(axis=0) > self.target_abundance)
+        if not len(targets):
+            # always keep at least the most abundant species
+            targets = np.array([np.argmax(Y.max(axis=0))])
+        return targets
+
+    def select(self, Y, temperature, density):
+        """
+        The positions, in the full network, of the species and the
+        reactions that are kept under these conditions (as for
+        importance); no Network is built.
+        """
+        R = self.importance(Y, temperature, density)
+        nspecies = len(self.network.isotopes)
+        keep = np.zeros(nspecies, dtype='bool')
+        keep[self._targets(Y)] = True
+
+        if self.method == "flux":
+            reactions = np.unique(R.indices[R.data > self.threshold])
+            members = self._reaction_species[:, reactions]
+            keep[members.indices] = True
+            return np.flatnonzero(keep), reactions
+
+        # r_AB, and a search of the graph from the targets
+        graph = R.dot(self.participation.T).tocsr()
+        graph.data[graph.data <= self.threshold] = 0
+        graph.eliminate_zeros()
+        frontier = list(np.flatnonzero(keep))
+        while frontier:
+            A = frontier.pop()
+            for B in graph.indices[graph.indptr[A]:graph.indptr[A+1]]:
+                if not keep[B]:
+                    keep[B] = True
+                    frontier.append(B)
+        # the reactions all of whose species are kept
+        dropped = self.participation.T.dot((~keep).astype('float64'))
+        return np.flatnonzero(keep), np.flatnonzero(dropped == 0)
+
+    def trajectory(self, Y0, temperature, density, dt):
+        """
+        The (nsamples + 1, species) molar abundances along a burn of the
+        full network for a time dt, starting with Y0.
+        """
+        samples = [np.asarray(Y0, dtype='float64')]
+        times = np.hstack((0, dt * np.logspace(1 - self.nsamples, 0,
+                                               self.nsamples)))
+        for step in np.diff(times):
+            samples.append(self.network.burn(samples[-1], temperature,
+                                             density, step,
+                                             method=self.burn_method,
+                                             **self.burn_options))
+        return np.array(samples)
+
+    def reduce(self, Y, temperature, density, dt=None):
+        """
+        The Reduction of the network for a single zone, with the molar
+        abundances Y at this temperature and density, from the
+        instantaneous fluxes or, given dt, from those along a burn for a
+        time dt.  Reductions are cached, and shared by all the zones in
+        the same bins.
+
+        Given dt, a cache miss burns the full network over dt (in nsamples
+        shorter burns) and builds a new Network, so it costs more than the
+        full burn it stands in for: on the ~500-species synthetic network
+        of benchmarks/fixtures.py, 1.1-1.2 s against 1.0 s.  Reductions
+        only pay off once they are shared by many zones, or timesteps.
+        """
+        key = self._key(Y, temperature, density, dt)
+        try:
+            reduction = self._cache.pop(key)
+            self.stats["hits"] += 1
+            instrument.count("reduction_cache_hits")
+        except KeyError:
+            self.stats["misses"] += 1
+            instrument.count("reduction_cache_misses")
+            with instrument.timer("reduction"):
+                if dt is not None:
+                    Y = self.trajectory(Y, temperature, density, dt)
+                reduction = self._build(Y, temperature, density)
+            if len(self._cache) >= self.maxsize:
+                self._cache.popitem(last=False)
+        self._cache[key] = reduction
+        return reduction
+
+    def _key(self, Y, temperature, density, dt):
+        log_Y = np.log10(np.maximum(np.asarray(Y, dtype='float64'),
+                                    self.Y_floor))
+        dt_bin = None
+        if dt is not None:
+            dt_bin = int(np.floor(np.log10(dt) / self.log_dt_bin))
+        return (int(np.floor(np.log10(temperature) / self.log_T_bin)),
+                int(np.floor(np.log10(density) / self.log_rho_bin)),
+                dt_bin, tuple(np.floor(log_Y / self.log_Y_bin).astype('int')))
+
+    def _build(self, Y, temperature, density):
+        species, reactions = self.select(Y, temperature, density)
+        network = Network([self.network.isotopes[i] for i in species],
+                          [self.network.reactions[j] for j in reactions])
+        # the reduced network sorts its species the same way, so they are
+        # still in the order of species
+        return Reduction(network, species, reactions)
+
+    def burn(self, Y0, temperature, density, dt, method="bdf", **options):
+        """
+        Same as Network.burn, but on the reduced network for these
+        conditions and this timestep; the abundances of the species that
+        were dropped are held fixed.
+        """
+        reduction = self.reduce(Y0, temperature, density, dt)
+        Y = np.array(Y0, dtype='float64')
+        Y[reduction.species] = reduction.network.burn(
+            Y[reduction.species], temperature, density, dt, method=method,
+            **options)
+        return Y
+
+    def error(self, Y0, temperature, density, dt, method="bdf",
+              Y_min=None, **options):
+        """
+        The error of burn against a burn of the full network: the largest
+        relative difference of the final abundances above Y_min (default:
+        target_abundance).  Species below that are only trace amounts,
+        which the reduction is free to get wrong.
+        """
+        if Y_min is None:
+            Y_min = self.target_abundance
+        full = self.network.burn(Y0, temperature, density, dt,
+                                 method=method, **options)
+        reduced = self.burn(Y0, temperature, density, dt, method=method,
+                            **options)
+        significant = np.abs(full) > Y_min
+        if not significant.any():
+            return 0.0
+        return np.max(np.abs(reduced[significant] / full[significant] - 1))
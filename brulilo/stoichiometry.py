@@ -0,0 +1,277 @@
+"""
+The stoichiometry of a Network: how each Reaction changes the abundance of
+each Isotope, stored as a sparse (species, reactions) matrix, along with
+the index arrays needed to form every reaction's molar flux at once.
+
+With molar abundances Y, the time derivative of the abundances is
+
+    dY/dt = S . f,   f_r = rho^(n_r - 1) lambda_r prod_{i in r} Y_i / d_r
+
+where n_r is the number of reactant nuclei of reaction r, lambda_r is its
+rate (N_A^(n_r - 1) <sigma v> for ReacLib rates), and d_r is the product
+of the factorials of the multiplicities of its reactants (e.g. 3! for
+three He4), which avoids double counting identical particles.
+
+The Jacobian d(dY_i/dt)/dY_k only has entries where species k is a
+reactant of a reaction that changes species i, so its sparsity pattern is
+fixed by the reactions; it is worked out once, and each evaluation just
+refills the data array of the same CSR matrix.
+
+Explicit stiff integrators instead split dY/dt into production and
+destruction,
+
+    dY_i/dt = F+_i - k_i Y_i
+
+where F+ = S+ . f sums the fluxes of the reactions that make species i and
+k_i, the destruction rate, sums those that use it up, divided by Y_i.
+k_i is formed from the products of the other reactants' abundances, so it
+stays finite when Y_i is zero.
+
+The energy generation rate is the Q-values of the reactions dotted with
+their molar fluxes,
+
+    eps_nuc = N_A sum_r Q_r f_r
+
+and likewise for the neutrino losses, eps_nu, with the mean energy the
+neutrinos of each reaction carry off.
+"""
+import numpy as np
+import scipy.sparse as sparse
+from math import factorial
+import collections
+
+from util.constants import avogadro
+from util.instrument import instrument
+
+
+class Stoichiometry(object):
+    def __init__(self, isotopes, reactions):
+        """
+        isotopes is the ordered list of the network's Isotopes, and
+        reactions the ordered list of its Reactions; these orders set the
+        rows and columns of the stoichiometry matrix.
+        """
+        self.nspecies = len(isotopes)
+        self.nrxns = len(reactions)
+        species_index = dict((isotope, i)
+                             for i, isotope in enumerate(isotopes))
+
+        rows, cols, vals = [], [], []
+        reactant_lists = []
+        self.dup_factor = np.ones(self.nrxns, dtype='float64')
+        for j, reaction in enumerate(reactions):
+            try:
+                reactants = [species_index[isotope]
+                             for isotope in reaction.isotope_reactants]
+                products = [species_index[isotope]
+                            for isotope in reaction.isotope_products]
+            except KeyError as err:
+                raise RuntimeError("%s not in network" % err.args[0])
+            net = collections.Counter(products)
+            net.subtract(reactants)
+            for i, count in net.iteritems():
+                if count:
+                    rows.append(i)
+                    cols.append(j)
+                    vals.append(count)
+            for multiplicity in collections.Counter(reactants).itervalues():
+                self.dup_factor[j] *= factorial(multiplicity)
+            reactant_lists.append(sorted(reactants))
+
+        # net change in species i from one instance of reaction j
+        self.S = sparse.csr_matrix((np.array(vals, dtype='float64'),
+                                    (rows, cols)),
+                                   shape=(self.nspecies, self.nrxns))
+
+        # the reactants of reaction j are reactant_index[j, :], padded with
+        # nspecies, which indexes a trailing 1 appended to Y
+        self.n_reactants = np.array([len(reactants)
+                                     for reactants in reactant_lists],
+                                    dtype='int')
+        max_reactants = max([1] + list(self.n_reactants))
+        self.reactant_index = np.full((self.nrxns, max_reactants),
+                                      self.nspecies, dtype='int')
+        for j, reactants in enumerate(reactant_lists):
+            self.reactant_index[j, :len(reactants)] = reactants
+        self.density_power = np.maximum(self.n_reactants - 1, 0)
+
+        # the energy released by one instance of each reaction, and the
+        # part of it carried off by neutrinos, in erg
+        self.qvalue = np.array([reaction.qvalue for reaction in reactions],
+                               dtype='float64')
+        self.neutrino_energy = np.array([reaction.neutrino_energy
+                                         for reaction in reactions],
+                                        dtype='float64')
+
+        self._build_jacobian_pattern()
+        self._build_split()
+
+    def _build_jacobian_pattern(self):
+        """
+        Work out the Jacobian's sparsity pattern, and how each term
+        S_ij * d(f_j)/d(Y at reactant slot s of j) maps onto its data array.
+        The diagonal is always included, as implicit solvers need it.
+        """
+        S = self.S.tocsc()
+        term_rxn, term_slot, term_coeff, term_row, term_col = \
+            [], [], [], [], []
+        for j in range(self.nrxns):
+            species = S.indices[S.indptr[j]:S.indptr[j+1]]
+            coeffs = S.data[S.indptr[j]:S.indptr[j+1]]
+            for slot in range(self.n_reactants[j]):
+                k = self.reactant_index[j, slot]
+                term_rxn.extend([j]*len(species))
+                term_slot.extend([slot]*len(species))
+                term_coeff.extend(coeffs)
+                term_row.extend(species)
+                term_col.extend([k]*len(species))
+        diagonal = list(range(self.nspecies))
+        pattern = sparse.csr_matrix(
+            (np.ones(len(term_row) + self.nspecies),
+             (term_row + diagonal, term_col + diagonal)),
+            shape=(self.nspecies, self.nspecies))
+        pattern.sum_duplicates()
+        pattern.sort_indices()
+        # position of (row, col) in the CSR data array
+        position = {}
+        for i in range(self.nspecies):
+            for p in range(pattern.indptr[i], pattern.indptr[i+1]):
+                position[(i, pattern.indices[p])] = p
+        self.term_rxn = np.array(term_rxn, dtype='int')
+        self.term_slot = np.array(term_slot, dtype='int')
+        self.term_coeff = np.array(term_coeff, dtype='float64')
+        self.term_pos = np.array([position[(i, k)] for i, k in
+                                  zip(term_row, term_col)], dtype='int')
+        pattern.data[:] = 0.0
+        self._jacobian = pattern
+
+    def _build_split(self):
+        """
+        S+, the positive part of S, and for each negative entry of S the
+        reactant slot of that species in the reaction, for the destruction
+        rates.
+        """
+        S = self.S.tocoo()
+        produced = S.data > 0
+        self.S_plus = sparse.csr_matrix((S.data[produced],
+                                         (S.row[produced], S.col[produced])),
+                                        shape=S.shape)
+        destroyed = S.data < 0
+        self.dest_species = S.row[destroyed]
+        self.dest_rxn = S.col[destroyed]
+        self.dest_coeff = -S.data[destroyed]
+        # a destroyed species is always among the reactants, and any of
+        # its slots will do
+        self.dest_slot = np.array(
+            [list(self.reactant_index[j]).index(i)
+             for i, j in zip(self.dest_species, self.dest_rxn)],
+            dtype='int')
+
+    @property
+    def jacobian_pattern(self):
+        """
+        The CSR matrix returned by jacobian; its structure never changes.
+        """
+        return self._jacobian
+
+    def _extended(self, Y):
+        """
+        Y with a trailing 1 appended along the species axis.
+        """
+        Y = np.asarray(Y, dtype='float64')
+        return np.concatenate([Y, np.ones(Y.shape[:-1] + (1,))], axis=-1)
+
+    def rate_factors(self, rates, density):
+        """
+        rho^(n_r - 1) lambda_r / d_r: the molar flux of each reaction per
+        unit product of its reactant abundances.
+        """
+        density = np.asarray(density, dtype='float64')[..., np.newaxis]
+        return rates * density**self.density_power / self.dup_factor
+
+    def molar_fluxes(self, Y, rates, density):
+        """
+        The molar flux f_r of every reaction; Y is (species,) or (zones,
+        species), with rates and density to match.
+        """
+        Yprod = np.prod(self._extended(Y)[..., self.reactant_index],
+                        axis=-1)
+        return self.rate_factors(rates, density) * Yprod
+
+    def rhs(self, Y, rates, density):
+        """
+        dY/dt = S . f for every species; Y is (species,) or (zones,
+        species), and so is the result.
+        """
+        with instrument.timer("rhs"):
+            fluxes = self.molar_fluxes(Y, rates, density)
+            return self.S.dot(fluxes.T).T
+
+    def energy_generation(self, Y, rates, density):
+        """
+        eps_nuc, the rate of nuclear energy release (erg/g/s), and eps_nu,
+        the part of it lost to neutrinos.  Y is (species,) or (zones,
+        species), and these are scalars or (zones,) arrays to match.
+        """
+        fluxes = avogadro * self.molar_fluxes(Y, rates, density)
+        return fluxes.dot(self.qvalue), fluxes.dot(self.neutrino_energy)
+
+    def heating_gradient(self, Y, rates, density):
+        """
+        d(eps_nuc - eps_nu)/dY_k for every species, for a single zone.
+        """
+        weights = (self._partials(Y) *
+                   (avogadro * (self.qvalue - self.neutrino_energy) *
+                    self.rate_factors(rates, density))[:, np.newaxis])
+        # the padding slots land on the extra bin, nspecies
+        return np.bincount(self.reactant_index.ravel(),
+                           weights=weights.ravel(),
+                           minlength=self.nspecies + 1)[:self.nspecies]
+
+    def _partials(self, Y):
+        """
+        d(prod_s Yr[j, s])/d(Yr[j, s]) for a single zone, where Yr[j, :]
+        are the reactant abundances of reaction j.  This is the product
+        over the other slots: the exclusive prefix product times the
+        exclusive suffix product.
+        """
+        Yr = self._extended(Y)[self.reactant_index]
+        ones = np.ones((self.nrxns, 1))
+        prefix = np.cumprod(np.hstack([ones, Yr[:, :-1]]), axis=1)
+        suffix = np.cumprod(np.hstack([ones, Yr[:, :0:-1]]),
+                            axis=1)[:, ::-1]
+        return prefix * suffix
+
+    def production_destruction(self, Y, rates, density):
+        """
+        The production terms F+ and destruction rates k of every species,
+        with dY/dt = F+ - k Y, for a single zone.
+        """
+        with instrument.timer("rhs"):
+            partials = self._partials(Y)
+            factors = self.rate_factors(rates, density)
+            production = self.S_plus.dot(self.molar_fluxes(Y, rates,
+                                                           density))
+            destruction = np.bincount(
+                self.dest_species,
+                weights=(self.dest_coeff * factors[self.dest_rxn] *
+                         partials[self.dest_rxn, self.dest_slot]),
+                minlength=self.nspecies)
+        return production, destruction
+
+    def jacobian(self, Y, rates, density):
+        """
+        The analytic Jacobian d(dY_i/dt)/dY_k for a single zone, as a
+        (species, species) CSR matrix.  The same matrix, with the same
+        structure, is refilled on every call, so copy it if it needs to
+        outlive the next call.
+        """
+        with instrument.timer("jacobian"):
+            partials = self._partials(Y)
+            factors = self.rate_factors(rates, density)
+            weights = (self.term_coeff * factors[self.term_rxn] *
+                       partials[self.term_rxn, self.term_slot])
+            self._jacobian.data[:] = np.bincount(
+                self.term_pos, weights=weights,
+                minlength=len(self._jacobian.data))
+        return self._jacobian
@@ -0,0 +1,64 @@
+"""
+Shared pytest fixtures.  The tests run on the small synthetic Webnucleo
+database of benchmarks/fixtures.py, or on data files of their own, rather
+than on the full data files.
+"""
+import os
+import sys
+import pytest
+
+from brulilo.isotope import isotope_registry, species_table
+from brulilo.util.webnucleo import webnucleo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, "benchmarks"))
+import fixtures
+
+
+def use_data_files(nuc_file, rxn_file):
+    """
+    Point webnucleo at these nuclide and reaction data files, forgetting
+    everything loaded from the previous ones, along with the Isotopes
+    built from them.
+    """
+    webnucleo._nuc_data_file, webnucleo._rxn_data_file = nuc_file, rxn_file
+    webnucleo._nuc_arrays = None
+    webnucleo._rxn_arrays = None
+    webnucleo._nuclide_index = None
+    webnucleo._reaction_index = None
+    webnucleo._proton_mass_excess = None
+    webnucleo._neutron_mass_excess = None
+    isotope_registry.clear()
+    species_table.__init__()
+
+
+@pytest.fixture(scope="session")
+def fixture_database(tmpdir_factory):
+    """
+    The (nuclide, reaction) data files of the synthetic database.
+    """
+    return fixtures.write_database(str(tmpdir_factory.mktemp("database")))
+
+
+@pytest.fixture
+def use_database():
+    """
+    use_data_files, with webnucleo's data files put back after the test.
+    """
+    saved = webnucleo._nuc_data_file, webnucleo._rxn_data_file
+    yield use_data_files
+    use_data_files(*saved)
+
+
+@pytest.fixture
+def fixture_network(fixture_database, use_database):
+    """
+    A function building the fixture network of this name (see
+    benchmarks/fixtures.py) on the synthetic database.
+    """
+    from brulilo import Network
+
+    def build(name):
+        use_database(*fixture_database)
+        return Network.from_rxn_strings(fixtures.networks[name]())
+    return build
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from test_stoichiometry import initial_abundances
+
+
+@pytest.mark.parametrize("name", ["cno", "light", "alpha"])
+def test_generated_kernels(tmpdir, fixture_network, name):
+    network = fixture_network(name)
+    generic = network.stoichiometry
+    network.use_generated_kernels(cache_dir=str(tmpdir))
+    generated = network.stoichiometry
+    assert generated is not generic
+
+    # a batch of zones, each with its own conditions
+    nzones = 5
+    temperature = np.linspace(1e9, 5e9, nzones)
+    density = np.logspace(5, 9, nzones)
+    Y = initial_abundances(network) * np.linspace(0.5, 1.5, nzones)[:, None]
+    rates = network.rates(temperature, density)
+    assert np.allclose(generated.rhs(Y, rates, density),
+                       generic.rhs(Y, rates, density), rtol=1e-12, atol=0)
+    # the jacobian_data kernel takes a batch too, giving (zones, nnz)
+    batch = generated.kernels.jacobian_data(Y, rates, density)
+    for zone in range(nzones):
+        args = Y[zone], rates[zone], density[zone]
+        assert np.allclose(generated.rhs(*args), generic.rhs(*args),
+                           rtol=1e-12, atol=0)
+        expected = generic.jacobian(*args).toarray()
+        assert np.allclose(generated.jacobian(*args).toarray(), expected,
+                           rtol=1e-12, atol=0)
+        assert np.allclose(batch[zone],
+                           generic.jacobian(*args).data, rtol=1e-12, atol=0)
+
+    # a second Network of the same reactions imports the cached module
+    network.use_generic_kernels()
+    assert network.stoichiometry is generic
+    network.use_generated_kernels(cache_dir=str(tmpdir))
+    assert len(tmpdir.listdir()) == 1
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from brulilo.compiled import CompiledNetwork
+from test_stoichiometry import initial_abundances
+
+temperature, density, dt = 3e9, 1e7, 1e-3
+
+
+@pytest.mark.parametrize("name", ["light", "alpha"])
+@pytest.mark.parametrize("rate_table", [False, True])
+def test_round_trip(tmpdir, fixture_network, name, rate_table):
+    network = fixture_network(name)
+    if rate_table:
+        network.use_rate_table()
+    path = str(tmpdir.join("network"))
+    network.compile().save(path)
+    compiled = CompiledNetwork.load(path)
+
+    assert compiled.species == [str(isotope) for isotope in network.isotopes]
+    # a range of temperatures, both inside and outside of any rate table
+    T = np.logspace(6.5, 10.5, 200)
+    rho = np.full_like(T, density)
+    np.testing.assert_array_equal(compiled.rates(T, rho),
+                                  network.rates(T, rho))
+    np.testing.assert_array_equal(compiled.rate_derivatives(T, rho),
+                                  network.rate_derivatives(T, rho))
+
+    Y0 = initial_abundances(network)
+    for method in ["bdf", "rosenbrock"]:
+        np.testing.assert_array_equal(
+            compiled.burn(Y0, temperature, density, dt, method=method),
+            network.burn(Y0, temperature, density, dt, method=method))
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+from brulilo.util.constants import MeV2erg, avogadro
+from test_integrators import methods
+from test_stoichiometry import initial_abundances
+
+# the Q-values (from the synthetic database's mass excesses, which are the
+# measured ones for these light nuclei) and mean neutrino energies (MeV) of
+# the pp and CNO beta+ decays
+weak_reactions = {"H1 + H1 -> positron + neutrino_e + H2": (1.442, 0.265),
+                  "N13 -> positron + neutrino_e + C13": (2.221, 0.706),
+                  "O15 -> positron + neutrino_e + N15": (2.754, 0.996),
+                  "F17 -> positron + neutrino_e + O17": (2.761, 0.999)}
+
+
+@pytest.mark.parametrize("name", ["cno", "light"])
+def test_energy_generation(fixture_network, name):
+    network = fixture_network(name)
+    temperature, density = 3e7, 1e2
+    Y = initial_abundances(network)
+    eps_nuc, eps_nu = network.energy_generation(Y, temperature, density)
+
+    # the energy released is the mass lost, as the atomic mass excesses
+    # already account for the electrons and the positrons annihilate
+    mass_excess = np.array([isotope.mass_excess
+                            for isotope in network.isotopes])
+    dYdt = network.rhs(Y, temperature, density)
+    assert np.isclose(eps_nuc, -avogadro * np.dot(dYdt, mass_excess),
+                      rtol=1e-10, atol=0)
+
+    # the neutrino losses of the decays, with their measured mean energies
+    fluxes = network.stoichiometry.molar_fluxes(
+        Y, network.rates(temperature, density), density)
+    expected_nu = 0.0
+    for reaction, flux in zip(network.reactions, fluxes):
+        if not reaction.is_weak:
+            continue
+        qvalue, neutrino_energy = weak_reactions[str(reaction)]
+        assert reaction.is_betaplus
+        assert np.isclose(reaction.qvalue, qvalue * MeV2erg, rtol=1e-6)
+        assert np.isclose(reaction.neutrino_energy,
+                          neutrino_energy * MeV2erg, rtol=0.25)
+        expected_nu += avogadro * flux * neutrino_energy * MeV2erg
+    assert np.isclose(eps_nu, expected_nu, rtol=0.25)
+
+
+@pytest.mark.parametrize("method,options,agreement,mass_drift", methods)
+def test_self_heating(fixture_network, method, options, agreement,
+                      mass_drift):
+    network = fixture_network("alpha")
+    Y0 = initial_abundances(network)
+    temperature, density, dt, specific_heat = 2e9, 1e7, 1e-2, 1e9
+    Y, T = network.burn_self_heating(Y0, temperature, density, dt,
+                                     specific_heat, method=method, **options)
+
+    # a reference burn by scipy's Radau integrator
+    def rhs(t, y):
+        eps_nuc, eps_nu = network.energy_generation(y[:-1], y[-1], density)
+        return np.append(network.rhs(y[:-1], y[-1], density),
+                         (eps_nuc - eps_nu) / specific_heat)
+    atol = np.append(np.full(len(Y0), 1e-20), 1e-3)
+    reference = solve_ivp(rhs, (0, dt), np.append(Y0, temperature),
+                          method="Radau", rtol=1e-10, atol=atol).y[:, -1]
+    # the burn heated things up
+    assert reference[-1] > 1.1 * temperature
+    assert np.isclose(T, reference[-1], rtol=agreement / 10, atol=0)
+    assert np.allclose(Y, reference[:-1], rtol=agreement, atol=1e-10)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from test_stoichiometry import initial_abundances
+
+temperature, density, dt = 3e9, 1e7, 1e-3
+
+# each method's options, how closely it must agree with a tight BDF burn,
+# and how closely it must conserve mass; backward Euler is only first
+# order, and the explicit methods don't conserve mass exactly
+methods = [("bdf", {}, 1e-4, 1e-12),
+           ("rosenbrock", {}, 1e-4, 1e-12),
+           ("backward_euler", {"rtol": 1e-4}, 5e-2, 1e-12),
+           ("asymptotic", {}, 1e-4, 1e-5),
+           ("qss", {}, 1e-4, 1e-5)]
+
+
+@pytest.mark.parametrize("name", ["cno", "alpha"])
+@pytest.mark.parametrize("method,options,agreement,mass_drift", methods)
+def test_burn(fixture_network, name, method, options, agreement,
+              mass_drift):
+    network = fixture_network(name)
+    A = np.array([isotope.A for isotope in network.isotopes])
+    Y0 = initial_abundances(network)
+    Y = network.burn(Y0, temperature, density, dt, method=method,
+                     **options)
+    assert abs(np.dot(A, Y) - np.dot(A, Y0)) <= mass_drift
+
+    reference = network.burn(Y0, temperature, density, dt, method="bdf",
+                             rtol=1e-10, atol=1e-20)
+    # the network did burn
+    assert np.max(np.abs(reference - Y0) / Y0) > 1
+    assert np.allclose(Y, reference, rtol=agreement, atol=1e-10)
+
+
+@pytest.mark.parametrize("name", ["cno", "alpha"])
+def test_dense_lu(fixture_network, name):
+    from brulilo.integrators.base import DenseLU, SparseLU
+    network = fixture_network(name)
+    Y = initial_abundances(network)
+    jacobian = network.jacobian(Y, temperature, density).tocsr()
+    matrix = np.eye(len(Y)) / dt - jacobian.toarray()
+    b = np.linspace(1., 2., len(Y))
+    for solver in DenseLU, SparseLU:
+        lu = solver(network.stoichiometry.jacobian_pattern)
+        lu.factor(jacobian, 1. / dt)
+        x = lu.solve(b)
+        # the matrices are badly conditioned, so it's the residuals that
+        # are compared
+        assert np.all(np.abs(matrix.dot(x) - b) <=
+                      1e-12 * np.abs(matrix).dot(np.abs(x)))
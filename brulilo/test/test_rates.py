@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("name", ["light", "alpha"])
+def test_rate_table_defaults(fixture_network, name):
+    # the light network has reverse rates that are far below the smallest
+    # float over much of the table, e.g. He4(g,d)d at T9 ~ 0.4
+    network = fixture_network(name)
+    assert network.use_rate_table() <= 1e-3
+
+    temperature = np.logspace(7, 10, 1001)
+    table = network.rates(temperature, 1e7)
+    derivatives = network.rate_derivatives(temperature, 1e7)
+    network.use_exact_rates()
+    exact = network.rates(temperature, 1e7)
+    significant = exact > 1e-280
+    assert np.all(np.abs(table[significant] / exact[significant] - 1) <=
+                  1e-3)
+    assert np.all(np.abs(table[~significant]) <= 1e-280)
+
+    exact_derivatives = network.rate_derivatives(temperature, 1e7)
+    scale = np.abs(exact_derivatives).max(axis=0)
+    assert np.all(np.abs(derivatives - exact_derivatives) <= 1e-2 * scale)
+
+
+def test_reverse_factors(fixture_database, use_database):
+    # the light network, plus the reverse of the triple-alpha
+    from brulilo import Network
+    from brulilo.isotope import Isotope, species_table
+    from conftest import fixtures
+    use_database(*fixture_database)
+    network = Network.from_rxn_strings(fixtures.networks["light"]() +
+                                       ["C12(g,aa)He4"])
+    temperature = np.logspace(9, 10, 11)
+    factors = network.rate_engine.reverse_factors(temperature, 1e7)
+
+    # the same as each Reaction's own reverse factor
+    for i, reaction in enumerate(network.reactions):
+        assert np.allclose(factors[:, i],
+                           reaction.reverse_factor(reaction, temperature,
+                                                   1e7),
+                           rtol=1e-12, atol=0)
+
+    # and as the reverse ratios of Caughlan & Fowler (1988), who take the
+    # partition functions to be 2J + 1; the small differences come from
+    # the Q-values of the synthetic database
+    def partition_function(name):
+        return species_table.partition_functions(
+            temperature, [Isotope(name).id])[:, 0]
+
+    names = [str(reaction) for reaction in network.reactions]
+    t9 = temperature / 1e9
+    gamma_n = factors[:, names.index("He4 + gamma -> n + He3")]
+    expected = (2.61e10 * t9**1.5 * np.exp(-238.81 / t9) *
+                partition_function("He3") * partition_function("n") /
+                (4 * partition_function("He4")))
+    assert np.allclose(gamma_n, expected, rtol=3e-2, atol=0)
+    # including the 1/3! for the three identical alphas
+    gamma_aa = factors[:, names.index("C12 + gamma -> He4 + He4 + He4")]
+    expected = (2.00e20 * t9**3 * np.exp(-84.424 / t9) /
+                partition_function("C12"))
+    assert np.allclose(gamma_aa, expected, rtol=1e-2, atol=0)
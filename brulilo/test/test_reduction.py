@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from test_stoichiometry import initial_abundances
+
+density, dt = 1e7, 1e-3
+
+
+def abundances(network, fractions):
+    """
+    Molar abundances with these mass fractions, and none of anything else.
+    """
+    names = [str(isotope) for isotope in network.isotopes]
+    Y = np.zeros(len(names))
+    for name, fraction in fractions:
+        i = names.index(name)
+        Y[i] = fraction / network.isotopes[i].A
+    return Y
+
+
+def test_cache(fixture_network):
+    network = fixture_network("alpha")
+    reducer = network.reducer(threshold=1e-3, maxsize=2)
+    Y = initial_abundances(network)
+
+    reduction = reducer.reduce(Y, 3e9, density, dt)
+    # the same bins
+    assert reducer.reduce(Y * 1.01, 3.001e9, density, dt) is reduction
+    assert reducer.stats == dict(hits=1, misses=1)
+    # another temperature, and another timestep
+    assert reducer.reduce(Y, 2e9, density, dt) is not reduction
+    reducer.reduce(Y, 2e9, density, 10 * dt)
+    assert reducer.stats == dict(hits=1, misses=3)
+    # which pushed the first one out
+    assert reducer.reduce(Y, 3e9, density, dt) is not reduction
+    assert reducer.stats == dict(hits=1, misses=4)
+
+
+def test_flux_and_drg(fixture_network):
+    # carbon and helium at 1 GK: the triple-alpha makes carbon, and a
+    # little of it goes on to oxygen
+    network = fixture_network("alpha")
+    Y = abundances(network, [("He4", 0.5), ("C12", 0.5)])
+    kept = {}
+    for method in ["flux", "drg"]:
+        reduction = network.reducer(method=method, threshold=1e-3).reduce(
+            Y, 1e9, density)
+        kept[method] = ([str(isotope)
+                         for isotope in reduction.network.isotopes],
+                        [str(reaction)
+                         for reaction in reduction.network.reactions])
+    # C12(a,g)O16 is all of the flux into O16, so it's kept by the flux
+    # method, but it is too small a part of what happens to He4 and C12
+    # for DRG to get to O16 from them
+    assert kept["flux"] == (["He4", "C12", "O16"],
+                            ["He4 + He4 + He4 -> gamma + C12",
+                             "C12 + He4 -> gamma + O16"])
+    assert kept["drg"] == (["He4", "C12"],
+                           ["He4 + He4 + He4 -> gamma + C12"])
+
+
+@pytest.mark.parametrize("name,fractions", [
+    ("alpha", [("He4", 0.5), ("C12", 0.5)]),
+    ("light", [("H1", 0.5), ("He4", 0.5)])])
+@pytest.mark.parametrize("method", ["flux", "drg"])
+def test_error(fixture_network, name, fractions, method):
+    network = fixture_network(name)
+    Y = abundances(network, fractions)
+    threshold = 1e-3
+    reducer = network.reducer(method=method, threshold=threshold)
+    for temperature in [1e9, 3e9]:
+        reduction = reducer.reduce(Y, temperature, density, dt)
+        if method == "drg":
+            assert len(reduction.reactions) < len(network.reactions)
+        assert reducer.error(Y, temperature, density, dt) <= threshold
@@ -0,0 +1,43 @@
+from brulilo import Reaction
+from brulilo.util.rxnfile import parse_rxn_string
+from brulilo.util.species import isotope_lut
+from brulilo.util.webnucleo import webnucleo
+
+# Al26 only comes in its ground and isomeric states, as in the Webnucleo
+# data
+nuclides = [(0, 1, ""), (1, 1, ""), (13, 26, "g"), (13, 26, "m"),
+            (14, 27, "")]
+
+
+def write_nuclides(nuc_file):
+    with open(nuc_file, 'w') as f:
+        f.write('<nuclear_data>\n')
+        for Z, A, state in nuclides:
+            f.write('<nuclide%s><z>%d</z><a>%d</a><source>test</source>'
+                    '<mass_excess>%r</mass_excess><spin>0.5</spin>'
+                    '</nuclide>\n' % (' state="%s"' % state if state else "",
+                                      Z, A, 0.1 * A))
+        f.write('</nuclear_data>\n')
+
+
+def test_isomer_reaction(tmpdir, use_database):
+    nuc_file, rxn_file = str(tmpdir.join("nuc.xml")), str(tmpdir.join("rxn"))
+    write_nuclides(nuc_file)
+    use_database(nuc_file, rxn_file)
+
+    spec = parse_rxn_string("Al26m(p,g)Si27")
+    assert spec.reactants == ["Al26m", "H1"]
+    assert spec.products == ["gamma", "Si27"]
+    # a trailing g is the ground state
+    assert parse_rxn_string("Al26g(p,g)Si27").reactants == ["Al26g", "H1"]
+    assert parse_rxn_string("pAl26m(,g)Si27").reactants == ["H1", "Al26m"]
+    # parsing goes by the names alone
+    assert webnucleo._nuclide_index is None
+    assert "Al26m" not in isotope_lut
+
+    reaction = Reaction("Al26m(p,g)Si27", lazy=True)
+    isomer, proton = reaction.isotope_reactants
+    assert str(isomer) == "Al26m" and isomer.state == "m"
+    assert str(proton) == "H1"
+    assert Reaction("Al26g(p,g)Si27", lazy=True).isotope_reactants[0].state \
+        == "g"
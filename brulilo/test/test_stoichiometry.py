@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+
+def initial_abundances(network):
+    """
+    Molar abundances of mostly protons and alphas, with some of everything
+    else.
+    """
+    names = [str(isotope) for isotope in network.isotopes]
+    X = np.full(len(names), 0.2 / len(names))
+    for name, fraction in [("H1", 0.3), ("He4", 0.5)]:
+        if name in names:
+            X[names.index(name)] = fraction
+    return X / np.array([isotope.A for isotope in network.isotopes])
+
+
+@pytest.mark.parametrize("name", ["cno", "light", "alpha"])
+def test_jacobian_matches_finite_differences(fixture_network, name):
+    network = fixture_network(name)
+    stoichiometry = network.stoichiometry
+    temperature, density = 3e9, 1e7
+    rates = network.rates(temperature, density)
+    Y = initial_abundances(network)
+
+    J = stoichiometry.jacobian(Y, rates, density).toarray()
+    fd = np.empty_like(J)
+    for k in range(len(Y)):
+        dY = np.zeros_like(Y)
+        dY[k] = 1e-6 * Y[k]
+        fd[:, k] = (stoichiometry.rhs(Y + dY, rates, density) -
+                    stoichiometry.rhs(Y - dY, rates, density)) / (2 * dY[k])
+    # the differences lose digits to the cancellations in each dY/dt, so
+    # the error is compared with the largest entry of its row
+    scale = np.abs(J).max(axis=1)[:, np.newaxis]
+    assert np.all(np.abs(J - fd) <= 1e-6 * scale)
+    # nothing outside of the pattern
+    pattern = stoichiometry.jacobian_pattern.toarray() != 0
+    assert not np.any(fd[~pattern])
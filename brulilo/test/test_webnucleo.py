@@ -0,0 +1,66 @@
+import numpy as np
+
+import fixtures
+from brulilo import Network
+from brulilo.util.webnucleo import (webnucleo, WebnucleoDataParser,
+                                    _compile_reactions, _reaction_chunks)
+
+
+def test_subset_then_full(fixture_database, use_database):
+    use_database(*fixture_database)
+    alpha = Network.from_rxn_strings(fixtures.networks["alpha"](),
+                                     subset=True)
+    assert len(webnucleo.rxn_arrays["source"]) == len(alpha.reactions)
+    # the CNO reactions aren't in the subset, so the full data is loaded
+    cno = Network.from_rxn_strings(fixtures.networks["cno"]())
+    assert len(cno.reactions) == 10
+    assert len(webnucleo.rxn_arrays["source"]) > len(alpha.reactions)
+    # and the alpha chain still has its rates
+    assert alpha.rates(3e9, 1e7).shape == (len(alpha.reactions),)
+
+
+def test_chunked_compile(tmpdir):
+    nuc_file, rxn_file = fixtures.write_database(
+        str(tmpdir), names=["cno", "light", "alpha", "synth500"])
+    parser = WebnucleoDataParser()
+    parser._ingest_processes = 2
+    parser._ingest_chunk_size = 4096
+    assert len(_reaction_chunks(rxn_file, 8)) == 8
+    serial = _compile_reactions(rxn_file)
+    chunked = parser._compile_reaction_file(rxn_file)
+    assert sorted(chunked) == sorted(serial)
+    for name in serial:
+        assert chunked[name].dtype == serial[name].dtype
+        # single_rate is padded with NaN, which compares as equal here
+        np.testing.assert_array_equal(chunked[name], serial[name])
+
+
+def test_lazy_network(fixture_database, use_database):
+    use_database(*fixture_database)
+    rxn_strings = fixtures.networks["light"]()
+    lazy = Network.from_rxn_strings(rxn_strings, lazy=True)
+    # only the nuclide data has been read
+    assert webnucleo._rxn_arrays is None
+    assert webnucleo._reaction_index is None
+    assert not any(reaction.resolved for reaction in lazy.reactions)
+    assert len(str(lazy.reactions[0])) > 0
+
+    # a Reaction resolves itself when its rate data is first used
+    first, second = lazy.reactions[:2]
+    # He4(g,n)He3, whose rate is that of He3(n,g)He4
+    assert first.is_reverse
+    assert first.resolved and not second.resolved
+    # and the Network resolves the rest, in one batch
+    temperature = np.logspace(8, 10, 5)
+    density = np.full_like(temperature, 1e7)
+    rates = lazy.rates(temperature, density)
+    assert all(reaction.resolved for reaction in lazy.reactions)
+
+    use_database(*fixture_database)
+    eager = Network.from_rxn_strings(rxn_strings)
+    assert [str(reaction) for reaction in eager.reactions] == \
+        [str(reaction) for reaction in lazy.reactions]
+    np.testing.assert_array_equal(rates, eager.rates(temperature, density))
+    np.testing.assert_array_equal(
+        [reaction.qvalue for reaction in lazy.reactions],
+        [reaction.qvalue for reaction in eager.reactions])
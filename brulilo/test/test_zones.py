@@ -0,0 +1,27 @@
+import numpy as np
+
+from test_stoichiometry import initial_abundances
+
+
+def test_burn_zones(fixture_network):
+    network = fixture_network("alpha")
+    nzones = 6
+    Y0 = np.tile(initial_abundances(network), (nzones, 1))
+    temperature = np.linspace(2e9, 4e9, nzones)
+    density = np.full(nzones, 1e7)
+    dt = 1e-3
+
+    serial = np.array([network.burn(Y, T, rho, dt)
+                       for Y, T, rho in zip(Y0, temperature, density)])
+    np.testing.assert_array_equal(
+        network.burn_zones(Y0, temperature, density, dt, processes=2),
+        serial)
+
+    # a burner keeps its workers from one burn to the next
+    with network.zone_burner(processes=2) as burner:
+        for step in range(2):
+            Y1 = burner.burn(Y0, temperature, density, dt, chunksize=1)
+            np.testing.assert_array_equal(Y1, serial)
+    with network.zone_burner(processes=1) as burner:
+        np.testing.assert_array_equal(
+            burner.burn(Y0, temperature, density, dt), serial)
@@ -0,0 +1,182 @@
+"""
+Instrumentation of where brulilo spends its time: wall-clock timers for
+each phase of the work (loading the XML, looking up the rate data,
+building the rates, evaluating them, the RHS, the Jacobian, the LU
+factorizations and solves, and the steps an integrator rejects) and
+counters of how often things happen (rate evaluations, integrator steps,
+Newton iterations, cache hits and misses, ...).
+
+It is off by default, and then each instrumented call costs only a check
+of a flag.  Switched on, the totals are read as a dict, and with tracing,
+every timed interval is also kept, to be written in the Chrome trace
+format (load the file in chrome://tracing or https://ui.perfetto.dev):
+
+    from brulilo.util.instrument import instrument
+    instrument.enable(trace=True)
+    Y = network.burn(Y0, temperature, density, dt)
+    print instrument.stats()
+    instrument.write_trace("burn_trace.json")
+
+Setting the environment variable BRULILO_INSTRUMENT turns it on at import,
+and BRULILO_TRACE=<file> also traces, writing the trace to <file> at exit.
+
+Timers nest: the time of a phase includes that of any phase timed inside
+it.  Only the process that enabled the instrumentation is instrumented,
+so e.g. the worker processes of Network.burn_zones are not.
+"""
+import atexit
+import json
+import os
+import thread
+import timeit
+
+clock = timeit.default_timer
+
+
+class _NullTimer(object):
+    """
+    The timer handed out while instrumentation is off.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_timer = _NullTimer()
+
+
+class _Timer(object):
+    __slots__ = ["instrumentation", "name", "start"]
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.add_time(self.name, self.start, clock())
+        return False
+
+
+class Instrumentation(object):
+    def __init__(self, max_events=1000000):
+        """
+        The timers and counters; off until enabled.  When tracing, at most
+        max_events intervals are kept, and the rest are only counted (as
+        dropped_trace_events).
+        """
+        self.enabled = False
+        self.tracing = False
+        self.max_events = max_events
+        self.reset()
+
+    def enable(self, trace=False):
+        """
+        Start timing and counting; if trace, also keep every interval for
+        write_trace.
+        """
+        self.enabled = True
+        self.tracing = trace
+
+    def disable(self):
+        """
+        Stop timing and counting; what was gathered so far is kept.
+        """
+        self.enabled = False
+        self.tracing = False
+
+    def reset(self):
+        """
+        Forget all the times, counts and trace events.
+        """
+        # [calls, total, min, max] of each timer
+        self.timers = {}
+        self.counters = {}
+        self.events = []
+        self._origin = clock()
+
+    def timer(self, name):
+        """
+        A context manager timing its block as (one call of) the phase
+        name.
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name)
+
+    def add_time(self, name, start, end):
+        """
+        Add the interval from start to end (as given by clock) to the phase
+        name.
+        """
+        if not self.enabled:
+            return
+        elapsed = end - start
+        totals = self.timers.get(name)
+        if totals is None:
+            self.timers[name] = [1, elapsed, elapsed, elapsed]
+        else:
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] = min(totals[2], elapsed)
+            totals[3] = max(totals[3], elapsed)
+        if self.tracing:
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, elapsed, thread.get_ident()))
+            else:
+                self.count("dropped_trace_events")
+
+    def count(self, name, n=1):
+        """
+        Add n to the counter name.
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def stats(self):
+        """
+        The totals so far, as a dict: "timers" holds the calls, total,
+        mean, min and max time (in seconds) of each phase, and "counters"
+        the counts.
+        """
+        timers = {}
+        for name, (calls, total, shortest, longest) in \
+                self.timers.iteritems():
+            timers[name] = {"calls": calls, "total": total,
+                            "mean": total / calls, "min": shortest,
+                            "max": longest}
+        return {"timers": timers, "counters": dict(self.counters)}
+
+    def trace(self):
+        """
+        The trace events so far, as a dict in the Chrome trace format; the
+        totals of stats are included as metadata.
+        """
+        pid = os.getpid()
+        events = [{"name": name, "cat": "brulilo", "ph": "X",
+                   "ts": 1e6 * (start - self._origin),
+                   "dur": 1e6 * elapsed, "pid": pid, "tid": tid}
+                  for name, start, elapsed, tid in self.events]
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": self.stats()}
+
+    def write_trace(self, filename):
+        """
+        Write trace() to the file filename, as JSON.
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+instrument = Instrumentation()
+
+if os.environ.get("BRULILO_TRACE"):
+    instrument.enable(trace=True)
+    atexit.register(instrument.write_trace,
+                    os.path.abspath(os.environ["BRULILO_TRACE"]))
+elif os.environ.get("BRULILO_INSTRUMENT"):
+    instrument.enable()
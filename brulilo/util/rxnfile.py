@@ -0,0 +1,71 @@
+"""
+Reading reaction lists: files with one reaction string per line, in the
+astrophysical notation of the README, e.g.
+
+    # the pp chain
+    p(p,e+nu_e)d
+    d(p,g)He3
+
+Blank lines are skipped, as is anything after a '#'.  The lines are read
+as a stream and parsed into RxnSpec records one at a time, so even very
+large lists never need to be held in memory as text.
+"""
+import re
+from collections import namedtuple
+
+from species import sanitize_species, PLUS
+from webnucleo import reaction_key
+
+# a parsed reaction string: reactants and products are the lists of
+# sanitized species (in Webnucleo syntax) on either side
+RxnSpec = namedtuple("RxnSpec", ["rxnString", "reactants", "products"])
+
+rate_breaker = re.compile("(.*)\((.*),(.*)\)(.*)")
+
+
+def parse_rxn_string(rxnString):
+    """
+    Takes a rxnString in the form of
+
+    He4(aa,g)C12
+
+    and parses it into the lists of reactants - [He4,He4,He4] - and
+    products - [gamma,C12] - useful for searching the ReacLib database.
+    Handling of special characters (e.g. aa, g) is done via the
+    sanitize_species method from the util.species module.
+    """
+    found = rate_breaker.match(rxnString)
+    if found is None:
+        errString = "Can't parse the reaction string %s" % rxnString
+        raise RuntimeError(errString)
+    # tokenize the rate string and apply any sanitizations
+    tokenized = map(sanitize_species, found.groups())
+    # compound species like 'He4 + He4' are split into their parts
+    # (empty slots, like the projectile of a decay, are dropped)
+    reactants = [spec for species in tokenized[:2]
+                 for spec in species.split(PLUS) if spec]
+    products = [spec for species in tokenized[2:]
+                for spec in species.split(PLUS) if spec]
+    return RxnSpec(rxnString, reactants, products)
+
+
+def iter_rxn_specs(lines, skip_duplicates=True):
+    """
+    A generator of RxnSpec records for the reaction strings in lines, an
+    iterable of strings such as an open reaction file.  Comments and blank
+    lines are skipped, as are (if skip_duplicates) reactions that were
+    already seen, in the same or any other notation (e.g. 'He4(aa,g)C12'
+    and 'a(aa,g)C12').
+    """
+    seen = set()
+    for line in lines:
+        rxnString = line.split("#", 1)[0].strip()
+        if not rxnString:
+            continue
+        spec = parse_rxn_string(rxnString)
+        if skip_duplicates:
+            key = reaction_key(spec.reactants, spec.products)
+            if key in seen:
+                continue
+            seen.add(key)
+        yield spec
@@ -3,6 +3,8 @@ Some utilities and maps for handling the various species we encounter - both
 isotopes and leptons and photons.
 """
 import re
+import collections
+import functools
 
 
 # this dictionary is a map between the syntax in our reaction rate file
@@ -77,13 +79,12 @@ isotope_A_ranges = [
     (253, 337), (256, 337), (259, 337), (262, 337), (268, 337),  # Uut
     (270, 337), (273, 337), (276, 337), (280, 337), (283, 337)   # Uuo
     ]
-# a list of all the possible isotopes
-isotope_lut = [element_lut[0], ]
-for i, A_range in enumerate(isotope_A_ranges):
-    if i == 0:  # skip neutron
-        continue
-    isotope_lut.extend("%s%d" % (element_lut[i], A)
-                       for A in range(A_range[0], A_range[1]+1))
+# all the possible isotopes
+isotope_lut = frozenset(
+    [element_lut[0]] +
+    ["%s%d" % (element_lut[i], A)
+     for i, A_range in enumerate(isotope_A_ranges) if i != 0  # not neutron
+     for A in range(A_range[0], A_range[1]+1)])
 
 # this is useful for going from a species name to a Z value
 Zdict = {}
@@ -100,6 +101,16 @@ specialCharZA = {'p': (1, 1),
 # these are used to parse species names
 _specZAFinder = re.compile(r'(\D+)(\d+)')
 _specSplitter = re.compile(r'([A-Z][^A-Z]*)')
+_specStateFinder = re.compile(r'\d+([a-z]+)$')
+# this splits a compound species like 'aO20' or 'npa' into its parts in one
+# pass; the non-isotopes come first, longest first, so that e.g. 'nu_e_bar'
+# isn't read as 'n' + ..., and nuclei take all of their digits, so that
+# 'C12' is never read as 'C1' + ..., along with any isomeric state, so that
+# 'Al26m' is the isomer of Al26 and 'Al26g' its ground state
+_specTokenizer = re.compile('|'.join(
+    [re.escape(spec) for spec in sorted(rxn_to_WN_map, key=len,
+                                        reverse=True)] +
+    [r'[A-Z][a-z]*\d+[gm]?', '[%s]' % ''.join(specialCharZA)]))
 
 # some oft-used constants
 PLUS = " + "
@@ -122,6 +133,53 @@ def get_Z_A(spec):
     return Z, int(A)
 
 
+def get_state(spec):
+    """
+    Parses the isomeric state off a species like 'Al26m'; returns '' for
+    species without an explicit state (e.g. 'He4').
+    """
+    found = _specStateFinder.search(spec)
+    if found is None:
+        return ''
+    return found.group(1)
+
+
+def is_isotope(spec):
+    """
+    Whether spec is an isotope, like 'He4', or one in an isomeric state,
+    like 'Al26m'.  This only goes by the name; whether the nuclide data has
+    that state is found out when its Isotope is built.
+    """
+    if spec in isotope_lut:
+        return True
+    state = get_state(spec)
+    return state in ('g', 'm') and spec[:-1] in isotope_lut
+
+
+def _lru_cache(maxsize):
+    """
+    Memoize a function of one (hashable) argument, keeping the maxsize
+    most recently used results.
+    """
+    def decorator(function):
+        cache = collections.OrderedDict()
+
+        @functools.wraps(function)
+        def wrapper(arg):
+            try:
+                result = cache.pop(arg)
+            except KeyError:
+                result = function(arg)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[arg] = result
+            return result
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+@_lru_cache(maxsize=4096)
 def sanitize_species(speciesString):
     """
     Takes a 'species' from a reaction string and parses it properly.
@@ -132,10 +190,8 @@ def sanitize_species(speciesString):
       'e+' really means there was a positron
       'aO20' really means 'He4 + O20'
     """
-    # TODO -- optimize/clarify this
-
     # check for pure species
-    if speciesString in isotope_lut:
+    if is_isotope(speciesString):
         return speciesString
     # check for pure non-isotopes, converting to Webnucleo syntax
     if speciesString in rxn_to_WN_map:
@@ -144,35 +200,27 @@ def sanitize_species(speciesString):
     if speciesString in specialCharZA:
         return _fix_special_species(speciesString)
     # what is left is a combination of isotopes (including special
-    # characters) and/or non-isotopes find things and remove them
-    # order here matters because {'n', 'g', 'p', 't', 'd', 'a'} could all
-    # be part of an isotope name or Webnucleo syntax name, in addition to
-    # being valid themselves
+    # characters) and/or non-isotopes; split it up, left to right
     ret = []
-    test_string = speciesString
-    # start with proper nuclei first - [1:] because we don't want neutron
-    for var in isotope_lut[1:]:
-        num_var = test_string.count(var)
-        for n in range(num_var):  # we might have more than 1 instance
-            ret.append(var)
-            test_string = test_string.replace(var, "")
-    # check non_isotopes
-    for var in rxn_to_WN_map:
-        num_var = test_string.count(var)
-        for n in range(num_var):  # we might have more than 1 instance
-            ret.append(rxn_to_WN_map[var])
-            test_string = test_string.replace(var, "")
-    # this should be only special characters
-    for var in specialCharZA:
-        num_var = test_string.count(var)
-        for n in range(num_var):  # we might have more than 1 instance
-            ret.append(var)
-            test_string = test_string.replace(var, "")
-    # if there is anything left, then we didn't properly parse
-    if test_string:
-        errString = ("Didn't properly parse %s.  Ended up with %s"
-                     % (speciesString, test_string))
-        raise RuntimeError(errString)
+    position = 0
+    while position < len(speciesString):
+        found = _specTokenizer.match(speciesString, position)
+        if found is None:
+            errString = ("Didn't properly parse %s.  Ended up with %s"
+                         % (speciesString, speciesString[position:]))
+            raise RuntimeError(errString)
+        spec = found.group()
+        if spec in rxn_to_WN_map:
+            ret.append(rxn_to_WN_map[spec])
+        elif spec in specialCharZA:
+            ret.append(_fix_special_species(spec))
+        elif is_isotope(spec):
+            ret.append(spec)
+        else:
+            errString = ("Didn't properly parse %s.  %s is not an "
+                         "isotope" % (speciesString, spec))
+            raise RuntimeError(errString)
+        position = found.end()
 
     # # lone gammas
     # if speciesString.strip() == 'g':
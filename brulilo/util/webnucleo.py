@@ -1,15 +1,151 @@
 """
 This provides some parsing and handling of the Webnucleo[1] data format.
 
+Parsing the full XML data files is slow, so the first time a data file is
+used it is compiled into a set of flat NumPy arrays, which are cached in a
+.npz file next to it (see WebnucleoDataParser._cache_dir).  The cache is
+keyed by the data file's modification time and SHA-1 hash, and later runs
+just load the arrays.  The XML is only ever streamed, one element at a
+time, so the full tree is never held in memory; large reaction files are
+split at <reaction> boundaries and compiled by a pool of processes.  A
+process that needs just a few reactions (e.g. a burner for a small
+network) can instead load only their records, and those of their
+nuclides; see WebnucleoDataParser.load_subset.
+
 [1] http://nucleo.ces.clemson.edu/
 """
+import re
 import lxml.etree as etree
-from scipy.interpolate import interp1d
+from scipy.interpolate import make_interp_spline
 import numpy as np
+from collections import namedtuple, Counter
+from math import factorial
+import hashlib
+import io
+import multiprocessing
+import os
 import os.path
+import tempfile
 
 import brulilo
 from .constants import avogadro, light_speed, boltzmann, planck_bar, amu
+from .species import PLUS, is_isotope, get_Z_A
+from .instrument import instrument
+
+# these are the records handed out by WebnucleoDataParser; mass excesses
+# are in MeV, as in the data files
+NuclideData = namedtuple("NuclideData", ["Z", "A", "state", "mass_excess",
+                                         "spin", "partf_t9", "partf_log10"])
+# rate_type is one of "non_smoker_fit", "single_rate" or "rate_table", and
+# data is, respectively, an (n_sets, 7) array of a1..a7 fit coefficients, a
+# float, or a (t9, rate, sef) tuple of arrays
+RateData = namedtuple("RateData", ["reactants", "products", "source",
+                                   "rate_type", "data"])
+
+rate_types = ["non_smoker_fit", "single_rate", "rate_table"]
+
+# the temperature-independent parts of a reverse rate's detailed-balance
+# factor; see detailed_balance_constants
+DetailedBalance = namedtuple("DetailedBalance", ["log_prefactor", "qvalue",
+                                                 "dn", "ids", "signs"])
+
+
+def temperature_factors(temperature):
+    """
+    The seven temperature factors multiplying the a1..a7 coefficients of a
+    non-smoker fit,
+
+        a1 + a2/T9 + a3/T9^(1/3) + a4 T9^(1/3) + a5 T9 + a6 T9^(5/3)
+           + a7 ln(T9)
+
+    temperature may be a scalar, giving a length-7 array, or an array of
+    temperatures, giving a (7,) + temperature.shape array.
+    """
+    t9 = np.asarray(temperature, dtype='float64') / 1e9
+    t913 = t9**(1./3.)
+    return np.array([np.ones_like(t9), 1./t9, 1./t913, t913, t9,
+                     t9*t913*t913, np.log(t9)])
+
+
+def detailed_balance_constants(reactants, products):
+    """
+    The constants of the detailed-balance factor of the reaction taking
+    the Isotopes reactants to products, when only the rate of the opposite
+    direction is known.  With
+
+        theta_i(T) = G_i(T) (m_i kT / (2 pi hbar^2))^(3/2) exp(B_i / kT)
+
+    for each nucleus i, of partition function G_i (which includes its
+    2J + 1), mass m_i and binding energy B_i, the rates (in the
+    N_A^(n - 1) <sigma v> form) are related by
+
+        lambda = N_A^(n_R - n_P) prod_P theta / prod_R theta
+                 prod_R n_k! / prod_P n_k!  lambda_opposite
+
+    where n_R and n_P count the reactant and product nuclei, and the n_k!
+    are for identical nuclei on either side, as lambda / prod n_k! is what
+    the molar fluxes use.  With the m_i c^2 taken out of the thetas, the
+    log of this is
+
+        log_prefactor + dn thermal_log_factor(T) + qvalue / kT
+            + sum_i signs_i ln G_i(T)
+
+    where dn = n_P - n_R; the photons and leptons don't enter.
+    Returns the DetailedBalance record of these constants, with ids the
+    species_table IDs of the nuclei and signs +1 for products and -1 for
+    reactants.
+    """
+    from ..isotope import species_table
+    reactants, products = list(reactants), list(products)
+    ids = np.array([iso.id for iso in reactants + products], dtype='int')
+    signs = np.array([-1.]*len(reactants) + [1.]*len(products))
+    rest_mass = (species_table.A[ids] * amu * light_speed**2 +
+                 species_table.mass_excess[ids])
+    log_duplicates = (
+        sum(np.log(factorial(count))
+            for count in Counter(reactants).itervalues()) -
+        sum(np.log(factorial(count))
+            for count in Counter(products).itervalues()))
+    log_prefactor = ((len(reactants) - len(products)) * np.log(avogadro) +
+                     1.5 * np.dot(signs, np.log(rest_mass)) +
+                     log_duplicates)
+    qvalue = np.dot(signs, species_table.binding_energy[ids])
+    return DetailedBalance(log_prefactor, qvalue,
+                           len(products) - len(reactants), ids, signs)
+
+
+def rate_table_interpolant(t9, log10_rate):
+    """
+    The rate tabulated as log10_rate on the points t9, as a function of T9
+    (a scalar or an array).  Between the points, log10(rate) is a cubic
+    spline (the same as an interp1d of kind 'cubic'), and it is held
+    constant beyond the ends of the table, so there is no extrapolation.
+    Both the Reactions' rate functions and the RateEngine interpolate the
+    rate tables with this, so they agree.
+    """
+    order = np.argsort(t9)
+    t9 = np.asarray(t9, dtype='float64')[order]
+    log10_rate = np.asarray(log10_rate, dtype='float64')[order]
+    spline = make_interp_spline(t9, log10_rate, k=min(3, len(t9) - 1))
+    t9_min, t9_max = t9[0], t9[-1]
+
+    def _rate(t9):
+        return 10**spline(np.clip(t9, t9_min, t9_max))
+    return _rate
+
+
+def thermal_log_factor(temperature):
+    """
+    (3/2) ln(kT / (2 pi (hbar c)^2)), the temperature dependence of the
+    log of each nucleus' (m kT / (2 pi hbar^2))^(3/2) once its m c^2 is
+    taken out.
+    """
+    return 1.5 * np.log(boltzmann * np.asarray(temperature) /
+                        (2 * np.pi * (planck_bar * light_speed)**2))
+
+
+# bump this whenever the layout of the compiled arrays changes
+_cache_version = 1
 
 
 class WebnucleoDataParser(object):
@@ -20,22 +156,242 @@ class WebnucleoDataParser(object):
     _rxn_data_file = os.path.join(__base_dir,
                                   "data/20141031default.webnucleo.xml")
 
-    # cache the parsing of the data files
-    _nuc_xml_root = None
+    # where the compiled .npz versions of the data files go; None puts
+    # them next to the data files.  Set _use_cache to False to always
+    # parse the XML.
+    _cache_dir = None
+    _use_cache = True
+
+    # reaction files are compiled in parallel, in chunks of at least
+    # _ingest_chunk_size bytes, by _ingest_processes worker processes (None
+    # for one per CPU; 1 to always compile serially)
+    _ingest_processes = None
+    _ingest_chunk_size = 8 << 20
+
+    # the compiled arrays, either loaded from the cache or compiled from
+    # the XML; see also load_subset
+    _nuc_arrays = None
+
+    @property
+    def nuc_arrays(self):
+        if self._nuc_arrays is None:
+            self._nuc_arrays = self._load_arrays(self._nuc_data_file,
+                                                 _compile_nuclides)
+        return self._nuc_arrays
+
+    _rxn_arrays = None
 
     @property
-    def nuc_data_file(self):
-        if self._nuc_xml_root is None:
-            self._nuc_xml_root = etree.parse(self._nuc_data_file)
-        return self._nuc_xml_root
+    def rxn_arrays(self):
+        if self._rxn_arrays is None:
+            self._rxn_arrays = self._load_arrays(
+                self._rxn_data_file, self._compile_reaction_file)
+        return self._rxn_arrays
+
+    def load_subset(self, specs):
+        """
+        Load only the data needed for the reactions of the RxnSpec records
+        specs (see util.rxnfile), in either direction, and their nuclides
+        (along with the proton and neutron, for the binding energies),
+        replacing whatever was loaded before.  The records are taken from
+        the cached arrays if they are valid, and otherwise picked out of
+        the XML in one streaming pass, without caching anything.  Either
+        way, only the subset stays in memory, until something outside of
+        it is looked up: the subset is then dropped, and the full data
+        loaded instead (see _drop_subset).
+        """
+        nuclides = set([(0, 1), (1, 1)])
+        reactions = set()
+        for spec in specs:
+            for species in spec.reactants + spec.products:
+                if is_isotope(species):
+                    nuclides.add(get_Z_A(species))
+            reactions.add(reaction_key(spec.reactants, spec.products))
+            reactions.add(reaction_key(spec.products, spec.reactants))
+
+        arrays = self._cached_arrays(self._nuc_data_file)[0]
+        if arrays is None:
+            with instrument.timer("xml_load"):
+                arrays = _compile_nuclides(self._nuc_data_file, nuclides)
+        else:
+            arrays = _take_rows(arrays, [
+                row for row, key in enumerate(zip(arrays["z"].tolist(),
+                                                  arrays["a"].tolist()))
+                if key in nuclides], _nuc_ragged)
+        self._nuc_arrays = arrays
+
+        arrays = self._cached_arrays(self._rxn_data_file)[0]
+        if arrays is None:
+            with instrument.timer("xml_load"):
+                arrays = self._compile_reaction_file(self._rxn_data_file,
+                                                     reactions)
+        else:
+            arrays = _take_rows(arrays, [
+                row for row, key in enumerate(zip(
+                    arrays["reactants"].tolist(),
+                    arrays["products"].tolist()))
+                if (tuple(key[0].split()), tuple(key[1].split()))
+                in reactions], _rxn_ragged)
+        self._rxn_arrays = arrays
+        self._subset = True
+
+        # everything derived from the arrays
+        self._nuclide_index = None
+        self._reaction_index = None
+        self._proton_mass_excess = None
+        self._neutron_mass_excess = None
+
+    # whether only a subset of the data is loaded
+    _subset = False
+
+    def _drop_subset(self):
+        """
+        If only a subset of the data is loaded (see load_subset), forget it,
+        so that the full data is loaded on next use, and return True;
+        lookups that miss call this, and try again if it did.
+        """
+        if not self._subset:
+            return False
+        self._subset = False
+        self._nuc_arrays = None
+        self._rxn_arrays = None
+        self._nuclide_index = None
+        self._reaction_index = None
+        return True
+
+    def _compile_reaction_file(self, rxn_file, keep=None):
+        """
+        Same as _compile_reactions, but large files are split into chunks
+        of whole <reaction> elements, by byte offset, which are compiled
+        by a pool of worker processes and merged.
+        """
+        processes = self._ingest_processes
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        nchunks = min(4 * processes,
+                      os.path.getsize(rxn_file) // self._ingest_chunk_size)
+        chunks = []
+        if processes > 1 and nchunks > 1:
+            chunks = _reaction_chunks(rxn_file, nchunks)
+        if len(chunks) < 2:
+            return _compile_reactions(rxn_file, keep)
+        pool = multiprocessing.Pool(min(processes, len(chunks)))
+        try:
+            parts = pool.map(_compile_reaction_chunk,
+                             [(rxn_file, start, end, keep)
+                              for start, end in chunks])
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return _concatenate_compiled(parts, _rxn_ragged)
+
+    def _cache_file(self, data_file):
+        cache_dir = self._cache_dir
+        if cache_dir is None:
+            cache_dir = os.path.dirname(data_file)
+        return os.path.join(cache_dir, os.path.basename(data_file) + ".npz")
+
+    def _cached_arrays(self, data_file):
+        """
+        The compiled arrays for data_file from the cache, if it is still
+        valid, or None, along with the data file's SHA-1 hash if it had to
+        be worked out.  The cache is valid if it has the same version and
+        was built from a data file with the same mtime and size, or,
+        failing that, with the same SHA-1 hash (e.g. the data file was
+        touched or copied).
+        """
+        cache_file = self._cache_file(data_file)
+        if not self._use_cache or not os.path.exists(cache_file):
+            return None, None
+        stat = os.stat(data_file)
+        cached = dict(np.load(cache_file))
+        if int(cached.pop("_version")) != _cache_version:
+            return None, None
+        cached_mtime = float(cached.pop("_source_mtime"))
+        cached_size = int(cached.pop("_source_size"))
+        cached_sha1 = str(cached.pop("_source_sha1"))
+        if (cached_mtime == stat.st_mtime and
+                cached_size == stat.st_size):
+            return cached, None
+        sha1 = _file_sha1(data_file)
+        if cached_sha1 == sha1:
+            return cached, sha1
+        return None, sha1
+
+    def _load_arrays(self, data_file, compiler):
+        """
+        Return the compiled arrays for data_file, from the cache if it is
+        still valid (see _cached_arrays).  Otherwise, compiler(data_file)
+        builds the arrays from the XML, and the result is cached for next
+        time.
+        """
+        arrays, sha1 = self._cached_arrays(data_file)
+        if arrays is not None:
+            instrument.count("database_cache_hits")
+            return arrays
+        instrument.count("database_cache_misses")
+        stat = os.stat(data_file)
+        with instrument.timer("xml_load"):
+            arrays = compiler(data_file)
+        if self._use_cache:
+            if sha1 is None:
+                sha1 = _file_sha1(data_file)
+            metadata = {"_version": _cache_version,
+                        "_source_mtime": stat.st_mtime,
+                        "_source_size": stat.st_size,
+                        "_source_sha1": sha1}
+            _write_cache(self._cache_file(data_file), arrays, metadata)
+        return arrays
 
-    _rxn_xml_root = None
+    # one-pass index of the nuclide data, keyed by (Z, A, state)
+    _nuclide_index = None
 
     @property
-    def rxn_data_file(self):
-        if self._rxn_xml_root is None:
-            self._rxn_xml_root = etree.parse(self._rxn_data_file)
-        return self._nuc_xml_root
+    def nuclide_index(self):
+        if self._nuclide_index is None:
+            self._nuclide_index = self._build_nuclide_index()
+        return self._nuclide_index
+
+    def _build_nuclide_index(self):
+        """
+        Build a dict mapping (Z, A, state) to the nuclide's row in the
+        compiled nuclide arrays.  Nuclides without a state (the common case)
+        are stored with state ''.  For nuclides that only come in explicit
+        states (e.g. Al26), the ground state is also stored under '' so
+        plain Z, A lookups still work.
+        """
+        arrays = self.nuc_arrays
+        index = {}
+        ground_states = {}
+        for row, key in enumerate(zip(arrays["z"].tolist(),
+                                      arrays["a"].tolist(),
+                                      arrays["state"].tolist())):
+            if key in index:
+                errString = ("Found multiple entries for nuclide "
+                             "(Z=%d, A=%d, state='%s')" % key)
+                raise RuntimeError(errString)
+            index[key] = row
+            if key[2] == "g":
+                ground_states[key[:2] + ("",)] = row
+        for key, row in ground_states.iteritems():
+            index.setdefault(key, row)
+        return index
+
+    def nuclide_data(self, row):
+        """
+        Returns the NuclideData record for this row of the nuclide arrays.
+        """
+        arrays = self.nuc_arrays
+        lo, hi = arrays["partf_offsets"][row:row+2]
+        return NuclideData(int(arrays["z"][row]), int(arrays["a"][row]),
+                           str(arrays["state"][row]),
+                           float(arrays["mass_excess"][row]),
+                           float(arrays["spin"][row]),
+                           arrays["partf_t9"][lo:hi],
+                           arrays["partf_log10"][lo:hi])
 
     # these are used in calculating binding energies
     _proton_mass_excess = None
@@ -43,9 +399,9 @@ class WebnucleoDataParser(object):
     @property
     def proton_mass_excess(self):
         if self._proton_mass_excess is None:
-            xpath_str = "//nuclide[z=1 and a=1]"
-            proton = self.nuc_data_file.xpath(xpath_str)[0]
-            self._proton_mass_excess = float(proton.find("mass_excess").text)
+            row = self.nuclide_index[(1, 1, "")]
+            self._proton_mass_excess = float(
+                self.nuc_arrays["mass_excess"][row])
         return self._proton_mass_excess
 
     _neutron_mass_excess = None
@@ -53,151 +409,217 @@ class WebnucleoDataParser(object):
     @property
     def neutron_mass_excess(self):
         if self._neutron_mass_excess is None:
-            xpath_str = "//nuclide[z=0 and a=1]"
-            neutron = self.nuc_data_file.xpath(xpath_str)[0]
-            self._neutron_mass_excess = float(neutron.find("mass_excess").text)
+            row = self.nuclide_index[(0, 1, "")]
+            self._neutron_mass_excess = float(
+                self.nuc_arrays["mass_excess"][row])
         return self._neutron_mass_excess
 
     def get_isotope_data(self, isotope):
         """
         Finds and returns a specific isotope within the nuclide data file.
-        The returned object is an etree.Element object.
-        """
-        # find this element in the XML file
-        xpath_str = "//nuclide[z=%d and a=%d]" % (isotope.Z, isotope.A)
-        this_isotope = self.nuc_data_file.xpath(xpath_str)
-        # if we didn't find a single entry, then this is an error
-        if len(this_isotope) != 1:
-            errString = ("Didn't find a proper entry for isotope %s" %
-                         str(isotope))
+        The returned object is a NuclideData record.
+        """
+        return self.find_nuclide(isotope.Z, isotope.A,
+                                 getattr(isotope, "state", ""))
+
+    def find_nuclide(self, Z, A, state=""):
+        """
+        Same as get_isotope_data, but for the nuclide with this Z, A and
+        isomeric state.
+        """
+        try:
+            row = self.nuclide_index[(Z, A, state)]
+        except KeyError:
+            if self._drop_subset():
+                return self.find_nuclide(Z, A, state)
+            errString = ("Didn't find a proper entry for isotope (Z=%d, "
+                         "A=%d, state='%s')" % (Z, A, state))
             raise RuntimeError(errString)
-        return this_isotope[0]
+        return self.nuclide_data(row)
+
+    # one-pass index of the reaction data, keyed by the sorted reactants
+    # and products
+    _reaction_index = None
+
+    @property
+    def reaction_index(self):
+        if self._reaction_index is None:
+            self._reaction_index = self._build_reaction_index()
+        return self._reaction_index
+
+    def _build_reaction_index(self):
+        """
+        Build a dict mapping the canonical (reactants, products) key -- see
+        reaction_key -- to the list of matching rows in the compiled
+        reaction arrays.
+        """
+        arrays = self.rxn_arrays
+        index = {}
+        for row, (reactants, products) in enumerate(
+                zip(arrays["reactants"].tolist(),
+                    arrays["products"].tolist())):
+            key = (tuple(reactants.split()), tuple(products.split()))
+            index.setdefault(key, []).append(row)
+        return index
+
+    def rate_data(self, row):
+        """
+        Returns the RateData record for this row of the reaction arrays.
+        """
+        arrays = self.rxn_arrays
+        rate_type = rate_types[arrays["rate_type"][row]]
+        if rate_type == "non_smoker_fit":
+            lo, hi = arrays["nsf_offsets"][row:row+2]
+            data = arrays["nsf_coeffs"][lo:hi]
+        elif rate_type == "single_rate":
+            data = float(arrays["single_rate"][row])
+        else:
+            lo, hi = arrays["table_offsets"][row:row+2]
+            data = (arrays["table_t9"][lo:hi], arrays["table_rate"][lo:hi],
+                    arrays["table_sef"][lo:hi])
+        return RateData(tuple(arrays["reactants"][row].split()),
+                        tuple(arrays["products"][row].split()),
+                        str(arrays["source"][row]), rate_type, data)
+
+    def find_reactions(self, reactants, products):
+        """
+        Returns the list of RateData records with exactly these reactants
+        and products; the list is empty if there are none.
+        """
+        return [self.rate_data(row) for row in
+                self.reaction_index.get(reaction_key(reactants, products),
+                                        [])]
 
     def get_rate_data(self, reaction):
         """
         Finds and returns a specific reaction rate within the data file.
-        The returned object is an etree.Element object.
+        The returned object is a RateData record.
+        """
+        with instrument.timer("lookup"):
+            rate_data, reaction.is_reverse = self._find_rate_data(
+                reaction.rxnString, reaction.reactants, reaction.products)
+        return rate_data
+
+    def get_rate_data_batch(self, specs):
+        """
+        Same as get_rate_data, but for a whole list of reactions at once,
+        given as RxnSpec records (see util.rxnfile).  Returns the list of
+        RateData records; the ones stored as the reverse reaction have the
+        spec's products as their reactants.  Every reaction that isn't
+        found, or is ambiguous, is reported in a single RuntimeError.
+        """
+        found, errors = [], []
+        with instrument.timer("lookup"):
+            for spec in specs:
+                try:
+                    found.append(self._find_rate_data(spec.rxnString,
+                                                      spec.reactants,
+                                                      spec.products)[0])
+                except RuntimeError as err:
+                    errors.append(str(err))
+        if errors:
+            raise RuntimeError("\n".join(errors))
+        return found
+
+    def _find_rate_data(self, rxnString, reactants, products):
+        """
+        The RateData record for these reactants and products, and whether
+        it is stored as the reverse reaction.
         """
-        # find this reaction in the XML file
-        xpath_str = _build_rxn_xpath_search(reaction.reactants,
-                                            reaction.products)
-        this_reaction = self.rxn_data_file.xpath(xpath_str)
+        instrument.count("lookups")
+        is_reverse = False
+        this_reaction = self.find_reactions(reactants, products)
         # if we didn't find anything, then this is a reverse rate
         if not this_reaction:
-            reaction.is_reverse = True
+            is_reverse = True
             # swap the reactants and products and re-search
-            xpath_str = _build_rxn_xpath_search(reaction.products,
-                                                reaction.reactants)
-            this_reaction = self.rxn_data_file.xpath(xpath_str)
-            # now if THIS is empty, we have an error
+            this_reaction = self.find_reactions(products, reactants)
+            # now if THIS is empty, we have an error, unless the data is
+            # just a subset
             if not this_reaction:
+                if self._drop_subset():
+                    return self._find_rate_data(rxnString, reactants,
+                                                products)
                 errString = "Couldn't find either a forward or reverse"
-                errString += " rate for\n %s" % reaction.rxnString
+                errString += " rate for\n %s" % rxnString
                 raise RuntimeError(errString)
-        return this_reaction[0]
+        # ambiguous matches are reported all at once
+        if len(this_reaction) > 1:
+            errString = ("Found %d rates for %s:" %
+                         (len(this_reaction), rxnString))
+            for rxn in this_reaction:
+                errString += "\n  source: %s" % rxn.source
+            raise RuntimeError(errString)
+        return this_reaction[0], is_reverse
 
-    def build_non_smoker_rate(self, reaction, reaction_xml):
+    def build_non_smoker_rate(self, reaction, rate_data):
         """
         This reaction's data is stored as a non-smoker fit in the 
-        reaction_xml data.  The units are rate per interaction pair or 
-        multiplet per second.  Parse it and build the forward rate function.
+        rate_data record.  The units are rate per interaction pair or 
+        multiplet per second.  Build the forward rate function.
         """
         # TODO -- honor min/max temperatures
-        aList = ["a%s" % i+1 for i in range(7)]
-        aFactors = {}
-        for a in aList:
-            aFactors[a] = map(float, [a_val.text for a_val in
-                                      reaction_xml.xpath('.//%s' % a)])
-        aFacs = np.array(zip(*[aFactors[a] for a in aList]))
-        
+        aFacs = rate_data.data
+
         def _forward_rate_function(reaction, temperature):
-            t9 = temperature / 1e9
-            t9i = 1./t9
-            tfactors = np.array([1.0,
-                                 t9i, t9i**(1./3.),
-                                 t9**(1./3.), t9, t9**(5./3.),
-                                 np.log10(t9)], dtype='float64')
-            rate = np.exp(aFacs * tfactors)
-            return np.sum(rate)
+            tfactors = temperature_factors(temperature)
+            # sum over the (resonant, non-resonant, ...) sets
+            rate = np.exp(np.tensordot(aFacs, tfactors, axes=1))
+            return np.sum(rate, axis=0)
         reaction.forward_rate = _forward_rate_function
 
-    def build_single_rate(self, reaction, reaction_xml):
+    def build_single_rate(self, reaction, rate_data):
         """
-        This reaction's data is stored as a single rate in the reaction_xml
-        data.  The units are rate per nuclide per second. Parse it and build 
-        the forward rate function.
+        This reaction's data is stored as a single rate in the rate_data
+        record.  The units are rate per nuclide per second.  Build the
+        forward rate function.
         """
-        single_rate = float(reaction_xml.xpath(".//single_rate")[0].text)
+        single_rate = rate_data.data
         def _forward_rate_function(reaction, temperature):
-            return single_rate
+            return single_rate * np.ones_like(temperature, dtype='float64')
         reaction.forward_rate = _forward_rate_function
 
-    def build_rate_table_rate(self, reaction, reaction_xml):
+    def build_rate_table_rate(self, reaction, rate_data):
         """
         This reaction's data is stored in a table of (t9, rate) pairs.  The
-        units are rate per interaction pair or multiplet per second.  Parse
-        it and build the forward rate function.
+        units are rate per interaction pair or multiplet per second.  Build
+        the forward rate function.
         """
-        rtable = reaction_xml.find("rate_table")
-        rt9 = map(float, [t9.text for t9 in rtable.xpath("point/t9")])
-        rrate = map(np.log10, [rate.text
-                               for rate in rtable.xpath("point/rate")])
+        rt9, rrate, rsef = rate_data.data
         # stellar enhancement factor; accounts for excited states
-        rsef = map(np.log10, [sef.text
-                              for sef in rtable.xpath("point/sef")])
         # this is the total rate
-        rtotal = [rate + sef for rate, sef in zip(rrate, rsef)]
-        mint9 = min(rt9)
-        maxt9 = max(rt9)
-        # now the fit
-        rfit = interp1d(rt9, rtotal, kind='cubic')
+        rfit = rate_table_interpolant(rt9, np.log10(rrate) + np.log10(rsef))
         def _forward_rate_function(reaction, temperature):
-            t9 = temperature / 1e9
-            # no extrapolation
-            t9 = min(maxt9, max(mint9, t9))
-            return 10**rfit(t9)
+            return rfit(np.asarray(temperature) / 1e9)
         reaction.forward_rate = _forward_rate_function
 
     def build_reverse_rate_function(self, reaction):
         """
         Build a function that calculates the reverse rate factor from detailed
         balance.  This factor is multiplied by the forward rate to get the
-        total rate.
+        total rate.  Like the forward rate functions, it works on scalars
+        or on arrays of temperatures and densities.
         """
         # first, if this isn't a reverse reaction, then the multiplicative
         # factor is just unity
         if not reaction.is_reverse:
-            return lambda temperature, density: 1.0
+            return lambda rxn, temperature, density: 1.0
         # if the forward reaction is weak, then this is not reversible
         if reaction.is_weak:
-            return lambda temperature, density: 0.0
+            return lambda rxn, temperature, density: 0.0
         # bonafide, non-weak reverse reaction
+        from ..isotope import species_table
+        constants = detailed_balance_constants(reaction.isotope_reactants,
+                                               reaction.isotope_products)
+
         def _reverse_factor(rxn, temperature, density):
-            # common factors
-            factor1 = 1. / (boltzmann * temperature)
-            factor2 = (1. /
-                       (factor1 * 2 *  np.pi *
-                        (planck_bar * light_speed)**2))**(3./2.)
-            factor3 = 1. / (avogadro * density)
-            # density weighting
-            dexp = (len(rxn.isotope_reactants)
-                    - len(rxn.isotope_products)) * np.log(density)
-            # reactants
-            dexp += np.sum([np.log(iso.partition_function(temperature) *
-                                   factor2 * factor3 *
-                                   (iso.A * amu * light_speed**2 +
-                                    iso.mass_excess)**(3./2.))
-                            + iso.binding_energy * factor1 for iso in
-                            rxn.isotope_reactants])
-            # products
-            dexp -= np.sum([np.log(iso.partition_function(temperature) *
-                                   factor2 * factor3 *
-                                   (iso.A * amu * light_speed**2 +
-                                    iso.mass_excess)**(3./2.))
-                            + iso.binding_energy * factor1 for iso in
-                            rxn.isotope_products])
-            # TODO -- account for duplicate reactants/products
-            return np.exp(dexp)
+            temperature = np.asarray(temperature, dtype='float64')
+            log_partf = np.log(species_table.partition_functions(
+                temperature, constants.ids))
+            return np.exp(constants.log_prefactor +
+                          constants.dn * thermal_log_factor(temperature) +
+                          constants.qvalue / (boltzmann * temperature) +
+                          np.dot(log_partf, constants.signs))
 
         return _reverse_factor
 
@@ -205,11 +627,285 @@ class WebnucleoDataParser(object):
 webnucleo = WebnucleoDataParser()
 
 
-def _build_rxn_xpath_search(reactants, products):
+def _iter_elements(data_file, tag):
+    """
+    Stream the tag elements of the XML file data_file.  Each element is
+    cleared, and dropped from its parent, once it has been handled, so the
+    tree never builds up in memory.
+    """
+    for event, element in etree.iterparse(data_file, events=("end",),
+                                          tag=tag):
+        yield element
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def _compile_nuclides(nuc_file, keep=None):
+    """
+    Flatten the nuclide XML file into a dict of arrays, in one streaming
+    pass.  Partition function tables are concatenated into
+    partf_t9/partf_log10, with nuclide i's table in [partf_offsets[i],
+    partf_offsets[i+1]).  If keep is given, only the nuclides whose (Z, A)
+    are in it are kept.
+    """
+    z, a, state, mass_excess, spin = [], [], [], [], []
+    partf_offsets, partf_t9, partf_log10 = [0], [], []
+    for nuclide in _iter_elements(nuc_file, "nuclide"):
+        Z, A = int(nuclide.findtext("z")), int(nuclide.findtext("a"))
+        if keep is not None and (Z, A) not in keep:
+            continue
+        z.append(Z)
+        a.append(A)
+        state.append(_nuclide_state(nuclide))
+        mass_excess.append(float(nuclide.findtext("mass_excess")))
+        spin.append(float(nuclide.findtext("spin")))
+        ptable = nuclide.find("partf_table")
+        if ptable is not None:
+            # (t9, log10(f)) pairs, where f is related to the partition
+            # function -- see Webnucleo documentation
+            for point in ptable.iter("point"):
+                partf_t9.append(float(point.findtext("t9")))
+                partf_log10.append(float(point.findtext("log10_partf")))
+        partf_offsets.append(len(partf_t9))
+    return {"z": np.array(z, dtype='int32'),
+            "a": np.array(a, dtype='int32'),
+            "state": np.array(state, dtype='S'),
+            "mass_excess": np.array(mass_excess, dtype='float64'),
+            "spin": np.array(spin, dtype='float64'),
+            "partf_offsets": np.array(partf_offsets, dtype='int64'),
+            "partf_t9": np.array(partf_t9, dtype='float64'),
+            "partf_log10": np.array(partf_log10, dtype='float64')}
+
+
+def _compile_reactions(rxn_file, keep=None):
+    """
+    Flatten the reaction XML file into a dict of arrays, in one streaming
+    pass.  The reactants and products are stored as space-separated
+    canonical names (see reaction_key), and the rate data by rate_type (an
+    index into rate_types): non-smoker fits as rows of nsf_coeffs, single
+    rates in single_rate, and rate tables concatenated into table_t9/
+    table_rate/table_sef, each indexed by the corresponding *_offsets
+    array.  If keep is given, only the reactions whose reaction_key is in
+    it are kept.
+    """
+    reactants, products, source, rate_type = [], [], [], []
+    nsf_offsets, nsf_coeffs = [0], []
+    single_rate = []
+    table_offsets, table_t9, table_rate, table_sef = [0], [], [], []
+    for reaction in _iter_elements(rxn_file, "reaction"):
+        key = reaction_key([r.text for r in reaction.iter("reactant")],
+                           [p.text for p in reaction.iter("product")])
+        if keep is not None and key not in keep:
+            continue
+        reactants.append(" ".join(key[0]))
+        products.append(" ".join(key[1]))
+        source.append(reaction.findtext("source", default=""))
+        single = np.nan
+        if reaction.find("non_smoker_fit") is not None:
+            rate_type.append(rate_types.index("non_smoker_fit"))
+            for fit in reaction.find("non_smoker_fit").iter("fit"):
+                nsf_coeffs.append([float(fit.findtext("a%d" % (i+1)))
+                                   for i in range(7)])
+        elif reaction.find("single_rate") is not None:
+            rate_type.append(rate_types.index("single_rate"))
+            single = float(reaction.findtext("single_rate"))
+        elif reaction.find("rate_table") is not None:
+            rate_type.append(rate_types.index("rate_table"))
+            for point in reaction.find("rate_table").iter("point"):
+                table_t9.append(float(point.findtext("t9")))
+                table_rate.append(float(point.findtext("rate")))
+                table_sef.append(float(point.findtext("sef", default="1")))
+        else:
+            errString = ("Unknown rate data format for reaction %s -> %s" %
+                         (reactants[-1], products[-1]))
+            raise RuntimeError(errString)
+        nsf_offsets.append(len(nsf_coeffs))
+        single_rate.append(single)
+        table_offsets.append(len(table_t9))
+    return {"reactants": np.array(reactants, dtype='S'),
+            "products": np.array(products, dtype='S'),
+            "source": np.array(source, dtype='S'),
+            "rate_type": np.array(rate_type, dtype='int8'),
+            "nsf_offsets": np.array(nsf_offsets, dtype='int64'),
+            "nsf_coeffs": np.array(nsf_coeffs,
+                                   dtype='float64').reshape(-1, 7),
+            "single_rate": np.array(single_rate, dtype='float64'),
+            "table_offsets": np.array(table_offsets, dtype='int64'),
+            "table_t9": np.array(table_t9, dtype='float64'),
+            "table_rate": np.array(table_rate, dtype='float64'),
+            "table_sef": np.array(table_sef, dtype='float64')}
+
+# the start of a <reaction> element, but not of <reactant> or <reactions>
+_reaction_start = re.compile(br"<reaction[\s>]")
+_reaction_end = b"</reaction>"
+
+
+def _reaction_chunks(rxn_file, nchunks, blocksize=1 << 20):
+    """
+    Split the reaction XML file rxn_file into at most nchunks (start, end)
+    byte ranges of about the same size, each a run of whole <reaction>
+    elements, and together covering all of them.  The chunks start at the
+    first <reaction> after each of the evenly spaced offsets.
+    """
+    size = os.path.getsize(rxn_file)
+    starts = []
+    with open(rxn_file, 'rb') as f:
+        for i in range(nchunks):
+            start = _find_forward(f, size * i // nchunks, blocksize)
+            if start is None:
+                break
+            if not starts or start > starts[-1]:
+                starts.append(start)
+        if not starts:
+            return []
+        # the chunks end where the next begins, and the last one after the
+        # last </reaction>
+        end = None
+        position = size
+        while end is None and position > starts[-1]:
+            block_start = max(starts[-1], position - blocksize)
+            f.seek(block_start)
+            # overlap the blocks, for a tag split across them
+            block = f.read(position - block_start + len(_reaction_end) - 1)
+            found = block.rfind(_reaction_end)
+            if found >= 0:
+                end = block_start + found + len(_reaction_end)
+            position = block_start
+    if end is None:
+        return []
+    return zip(starts, starts[1:] + [end])
+
+
+def _find_forward(f, position, blocksize):
+    """
+    The byte offset of the first <reaction> at or after position in the
+    open file f, or None if there isn't one.
+    """
+    overlap = len("<reaction ") - 1
+    while True:
+        f.seek(position)
+        block = f.read(blocksize + overlap)
+        match = _reaction_start.search(block)
+        if match is not None:
+            return position + match.start()
+        if len(block) <= overlap:
+            return None
+        position += blocksize
+
+
+def _compile_reaction_chunk(args):
+    """
+    _compile_reactions for the bytes start:end of rxn_file, a run of whole
+    <reaction> elements; for the worker processes of
+    WebnucleoDataParser._compile_reaction_file.
+    """
+    rxn_file, start, end, keep = args
+    with open(rxn_file, 'rb') as f:
+        f.seek(start)
+        chunk = f.read(end - start)
+    return _compile_reactions(io.BytesIO(b"<reactions>" + chunk +
+                                         b"</reactions>"), keep)
+
+
+def _concatenate_compiled(parts, ragged):
+    """
+    Merge the dicts of compiled arrays parts, in order, into one; ragged
+    is as for _take_rows.
+    """
+    merged = {}
+    for name in parts[0]:
+        if name in ragged:
+            shifts = np.cumsum([0] + [part[name][-1] for part in parts])
+            merged[name] = np.concatenate(
+                [parts[0][name][:1]] +
+                [part[name][1:] + shift
+                 for part, shift in zip(parts, shifts)])
+        else:
+            merged[name] = np.concatenate([part[name] for part in parts])
+    return merged
+
+# the ragged arrays of the compiled nuclides and reactions, by the offsets
+# arrays that index them
+_nuc_ragged = {"partf_offsets": ["partf_t9", "partf_log10"]}
+_rxn_ragged = {"nsf_offsets": ["nsf_coeffs"],
+               "table_offsets": ["table_t9", "table_rate", "table_sef"]}
+
+
+def _take_rows(arrays, rows, ragged):
+    """
+    The compiled arrays cut down to these rows (in order); ragged maps
+    each offsets array to the arrays it indexes.
+    """
+    rows = np.asarray(rows, dtype='int')
+    subset = {}
+    for name, array in arrays.iteritems():
+        if name not in ragged and not any(name in members for members in
+                                           ragged.itervalues()):
+            subset[name] = array[rows]
+    for offsets_name, members in ragged.iteritems():
+        offsets = arrays[offsets_name]
+        starts, ends = offsets[rows], offsets[rows + 1]
+        subset[offsets_name] = np.concatenate(
+            [[0], np.cumsum(ends - starts)]).astype('int64')
+        points = np.concatenate([np.zeros(0, dtype='int')] +
+                                [np.arange(start, end) for start, end in
+                                 zip(starts, ends)])
+        for name in members:
+            subset[name] = arrays[name][points]
+    return subset
+
+
+def _file_sha1(filename, blocksize=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _write_cache(cache_file, arrays, metadata):
+    """
+    Write the compiled arrays to cache_file.  This goes through a temporary
+    file, so a concurrent reader never sees a partial cache.  Failing to
+    write the cache (e.g. a read-only data directory) is not an error.
+    """
+    contents = dict(arrays)
+    contents.update(metadata)
+    try:
+        fd, tmp_file = tempfile.mkstemp(suffix=".npz",
+                                        dir=os.path.dirname(cache_file))
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **contents)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError):
+        os.remove(tmp_file)
+
+
+def _nuclide_state(nuclide):
+    """
+    Webnucleo marks isomeric states either as a 'state' attribute or as a
+    <state> child of the nuclide; return '' if there is no state.
+    """
+    state = nuclide.get("state")
+    if state is None:
+        state = nuclide.findtext("state", default="")
+    return state.strip()
+
+
+def reaction_key(reactants, products):
     """
-    Helper function for searching for forward/reverse rates within an XML file.
+    Canonical, hashable key for a reaction: the sorted multiset of
+    (lower-cased, Webnucleo-named) reactants and of products.  Compound
+    species such as 'He4 + He4' are split into their parts, so duplicate
+    reactants/products are counted properly.
     """
-    xpath_str = "//reaction[%s]"
-    reacts = ["reactant='%s'" % reactant.lower() for reactant in reactants]
-    prods = ["product='%s'" % product.lower() for product in products]
-    return xpath_str % ' and '.join(reacts + prods)
+    def _canonical(species):
+        flat = []
+        for spec in species:
+            flat.extend(part.strip().lower() for part in spec.split(PLUS))
+        return tuple(sorted(flat))
+    return _canonical(reactants), _canonical(products)
@@ -0,0 +1,124 @@
+"""
+Burning the many independent zones of a hydro grid, timestep after
+timestep, with a pool of worker processes that lasts as long as the
+ZoneBurner does.  Starting the workers, and compiling the Network for
+them to share, is paid for once rather than on every timestep:
+
+    burner = network.zone_burner(processes=4)
+    for step in range(nsteps):
+        Y = burner.burn(Y, temperature, density, dt)
+        ...
+    burner.close()
+
+The workers all attach to one memory-mapped CompiledNetwork (see
+compiled.py), so each holds only its own integrator.  With a single
+process, the zones are burned in a loop in this process, with no pool at
+all.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from compiled import CompiledNetwork
+import integrators
+
+
+class ZoneBurner(object):
+    def __init__(self, network, method="bdf", processes=None,
+                 compiled_path=None, **options):
+        """
+        Burn zones of the Network network with the integrator method, and
+        its options (as for Network.burn), on a pool of processes worker
+        processes (default: one per CPU).  The workers share the
+        CompiledNetwork already saved at compiled_path or, by default, one
+        compiled from network into a temporary directory (on /dev/shm,
+        where available), which is removed by close.
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = max(1, processes)
+        self._tmp_dir = None
+        self._pool = None
+        if self.processes == 1:
+            self._integrator = integrators.methods[method](network,
+                                                           **options)
+            return
+        if compiled_path is None:
+            self._tmp_dir = tempfile.mkdtemp(
+                prefix="brulilo-",
+                dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+            compiled_path = os.path.join(self._tmp_dir, "network")
+            network.compile().save(compiled_path)
+        self._pool = multiprocessing.Pool(self.processes,
+                                          initializer=_init_zone_worker,
+                                          initargs=(compiled_path, method,
+                                                    options))
+
+    def burn(self, Y0, temperature, density, dt, chunksize=None):
+        """
+        Burn the zones for a time dt.  Y0 is a (zones, species) array of
+        molar abundances, and temperature and density are arrays with one
+        value per zone (or scalars, shared by all zones).  Returns the
+        (zones, species) final abundances, in zone order.  The zones are
+        handed out to the workers chunksize at a time (default: about four
+        chunks per worker, to even out zones that burn more slowly).
+        """
+        Y0 = np.atleast_2d(np.asarray(Y0, dtype='float64'))
+        nzones = Y0.shape[0]
+        temperature = np.broadcast_to(np.asarray(temperature,
+                                                 dtype='float64'), (nzones,))
+        density = np.broadcast_to(np.asarray(density, dtype='float64'),
+                                  (nzones,))
+        if self._pool is None:
+            if self.processes > 1:
+                raise RuntimeError("This ZoneBurner has been closed")
+            return np.array([self._integrator.integrate(Y, T, rho, dt)
+                             for Y, T, rho in zip(Y0, temperature, density)]
+                            ).reshape(Y0.shape)
+        if chunksize is None:
+            chunksize = max(1, nzones // (4 * self.processes))
+        zones = [(Y, T, rho, dt) for Y, T, rho in zip(Y0, temperature,
+                                                        density)]
+        # imap keeps the results in zone order
+        return np.array(list(self._pool.imap(_burn_zone, zones, chunksize))
+                        ).reshape(Y0.shape)
+
+    def close(self):
+        """
+        Stop the worker processes, and remove the temporary
+        CompiledNetwork, if there is one.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is not None and self._pool is not None:
+            self._pool.terminate()
+        self.close()
+        return False
+
+
+# the Integrator of a ZoneBurner worker process, on the CompiledNetwork
+# attached to once by _init_zone_worker
+_zone_integrator = None
+
+
+def _init_zone_worker(compiled_path, method, options):
+    global _zone_integrator
+    network = CompiledNetwork.load(compiled_path)
+    _zone_integrator = integrators.methods[method](network, **options)
+
+
+def _burn_zone(zone):
+    Y0, temperature, density, dt = zone
+    return _zone_integrator.integrate(Y0, temperature, density, dt)
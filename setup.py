@@ -6,7 +6,7 @@ setup(name='brulilo',
       url='http://bitbucket.org/ChrisMalone/brulilo',
       author='Chris Malone',
       author_email='chris.m.malone@gmail.com',
-      packages=['brulilo'],
+      packages=['brulilo', 'brulilo.integrators'],
       install_requires=[
           'numpy',
           'matplotlib',